@@ -0,0 +1,169 @@
+"""Columnar transaction loading for reports.
+
+Rows are read straight from the cursor into typed pandas columns, skipping
+the list of dicts that get_transactions() builds for the UI.
+"""
+import pandas as pd
+
+from migrations import shipped_query
+from money import DEFAULT_EXPONENT
+from shards import managers_for
+
+FETCH_SIZE = 5000
+
+# Frame column -> SQL expressions it is built from.
+SOURCE_COLUMNS = {
+    'id': ('id',),
+    'user_id': ('user_id',),
+    'type': ('type',),
+    'category': ('category',),
+    'currency': ('currency',),
+    'amount_minor': ('amount_minor',),
+    'currency_exponent': (f'COALESCE(currency_exponent, {DEFAULT_EXPONENT})',),
+    'amount': ('amount_minor', f'COALESCE(currency_exponent, {DEFAULT_EXPONENT})'),
+    'date': ('date_day',),
+}
+
+CATEGORICAL_COLUMNS = ('type', 'category', 'currency')
+
+# Filter name -> indexed predicate. A value of None leaves the filter off.
+FILTERS = {
+    'start_day': 'date_day >= ?',
+    'end_day': 'date_day < ?',
+    'type': 'type = ?',
+    'category': 'category = ?',
+    'currency': 'currency = ?',
+}
+
+DEFAULT_COLUMNS = ('id', 'type', 'amount', 'amount_minor', 'currency_exponent', 'category', 'date', 'currency')
+
+
+def source_columns(columns):
+    """SQL expressions the frame ``columns`` are built from, each once."""
+    sources = []
+    for name in columns:
+        for expression in SOURCE_COLUMNS[name]:
+            if expression not in sources:
+                sources.append(expression)
+    return sources
+
+
+@shipped_query('report frame for user', 1, source_columns(DEFAULT_COLUMNS),
+               {'start_day': 19723, 'end_day': 20089, 'category': 'Food'})
+def transactions_frame_query(user_id, sources, filters, is_admin=False):
+    """``(sql, params)`` selecting ``sources`` for load_transactions_frame()."""
+    conditions, params = ['amount_minor IS NOT NULL'], []
+    if not is_admin:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    for name, value in filters.items():
+        if value is not None:
+            conditions.append(FILTERS[name])
+            params.append(value)
+    return f"SELECT {', '.join(sources)} FROM transactions WHERE {' AND '.join(conditions)}", params
+
+
+def load_transactions_frame(user_id, columns=DEFAULT_COLUMNS, filters=None, is_admin=False):
+    """Load transactions into a typed DataFrame.
+
+    ``columns`` picks the frame columns (see SOURCE_COLUMNS) and only the SQL
+    columns they need are selected. ``filters`` maps names from FILTERS to
+    values and is applied in the WHERE clause. type, category and currency
+    come back categorical, date as datetime64 (NaT for rows without a valid
+    day), ids and minor units as int64 and amount as float64 major units.
+    Rows without minor-unit amounts are skipped, as in money.minor_frame().
+    """
+    unknown = [name for name in columns if name not in SOURCE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown transaction columns: {', '.join(unknown)}")
+    filters = filters or {}
+    unknown = [name for name in filters if name not in FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown transaction filters: {', '.join(unknown)}")
+
+    sources = source_columns(columns)
+    query, params = transactions_frame_query(user_id, sources, filters, is_admin)
+
+    values = [[] for _ in sources]
+    for manager in managers_for(user_id, is_admin):
+        with manager.reader() as c:
+            c.execute(query, params)
+            while True:
+                rows = c.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for column, chunk in zip(values, zip(*rows)):
+                    column.extend(chunk)
+    data = dict(zip(sources, values))
+
+    frame = {}
+    exponent_source = SOURCE_COLUMNS['currency_exponent'][0]
+    for name in columns:
+        if name == 'amount':
+            minor = pd.Series(data['amount_minor'], dtype='int64')
+            exponent = pd.Series(data[exponent_source], dtype='int64')
+            frame[name] = minor / (10.0 ** exponent)
+        elif name == 'date':
+            days = pd.Series(data['date_day'], dtype='float64')
+            frame[name] = pd.to_datetime(days, unit='D')
+        elif name in CATEGORICAL_COLUMNS:
+            frame[name] = pd.Categorical(data[name])
+        else:
+            frame[name] = pd.Series(data[SOURCE_COLUMNS[name][0]], dtype='int64')
+    return pd.DataFrame(frame, columns=list(columns))
+
+
+# Filter name -> predicate on monthly_rollups. Months are 'YYYY-MM' text.
+ROLLUP_FILTERS = {
+    'start_month': 'month >= ?',
+    'end_month': 'month < ?',
+    'type': 'type = ?',
+    'category': 'category = ?',
+    'currency': 'currency = ?',
+}
+
+
+@shipped_query('monthly rollups for user', 1, {'start_month': '2024-01', 'end_month': '2025-01'})
+def monthly_rollups_query(user_id, filters, is_admin=False):
+    """``(sql, params)`` for load_monthly_rollups_frame()."""
+    conditions, params = [], []
+    if not is_admin:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    for name, value in filters.items():
+        if value is not None:
+            conditions.append(ROLLUP_FILTERS[name])
+            params.append(value)
+    query = 'SELECT month, type, category, currency, currency_exponent, total, count FROM monthly_rollups'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return query, params
+
+
+def load_monthly_rollups_frame(user_id, filters=None, is_admin=False):
+    """Load monthly rollups as a frame shaped like load_transactions_frame().
+
+    Each row is one (month, type, category, currency) bucket; date is the
+    first day of the month, amount_minor the bucket total and count the
+    number of transactions in it. money.sum_minor() works on it unchanged.
+    """
+    filters = filters or {}
+    unknown = [name for name in filters if name not in ROLLUP_FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown rollup filters: {', '.join(unknown)}")
+    query, params = monthly_rollups_query(user_id, filters, is_admin)
+    rows = []
+    for manager in managers_for(user_id, is_admin):
+        with manager.reader() as c:
+            c.execute(query, params)
+            rows.extend(c.fetchall())
+    month, trans_type, category, currency, exponent, total, count = zip(*rows) if rows else ((),) * 7
+    return pd.DataFrame({
+        'date': pd.to_datetime(pd.Series(month, dtype='object'), format='%Y-%m'),
+        'type': pd.Categorical(trans_type),
+        'category': pd.Categorical(category),
+        'currency': pd.Categorical(currency),
+        'amount_minor': pd.Series(total, dtype='int64'),
+        'currency_exponent': pd.Series(exponent, dtype='int64'),
+        'count': pd.Series(count, dtype='int64'),
+    })
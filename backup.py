@@ -0,0 +1,269 @@
+"""Online backups through the SQLite backup API.
+
+Pages are copied a few at a time from a consistent snapshot of the live
+database, so the app keeps reading and writing while a backup runs. Each
+backup is checked with ``PRAGMA quick_check``, optionally gzipped, and kept
+as a timestamped generation; the oldest generations beyond ``keep`` are
+deleted.
+
+Unsharded, a generation is a single file. With sharding on it is a folder
+holding the directory database and every shard file, written, rotated and
+restored as one unit so ``users`` and the ledgers stay in step.
+"""
+import datetime
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from connection import get_manager
+from shards import clear_ledger, get_router, shard_file_index
+
+BACKUP_DIR = 'backups'
+BACKUP_PREFIX = 'finance_backup'
+DEFAULT_PAGES_PER_STEP = 256
+DEFAULT_GENERATIONS = 7
+# Name of the directory database inside a sharded generation.
+DIRECTORY_FILE = 'directory.db'
+
+
+def quick_check(conn):
+    """Raise RuntimeError unless ``PRAGMA quick_check`` reports ok."""
+    problems = [row[0] for row in conn.execute('PRAGMA quick_check').fetchall()]
+    if problems != ['ok']:
+        raise RuntimeError(f"Backup failed integrity check: {'; '.join(problems[:5])}")
+
+
+def list_generations(directory=BACKUP_DIR):
+    """Backup generations (files and sharded folders) in ``directory``, oldest first."""
+    paths = glob.glob(os.path.join(directory, f'{BACKUP_PREFIX}_*.db'))
+    paths += glob.glob(os.path.join(directory, f'{BACKUP_PREFIX}_*.db.gz'))
+    paths += [path for path in glob.glob(os.path.join(directory, f'{BACKUP_PREFIX}_*'))
+              if os.path.isdir(path) and not path.endswith('.partial')]
+    return sorted(paths, key=os.path.basename)
+
+
+def rotate_generations(directory=BACKUP_DIR, keep=DEFAULT_GENERATIONS):
+    """Delete all but the newest ``keep`` generations; returns the deleted paths."""
+    generations = list_generations(directory)
+    expired = generations[:-keep] if keep > 0 else generations
+    for path in expired:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    return expired
+
+
+def _copy_database(manager, path, pages, compress, progress):
+    """Copy ``manager``'s database to ``path``, verified and optionally gzipped; returns the path written."""
+    partial = path + '.partial'
+
+    def report(status, remaining, total):
+        if progress is not None:
+            progress(total - remaining, total)
+
+    source = manager.open_connection()
+    target = sqlite3.connect(partial)
+    try:
+        # Holding a read transaction pins one WAL snapshot, so commits made
+        # while the copy runs neither block it nor force it to restart.
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(target, pages=pages, progress=report)
+        quick_check(target)
+    except BaseException:
+        target.close()
+        os.remove(partial)
+        raise
+    finally:
+        source.close()
+    target.close()
+
+    if compress:
+        with open(partial, 'rb') as raw, gzip.open(path + '.gz', 'wb') as packed:
+            shutil.copyfileobj(raw, packed)
+        os.remove(partial)
+        path += '.gz'
+    else:
+        os.replace(partial, path)
+    return path
+
+
+def backup_database(directory=BACKUP_DIR, pages=DEFAULT_PAGES_PER_STEP, compress=False,
+                    keep=DEFAULT_GENERATIONS, progress=None, manager=None):
+    """Write a new backup generation and return its path.
+
+    ``progress(copied, total)`` is called after every step of ``pages``
+    pages. Each copy is verified before it is compressed or kept. With
+    sharding on (and no ``manager`` given) the generation is a folder of
+    the directory database and every shard file; each file is copied from
+    its own snapshot, and the folder only appears once all are written.
+    """
+    router = get_router() if manager is None else None
+    manager = manager or get_manager()
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    if router is None:
+        path = _copy_database(manager, os.path.join(directory, f'{BACKUP_PREFIX}_{stamp}.db'),
+                              pages, compress, progress)
+    else:
+        path = os.path.join(directory, f'{BACKUP_PREFIX}_{stamp}')
+        partial = path + '.partial'
+        indexes = router.indexes()
+        count = len(indexes) + 1
+
+        def step(done):
+            # Scale each file's pages into its share of the whole generation.
+            if progress is None:
+                return None
+            return lambda copied, total: progress(done * total + copied, count * total)
+
+        os.makedirs(partial)
+        try:
+            _copy_database(manager, os.path.join(partial, DIRECTORY_FILE), pages, compress, step(0))
+            for done, index in enumerate(indexes, 1):
+                shard = router.manager(index)
+                _copy_database(shard, os.path.join(partial, os.path.basename(shard.path)), pages, compress, step(done))
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        os.replace(partial, path)
+        router.trim()
+    rotate_generations(directory, keep)
+    logging.info(f"Database backup written to {path}")
+    return path
+
+
+class BackupJob:
+    """Runs backup_database() on a background thread.
+
+    The Tk thread polls ``progress``, ``done``, ``path`` and ``error``
+    instead of waiting on the thread.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.progress = 0.0
+        self.path = None
+        self.error = None
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _update(self, copied, total):
+        self.progress = copied / total if total else 1.0
+
+    def _run(self):
+        try:
+            self.path = backup_database(progress=self._update, **self.options)
+            self.progress = 1.0
+        except Exception as e:
+            logging.error(f"Database backup failed: {e}")
+            self.error = e
+        finally:
+            self.done.set()
+
+
+def _generation_files(path):
+    """``(directory file, {shard index: file})`` of a generation."""
+    if not os.path.isdir(path):
+        return path, {}
+    directory_file = None
+    shard_files = {}
+    for name in os.listdir(path):
+        plain = name[:-len('.gz')] if name.endswith('.gz') else name
+        if plain == DIRECTORY_FILE:
+            directory_file = os.path.join(path, name)
+        elif shard_file_index(plain) is not None:
+            shard_files[shard_file_index(plain)] = os.path.join(path, name)
+    if directory_file is None:
+        raise FileNotFoundError(f"{path} has no {DIRECTORY_FILE}")
+    return directory_file, shard_files
+
+
+def _unpacked(path, temporary):
+    """A plain database file for ``path``, gunzipped into a temporary file when needed."""
+    if not path.endswith('.gz'):
+        return path
+    handle, unpacked = tempfile.mkstemp(suffix='.db')
+    temporary.append(unpacked)
+    with os.fdopen(handle, 'wb') as raw, gzip.open(path, 'rb') as packed:
+        shutil.copyfileobj(packed, raw)
+    return unpacked
+
+
+def _restore_file(source_path, manager, pages):
+    source = sqlite3.connect(source_path)
+    try:
+        target = manager.open_connection()
+        try:
+            source.backup(target, pages=pages)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def restore_database(path=None, directory=BACKUP_DIR, pages=DEFAULT_PAGES_PER_STEP, manager=None):
+    """Copy a backup generation (the newest by default) over the live database.
+
+    Every file of the generation is checked before any is written. The
+    copies go through the backup API into the live files, so open
+    connections see the restored data on their next read. With sharding on
+    (and no ``manager`` given) each shard file is restored too, and shards
+    the generation has no file for are emptied, so the directory and the
+    ledgers match the generation. Returns the path restored from.
+    """
+    router = get_router() if manager is None else None
+    manager = manager or get_manager()
+    if path is None:
+        generations = list_generations(directory)
+        if not generations:
+            raise FileNotFoundError(f"No backups found in {directory}")
+        path = generations[-1]
+    directory_file, shard_files = _generation_files(path)
+    if shard_files and router is None:
+        raise RuntimeError(f"{path} is a sharded backup but sharding is not configured.")
+
+    temporary = []
+    try:
+        sources = [(None, _unpacked(directory_file, temporary))]
+        sources += [(index, _unpacked(shard_files[index], temporary)) for index in sorted(shard_files)]
+        for _, source_path in sources:
+            source = sqlite3.connect(source_path)
+            try:
+                quick_check(source)
+            finally:
+                source.close()
+        for index, source_path in sources:
+            _restore_file(source_path, manager if index is None else router.manager(index), pages)
+        if router is not None:
+            for index in router.indexes():
+                if index not in shard_files:
+                    clear_ledger(router.manager(index))
+            router.trim()
+    finally:
+        for unpacked in temporary:
+            os.remove(unpacked)
+    if router is not None and not shard_files:
+        logging.warning(f"{path} predates sharding; run shards.split_into_shards() to move its ledger into shards.")
+    logging.info(f"Database restored from {path}")
+    return path
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    if '--restore' in sys.argv:
+        restore_database()
+    else:
+        backup_database(compress='--compress' in sys.argv)
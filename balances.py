@@ -0,0 +1,120 @@
+"""Per-user, per-currency running balances kept current by SQLite triggers.
+
+balances holds the net income minus expenses of each user in each
+currency, in minor units, plus the number of transactions behind it. The
+dashboard reads it instead of summing the ledger. Like monthly_rollups,
+only rows with plain minor-unit amounts are counted.
+"""
+import logging
+
+from connection import get_manager
+from money import DEFAULT_EXPONENT
+
+
+def _signed(row):
+    return (f"CASE WHEN {row}.type = 'income' THEN {row}.amount_minor "
+            f"WHEN {row}.type = 'expense' THEN -{row}.amount_minor ELSE 0 END")
+
+
+def _add(row):
+    return f'''
+        INSERT INTO balances (user_id, currency, currency_exponent, amount, count)
+        SELECT {row}.user_id, COALESCE({row}.currency, 'USD'),
+               COALESCE({row}.currency_exponent, {DEFAULT_EXPONENT}), {_signed(row)}, 1
+        WHERE {row}.amount_minor IS NOT NULL
+        ON CONFLICT (user_id, currency) DO UPDATE SET amount = amount + excluded.amount, count = count + 1;
+    '''
+
+
+def _remove(row):
+    bucket = f"user_id = {row}.user_id AND currency = COALESCE({row}.currency, 'USD')"
+    return f'''
+        UPDATE balances SET amount = amount - ({_signed(row)}), count = count - 1
+        WHERE {row}.amount_minor IS NOT NULL AND {bucket};
+        DELETE FROM balances WHERE {row}.amount_minor IS NOT NULL AND {bucket} AND count <= 0;
+    '''
+
+
+BALANCE_TRIGGERS = {
+    'trg_transactions_balance_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_balance_insert AFTER INSERT ON transactions
+        WHEN NEW.amount_minor IS NOT NULL
+        BEGIN {_add('NEW')} END
+    ''',
+    'trg_transactions_balance_update': f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_balance_update
+        AFTER UPDATE OF user_id, type, currency, currency_exponent, amount_minor ON transactions
+        WHEN OLD.amount_minor IS NOT NULL OR NEW.amount_minor IS NOT NULL
+        BEGIN {_remove('OLD')} {_add('NEW')} END
+    ''',
+    'trg_transactions_balance_delete': f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_balance_delete AFTER DELETE ON transactions
+        WHEN OLD.amount_minor IS NOT NULL
+        BEGIN {_remove('OLD')} END
+    ''',
+}
+
+# Balances as they should be, computed from the ledger.
+EXPECTED_BALANCES = f'''
+    SELECT user_id, COALESCE(currency, 'USD') AS currency,
+           MAX(COALESCE(currency_exponent, {DEFAULT_EXPONENT})) AS currency_exponent,
+           SUM(CASE WHEN type = 'income' THEN amount_minor
+                    WHEN type = 'expense' THEN -amount_minor ELSE 0 END) AS amount,
+           COUNT(*) AS count
+    FROM transactions
+    WHERE amount_minor IS NOT NULL
+    GROUP BY 1, 2
+'''
+
+
+def create_balance_triggers(c):
+    for sql in BALANCE_TRIGGERS.values():
+        c.execute(sql)
+
+
+def fill_balances(c):
+    """Recompute every balance row from the transactions table."""
+    c.execute('DELETE FROM balances')
+    c.execute(f'INSERT INTO balances (user_id, currency, currency_exponent, amount, count) {EXPECTED_BALANCES}')
+
+
+def verify_balances(manager=None, repair=False):
+    """Compare stored balances with the ledger.
+
+    Returns a list of ``(user_id, currency, stored, expected)`` mismatches,
+    with None for a missing side. With ``repair`` the table is rebuilt in the
+    same transaction when anything differs.
+    """
+    manager = manager or get_manager()
+    with manager.transaction() as c:
+        c.execute(f'''
+            WITH expected AS ({EXPECTED_BALANCES})
+            SELECT b.user_id, b.currency, b.amount, e.amount
+            FROM balances b LEFT JOIN expected e ON e.user_id = b.user_id AND e.currency = b.currency
+            WHERE e.amount IS NOT b.amount OR e.count IS NOT b.count
+            UNION ALL
+            SELECT e.user_id, e.currency, NULL, e.amount
+            FROM expected e LEFT JOIN balances b ON b.user_id = e.user_id AND b.currency = e.currency
+            WHERE b.user_id IS NULL
+        ''')
+        mismatches = c.fetchall()
+        if mismatches and repair:
+            fill_balances(c)
+    if mismatches:
+        action = "repaired" if repair else "found"
+        logging.warning(f"Balance check {action} {len(mismatches)} mismatch(es).")
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+
+    from migrations import migrate
+
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    mismatches = verify_balances(repair='--repair' in sys.argv)
+    for user_id, currency, stored, expected in mismatches:
+        print(f"user {user_id} {currency}: stored {stored}, expected {expected}")
+    if not mismatches:
+        print("Balances match the ledger.")
@@ -0,0 +1,207 @@
+"""Session-scoped cache of transaction rows.
+
+Each entry holds one user's transactions (or every user's, for admin
+views) together with their (date_day, id) order, so full listings and
+keyset pages are served from memory. Writes made through the app update
+the cached entries in place instead of dropping them. Entries are evicted
+least recently used first once their estimated size passes ``max_bytes``.
+
+The cache remembers the ``transactions`` modification counter (see
+changes.py) of each database it is consistent with, keyed by the database's
+path, since admin entries span the directory database and every shard. Any
+other writer, including another process, moves a counter and the cache is
+dropped on the next read.
+"""
+import sys
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# Cache key for admin views that list every user's transactions.
+ALL_USERS = 'all'
+
+
+def row_size(transaction):
+    """Rough memory footprint of a cached transaction dict."""
+    return sys.getsizeof(transaction) + sum(sys.getsizeof(value) for value in transaction.values())
+
+
+class CachedTransactions:
+    """The cached rows for one key, with their (date_day, id) sort keys."""
+
+    def __init__(self):
+        self.rows = {}
+        self.sort_keys = {}
+        self.order = []  # Sorted (date_day, id) of rows that have a valid day
+        self.undated = []  # Sorted ids of rows without one
+        self.bytes = 0
+
+    def put(self, transaction, date_day):
+        self.discard(transaction['id'])
+        self.rows[transaction['id']] = transaction
+        self.bytes += row_size(transaction)
+        if date_day is not None:
+            key = (date_day, transaction['id'])
+            self.sort_keys[transaction['id']] = key
+            insort(self.order, key)
+        else:
+            insort(self.undated, transaction['id'])
+
+    def discard(self, transaction_id):
+        transaction = self.rows.pop(transaction_id, None)
+        if transaction is None:
+            return 0
+        size = row_size(transaction)
+        self.bytes -= size
+        key = self.sort_keys.pop(transaction_id, None)
+        if key is not None:
+            del self.order[bisect_left(self.order, key)]
+        else:
+            del self.undated[bisect_left(self.undated, transaction_id)]
+        return size
+
+    def all(self):
+        return list(self.rows.values())
+
+    def page(self, after=None, page_size=200, descending=True):
+        """Same contract as main.get_transactions_page(): ``(transactions, cursor)``."""
+        keys = []
+        in_dated = after is None or after[0] is not None
+        if in_dated and descending:
+            end = len(self.order) if after is None else bisect_left(self.order, tuple(after))
+            keys = self.order[max(0, end - page_size):end][::-1]
+        elif in_dated:
+            start = 0 if after is None else bisect_right(self.order, tuple(after))
+            keys = self.order[start:start + page_size]
+        # Undated rows follow the dated ones, in id order.
+        remaining = page_size - len(keys)
+        if remaining and descending:
+            end = len(self.undated) if in_dated else bisect_left(self.undated, after[1])
+            keys += [(None, transaction_id) for transaction_id in self.undated[max(0, end - remaining):end][::-1]]
+        elif remaining:
+            start = 0 if in_dated else bisect_right(self.undated, after[1])
+            keys += [(None, transaction_id) for transaction_id in self.undated[start:start + remaining]]
+        cursor = keys[-1] if len(keys) == page_size else None
+        return [self.rows[key[1]] for key in keys], cursor
+
+
+class TransactionCache:
+    """LRU cache of CachedTransactions entries with hit/miss counters."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._oversized = set()
+        self._lock = threading.RLock()
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def sync(self, versions):
+        """Drop every entry unless the cache reflects ``versions``, a {database: table version} dict."""
+        with self._lock:
+            if any(self.versions.get(database) != version for database, version in versions.items()):
+                self._entries.clear()
+                self._oversized.clear()
+            self.versions.update(versions)
+
+    def get(self, key, loader):
+        """Return the entry for ``key``, filling it from ``loader`` on a miss.
+
+        ``loader()`` yields ``(transaction, date_day)`` pairs. Returns None if
+        the rows do not fit under the ceiling; the key is then remembered and
+        not loaded again until invalidated, so callers should query directly.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            if key in self._oversized:
+                return None
+        entry = CachedTransactions()
+        rows = loader()
+        try:
+            for transaction, date_day in rows:
+                entry.put(transaction, date_day)
+                if entry.bytes > self.max_bytes:
+                    with self._lock:
+                        self._oversized.add(key)
+                    return None
+        finally:
+            close = getattr(rows, 'close', None)
+            if close is not None:
+                close()
+        with self._lock:
+            self._entries[key] = entry
+            self._evict()
+        return entry
+
+    def upsert(self, transaction, date_day, versions=None):
+        """Write through an inserted or updated row to every entry that holds it.
+
+        ``versions`` is ``(database, before, after)``: the database written to
+        and its table versions around the write. If the cache was not at
+        ``before`` for that database, someone else wrote too, and the cache
+        is dropped instead.
+        """
+        with self._lock:
+            if versions is not None and not self._advance(*versions):
+                return
+            for key in (transaction['user_id'], ALL_USERS):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.put(transaction, date_day)
+            # An update may have moved the row to another user.
+            for key, entry in self._entries.items():
+                if key not in (transaction['user_id'], ALL_USERS):
+                    entry.discard(transaction['id'])
+            self._evict()
+
+    def remove(self, transaction_id, versions=None):
+        with self._lock:
+            if versions is not None and not self._advance(*versions):
+                return
+            for entry in self._entries.values():
+                entry.discard(transaction_id)
+
+    def invalidate(self, key=None):
+        """Drop one entry, or every entry when ``key`` is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._oversized.clear()
+            else:
+                self._entries.pop(key, None)
+                self._oversized.discard(key)
+
+    def _advance(self, database, before, after):
+        current = self.versions.get(database)
+        self.versions[database] = after
+        if current != before:
+            self._entries.clear()
+            self._oversized.clear()
+            return False
+        return True
+
+    def _evict(self):
+        total = sum(entry.bytes for entry in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry.bytes
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': sum(entry.bytes for entry in self._entries.values()),
+            }
@@ -0,0 +1,75 @@
+"""Cheap change detection for periodic refreshes.
+
+Triggers bump a counter in ``table_versions`` for every row written to a
+tracked table, so a refresh stage can tell whether the tables it reads have
+changed since it last ran.
+"""
+from connection import get_manager
+
+TRACKED_TABLES = ('transactions', 'planned_transactions', 'users', 'categories')
+
+
+def create_version_triggers(c, table):
+    for operation in ('INSERT', 'UPDATE', 'DELETE'):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{operation.lower()} AFTER {operation} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+            END
+        ''')
+
+
+def table_version(c, table):
+    """Current modification counter of a tracked table."""
+    c.execute('SELECT version FROM table_versions WHERE name = ?', (table,))
+    row = c.fetchone()
+    return row[0] if row else None
+
+
+class ChangeTracker:
+    """Remembers which table versions each refresh stage last ran against.
+
+    ``managers`` is called on every poll for the databases to watch (the
+    directory database and shards), so shards created since the last poll
+    are picked up. Versions are read through each manager's pooled readers;
+    the tracker holds no connections of its own, leaving the shard router
+    in charge of how many stay open. With several databases a table's
+    version is the sum of its counters, which moves whenever any of them
+    does, since the counters only grow.
+    """
+
+    def __init__(self, managers=None):
+        self._managers = managers or (lambda: [get_manager()])
+        self._versions = {}
+        self._seen = {}
+
+    def poll(self):
+        """Return the table versions summed over every watched database."""
+        versions = {}
+        watched = []
+        for manager in self._managers():
+            if any(manager is known for known in watched):
+                continue
+            watched.append(manager)
+            with manager.reader() as c:
+                c.execute('SELECT name, version FROM table_versions')
+                for name, version in c.fetchall():
+                    versions[name] = versions.get(name, 0) + version
+        self._versions = versions
+        return versions
+
+    def changed(self, stage, tables):
+        """True the first time and whenever one of ``tables`` changed since ``stage`` last ran."""
+        versions = self.poll()
+        current = {table: versions.get(table) for table in tables}
+        if self._seen.get(stage) == current:
+            return False
+        self._seen[stage] = current
+        return True
+
+    def reset(self, stage=None):
+        """Force ``stage``, or every stage, to run on its next check."""
+        if stage is None:
+            self._seen.clear()
+        else:
+            self._seen.pop(stage, None)
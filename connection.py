@@ -0,0 +1,414 @@
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+DB_PATH = 'finance.db'
+DEFAULT_POOL_SIZE = 4
+DEFAULT_STATEMENT_CACHE_SIZE = 256
+
+STORAGE_PROFILE_FILE = "storage_profile.json"
+DEFAULT_STORAGE_PROFILE = "balanced"
+
+# PRAGMAs applied to every connection the manager opens. journal_mode is
+# persistent in the database file and is only set from the writer.
+STORAGE_PROFILES = {
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -8000,        # KiB when negative
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000,       # ms
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+}
+
+
+def load_storage_profile():
+    """Return the profile name saved in STORAGE_PROFILE_FILE, or the default."""
+    if os.path.exists(STORAGE_PROFILE_FILE):
+        try:
+            with open(STORAGE_PROFILE_FILE, 'r') as file:
+                profile = json.load(file).get('profile')
+            if profile in STORAGE_PROFILES:
+                return profile
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Error reading storage profile: {e}")
+    return DEFAULT_STORAGE_PROFILE
+
+
+def save_storage_profile(profile):
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {profile}")
+    with open(STORAGE_PROFILE_FILE, 'w') as file:
+        json.dump({'profile': profile}, file)
+
+
+def apply_storage_profile(conn, profile, writer=False):
+    """Apply the PRAGMAs of a storage profile to an open connection."""
+    settings = STORAGE_PROFILES[profile]
+    conn.execute(f"PRAGMA busy_timeout = {int(settings['busy_timeout'])}")
+    if writer:
+        conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(settings['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+
+
+class ConnectionManager:
+    """Shared SQLite connections: a single writer plus a bounded pool of readers.
+
+    Connections stay open for the life of the manager, so the per-connection
+    prepared-statement cache (``cached_statements``) is reused across calls
+    instead of being thrown away with every ``connect()``.
+    """
+
+    def __init__(self, path=DB_PATH, pool_size=DEFAULT_POOL_SIZE,
+                 statement_cache_size=DEFAULT_STATEMENT_CACHE_SIZE, profile=None):
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        profile = profile or DEFAULT_STORAGE_PROFILE
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile: {profile}")
+        self.path = path
+        self.pool_size = pool_size
+        self.statement_cache_size = statement_cache_size
+        self.profile = profile
+        self._applied_profiles = {}
+        self._commit_stats = {}
+        self._local = threading.local()
+        self._idle_readers = queue.LifoQueue()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._closed = False
+
+    def _connect(self):
+        # isolation_level=None hands transaction control to transaction(),
+        # so plain reads never open an implicit write transaction.
+        return sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=self.statement_cache_size,
+        )
+
+    def _ensure_profile(self, conn, writer=False):
+        if self._applied_profiles.get(id(conn)) != self.profile:
+            apply_storage_profile(conn, self.profile, writer=writer)
+            self._applied_profiles[id(conn)] = self.profile
+
+    def _writer_connection(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection manager is closed.")
+        if self._writer is None:
+            self._writer = self._connect()
+        if not self._in_transaction():
+            self._ensure_profile(self._writer, writer=True)
+        return self._writer
+
+    def _acquire_reader(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection manager is closed.")
+        try:
+            conn = self._idle_readers.get_nowait()
+        except queue.Empty:
+            conn = None
+        if conn is None:
+            with self._readers_lock:
+                if len(self._readers) < self.pool_size:
+                    # Open the writer first so the journal mode is settled
+                    # before any reader attaches to the file.
+                    with self._writer_lock:
+                        self._writer_connection()
+                    conn = self._connect()
+                    self._readers.append(conn)
+        if conn is None:
+            # Pool exhausted: wait for another thread to hand its reader back.
+            conn = self._idle_readers.get()
+        self._ensure_profile(conn)
+        return conn
+
+    def open_connection(self):
+        """Open a standalone connection outside the pool, with the current profile.
+
+        For long-lived watchers that must keep their own connection; the
+        caller closes it.
+        """
+        with self._writer_lock:
+            self._writer_connection()
+        conn = self._connect()
+        apply_storage_profile(conn, self.profile)
+        return conn
+
+    def _in_transaction(self):
+        return getattr(self._local, 'tx_depth', 0) > 0
+
+    @contextmanager
+    def reader(self):
+        """Yield a cursor on this thread's reader connection.
+
+        The connection is bound to the calling thread for the duration of the
+        block (nested ``reader()`` calls reuse it) and returned to the pool
+        afterwards. Inside ``transaction()`` the writer cursor is yielded so
+        the block sees its own uncommitted changes.
+        """
+        if self._in_transaction():
+            yield self._writer.cursor()
+            return
+
+        conn = getattr(self._local, 'reader', None)
+        if conn is not None:
+            yield conn.cursor()
+            return
+
+        conn = self._acquire_reader()
+        self._local.reader = conn
+        try:
+            yield conn.cursor()
+        finally:
+            self._local.reader = None
+            self._idle_readers.put(conn)
+
+    @contextmanager
+    def snapshot(self, copy=False):
+        """Make every ``reader()`` on this thread see one consistent snapshot.
+
+        In WAL mode this holds a read transaction on the thread's reader, so
+        writers on other connections carry on and are simply not seen. With
+        ``copy`` (or outside WAL) the database is first copied into memory
+        with the backup API and reads go to the copy. Nested snapshots join
+        the outer one.
+        """
+        if self._in_transaction() or getattr(self._local, 'snapshot_depth', 0):
+            self._local.snapshot_depth = getattr(self._local, 'snapshot_depth', 0) + 1
+            try:
+                yield
+            finally:
+                self._local.snapshot_depth -= 1
+            return
+
+        outer = getattr(self._local, 'reader', None)
+        conn = outer or self._acquire_reader()
+        memory = None
+        began = False
+        try:
+            if not copy:
+                copy = conn.execute('PRAGMA journal_mode').fetchone()[0].lower() != 'wal'
+            if copy:
+                memory = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+                conn.backup(memory)
+                self._local.reader = memory
+            else:
+                conn.execute('BEGIN')
+                began = True
+                conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()  # Pins the snapshot
+                self._local.reader = conn
+            self._local.snapshot_depth = 1
+            yield
+        finally:
+            self._local.snapshot_depth = 0
+            self._local.reader = outer
+            if memory is not None:
+                memory.close()
+            if began:
+                conn.execute('COMMIT')
+            if outer is None:
+                self._idle_readers.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Run the block in one write transaction on the shared writer.
+
+        Commits on success and rolls back on any exception. Nested calls on
+        the same thread join the outer transaction.
+        """
+        with self._writer_lock:
+            conn = self._writer_connection()
+            if self._in_transaction():
+                self._local.tx_depth += 1
+                try:
+                    yield conn.cursor()
+                finally:
+                    self._local.tx_depth -= 1
+                return
+
+            conn.execute('BEGIN IMMEDIATE')
+            self._local.tx_depth = 1
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                started = time.perf_counter()
+                conn.commit()
+                self._record_commit(time.perf_counter() - started)
+            finally:
+                self._local.tx_depth = 0
+
+    def _record_commit(self, seconds):
+        stats = self._commit_stats.setdefault(self.profile, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    def commit_latency(self, profile=None):
+        """Return commit latency measured on live commits under a profile.
+
+        The result is a dict with ``count``, ``avg_ms`` and ``max_ms``.
+        """
+        count, total, worst = self._commit_stats.get(profile or self.profile, [0, 0.0, 0.0])
+        return {
+            'count': count,
+            'avg_ms': (total / count) * 1000 if count else 0.0,
+            'max_ms': worst * 1000,
+        }
+
+    def set_profile(self, profile):
+        """Switch the storage profile; open connections pick it up on next use."""
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile: {profile}")
+        with self._writer_lock:
+            self.profile = profile
+            if self._writer is not None and not self._in_transaction():
+                self._ensure_profile(self._writer, writer=True)
+
+    def release_idle(self):
+        """Close the pooled connections no thread is using; they reopen on next use.
+
+        For owners of many managers, such as the shard router, that must keep
+        the number of open files down. Returns True if none are left open.
+        """
+        with self._readers_lock:
+            while True:
+                try:
+                    conn = self._idle_readers.get_nowait()
+                except queue.Empty:
+                    break
+                self._readers.remove(conn)
+                self._applied_profiles.pop(id(conn), None)
+                conn.close()
+        # A writer held by another thread's transaction stays open.
+        if self._writer_lock.acquire(blocking=False):
+            try:
+                if self._writer is not None and not self._in_transaction():
+                    self._applied_profiles.pop(id(self._writer), None)
+                    self._writer.close()
+                    self._writer = None
+            finally:
+                self._writer_lock.release()
+        with self._readers_lock:
+            return not self._readers and self._writer is None
+
+    def close(self):
+        """Close every pooled connection."""
+        self._closed = True
+        self._applied_profiles = {}
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+        self._idle_readers = queue.LifoQueue()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def configure(path=DB_PATH, pool_size=DEFAULT_POOL_SIZE,
+              statement_cache_size=DEFAULT_STATEMENT_CACHE_SIZE, profile=None):
+    """Replace the shared connection manager with a newly configured one."""
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+        _manager = ConnectionManager(path, pool_size, statement_cache_size,
+                                     profile or load_storage_profile())
+        return _manager
+
+
+def get_manager():
+    """Return the shared connection manager, creating it on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ConnectionManager(profile=load_storage_profile())
+        return _manager
+
+
+def set_storage_profile(profile):
+    """Persist a storage profile and apply it to the shared manager."""
+    save_storage_profile(profile)
+    get_manager().set_profile(profile)
+
+
+def benchmark_storage_profiles(samples=50, directory=None):
+    """Measure average single-row commit latency (ms) for every profile.
+
+    Each profile runs against a scratch database created in ``directory``
+    (the database's own directory by default) so the figures reflect the
+    same filesystem the real file lives on.
+    """
+    directory = directory or os.path.dirname(os.path.abspath(DB_PATH))
+    results = {}
+    for profile in STORAGE_PROFILES:
+        fd, path = tempfile.mkstemp(suffix='.db', dir=directory)
+        os.close(fd)
+        manager = ConnectionManager(path, pool_size=1, profile=profile)
+        try:
+            with manager.transaction() as c:
+                c.execute('CREATE TABLE probe (id INTEGER PRIMARY KEY, payload TEXT)')
+            # Start the figures after the CREATE TABLE commit.
+            manager._commit_stats.pop(profile, None)
+            for i in range(samples):
+                with manager.transaction() as c:
+                    c.execute('INSERT INTO probe (payload) VALUES (?)', (str(i),))
+            results[profile] = manager.commit_latency(profile)['avg_ms']
+        finally:
+            manager.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    return results
+
+
+def reader():
+    """Shortcut for ``get_manager().reader()``."""
+    return get_manager().reader()
+
+
+def transaction():
+    """Shortcut for ``get_manager().transaction()``."""
+    return get_manager().transaction()
+
+
+def snapshot(copy=False):
+    """Shortcut for ``get_manager().snapshot()``."""
+    return get_manager().snapshot(copy)
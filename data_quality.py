@@ -0,0 +1,287 @@
+"""Set-based data-quality checks and fixes.
+
+Each table is checked in one aggregate pass: every check is a
+``COUNT(*) FILTER (WHERE ...)`` over the same scan. Text amounts that
+SQLite could not read as numbers and dates that are not strict ISO text are
+the things SQL cannot judge; those are fetched in chunks and parsed a chunk
+at a time, amounts with pandas and dates the way the app reads them
+(dates.to_epoch_day, which takes '2024-1-5'). Fixes are
+set-based UPDATE/DELETE statements (and one executemany for recovered
+amounts), all applied in a single transaction.
+
+By default nothing is written: ``validate()`` returns what it found. Pass
+``fix=True`` to repair. ``validate_all()`` runs the checks on the directory
+database and on every shard file when sharding is on.
+"""
+import logging
+
+import pandas as pd
+
+from connection import get_manager
+from dates import JULIAN_DAY_EPOCH, from_epoch_day, to_epoch_day
+from migrations import USER_OWNED_TABLES, normalise_dates
+from money import CURRENCY_EXPONENTS, DEFAULT_EXPONENT
+from shards import all_managers
+
+# What clean_invalid_dates.py always wrote over a bad date.
+DEFAULT_DATE = '2024-01-01'
+DEFAULT_CURRENCY = 'USD'
+SAMPLE_SIZE = 10
+PARSE_CHUNK_SIZE = 5000
+
+# Thousands separators, currency signs and spaces stripped before parsing.
+AMOUNT_NOISE = r'[,\s$€£¥₴]'
+
+
+def _valid_date(column):
+    return f"{column} IS NOT NULL AND date({column}, '+0 days') IS {column}"
+
+
+def _day_number(column):
+    return f'CAST(julianday({column}) - {JULIAN_DAY_EPOCH} AS INTEGER)'
+
+
+def _by_currency(value):
+    """CASE expression giving ``value(exponent)`` for the row's currency."""
+    cases = ' '.join(f"WHEN '{currency}' THEN {value(exponent)}" for currency, exponent in CURRENCY_EXPONENTS.items())
+    return f'CASE currency {cases} ELSE {value(DEFAULT_EXPONENT)} END'
+
+
+def _expected_exponent():
+    return _by_currency(lambda exponent: exponent)
+
+
+def _date_columns(table):
+    return ('date', 'date_day') if table == 'transactions' else ('planned_date', 'planned_day')
+
+
+_CURRENCY_CODE = "GLOB '[A-Z][A-Z][A-Z]'"
+_ORPHAN = 'NOT EXISTS (SELECT 1 FROM users WHERE users.id = {table}.user_id)'
+
+# (check, table, condition) in the order fixes are applied: later checks
+# clean up after earlier fixes (new currencies need new minor units, and
+# only dates that fail to parse are left for 'invalid date'). The two date
+# checks share a condition; validate() splits its rows by parsing them.
+DATE_CHECKS = ('non-ISO date', 'invalid date')
+CHECKS = [
+    ('unknown currency', 'transactions', f'currency IS NULL OR currency NOT {_CURRENCY_CODE}'),
+    ('non-numeric amount', 'transactions', "typeof(amount) = 'text'"),
+    ('stale minor units', 'transactions',
+     f"typeof(amount) IN ('integer', 'real') "
+     f"AND (amount_minor IS NULL OR currency_exponent IS NOT {_expected_exponent()})"),
+    ('non-ISO date', 'transactions', f'NOT ({_valid_date("date")})'),
+    ('invalid date', 'transactions', f'NOT ({_valid_date("date")})'),
+    ('stale day number', 'transactions', f'{_valid_date("date")} AND date_day IS NOT {_day_number("date")}'),
+    ('non-ISO date', 'planned_transactions', f'NOT ({_valid_date("planned_date")})'),
+    ('invalid date', 'planned_transactions', f'NOT ({_valid_date("planned_date")})'),
+    ('stale day number', 'planned_transactions',
+     f'{_valid_date("planned_date")} AND planned_day IS NOT {_day_number("planned_date")}'),
+] + [('orphaned user_id', table, _ORPHAN.format(table=table)) for table in USER_OWNED_TABLES]
+
+
+def count_issues(c, checks=CHECKS):
+    """Run the checks with one aggregate scan per table; returns {(check, table): count}."""
+    counts = {}
+    tables = []
+    for _, table, _ in checks:
+        if table not in tables:
+            tables.append(table)
+    for table in tables:
+        table_checks = [(check, condition) for check, check_table, condition in checks if check_table == table]
+        filters = ', '.join(f'COUNT(*) FILTER (WHERE {condition})' for _, condition in table_checks)
+        c.execute(f'SELECT {filters} FROM {table}')
+        for (check, _), count in zip(table_checks, c.fetchone()):
+            counts[(check, table)] = count
+    return counts
+
+
+def sample_rows(c, table, condition, limit=SAMPLE_SIZE):
+    c.execute(f'SELECT rowid FROM {table} WHERE {condition} LIMIT ?', (limit,))
+    return [row[0] for row in c.fetchall()]
+
+
+def parse_text_amounts(c):
+    """Return ``(recovered, unparseable)`` for text amounts.
+
+    ``recovered`` is a list of ``(amount, id)`` for values like '1,234.50'
+    or '$12' once separators and signs are stripped; ``unparseable`` lists
+    the ids of everything else.
+    """
+    c.execute("SELECT id, amount FROM transactions WHERE typeof(amount) = 'text'")
+    recovered, unparseable = [], []
+    while True:
+        rows = c.fetchmany(PARSE_CHUNK_SIZE)
+        if not rows:
+            break
+        ids = pd.Series([row[0] for row in rows])
+        cleaned = pd.Series([row[1] for row in rows], dtype='object').str.replace(AMOUNT_NOISE, '', regex=True)
+        values = pd.to_numeric(cleaned, errors='coerce')
+        parsed = values.notna() & (values.abs() != float('inf'))
+        recovered.extend(zip(values[parsed].tolist(), ids[parsed].tolist()))
+        unparseable.extend(ids[~parsed].tolist())
+    return recovered, unparseable
+
+
+def parse_text_dates(c, table):
+    """Return ``(recovered, unparseable)`` for dates that are not strict ISO text.
+
+    ``recovered`` is a list of ``(iso_date, day, rowid)`` for values the app
+    itself accepts, like '2024-1-5'; ``unparseable`` lists the rowids of
+    everything else.
+    """
+    date_column, _ = _date_columns(table)
+    c.execute(f'SELECT rowid, {date_column} FROM {table} WHERE NOT ({_valid_date(date_column)})')
+    recovered, unparseable = [], []
+    days = {}
+    while True:
+        rows = c.fetchmany(PARSE_CHUNK_SIZE)
+        if not rows:
+            break
+        for rowid, value in rows:
+            if value not in days:
+                try:
+                    days[value] = to_epoch_day(value) if isinstance(value, str) else None
+                except ValueError:
+                    days[value] = None
+            day = days[value]
+            if day is None:
+                unparseable.append(rowid)
+            else:
+                recovered.append((from_epoch_day(day), day, rowid))
+    return recovered, unparseable
+
+
+def _apply_fix(c, check, table, condition, default_date):
+    """Repair one check set-wise and return the number of rows changed."""
+    if check == 'unknown currency':
+        c.execute(f'''
+            UPDATE {table}
+            SET currency = CASE WHEN upper(trim(currency)) {_CURRENCY_CODE} THEN upper(trim(currency)) ELSE ? END
+            WHERE {condition}
+        ''', (DEFAULT_CURRENCY,))
+    elif check == 'non-numeric amount':
+        recovered, _ = parse_text_amounts(c)
+        # amount_minor is rebuilt by the 'stale minor units' fix that follows.
+        c.executemany('UPDATE transactions SET amount = ?, amount_minor = NULL WHERE id = ?', recovered)
+        return len(recovered)
+    elif check == 'stale minor units':
+        scale = _by_currency(lambda exponent: 10 ** exponent)
+        c.execute(f'''
+            UPDATE {table}
+            SET amount_minor = CAST(ROUND(amount * {scale}) AS INTEGER), currency_exponent = {_expected_exponent()}
+            WHERE {condition}
+        ''')
+    elif check == 'non-ISO date':
+        return normalise_dates(c, table, *_date_columns(table))
+    elif check == 'invalid date':
+        # Runs after 'non-ISO date', so only dates that fail to parse are left.
+        date_column, day_column = _date_columns(table)
+        if default_date is None:
+            c.execute(f'DELETE FROM {table} WHERE {condition}')
+        else:
+            c.execute(f'UPDATE {table} SET {date_column} = ?, {day_column} = ? WHERE {condition}',
+                      (default_date, to_epoch_day(default_date)))
+    elif check == 'stale day number':
+        date_column, day_column = _date_columns(table)
+        c.execute(f'UPDATE {table} SET {day_column} = {_day_number(date_column)} WHERE {condition}')
+    elif check == 'orphaned user_id':
+        c.execute(f'DELETE FROM {table} WHERE {condition}')
+    return c.rowcount
+
+
+def validate(manager=None, fix=False, default_date=DEFAULT_DATE, check_orphans=True):
+    """Check the ledger and, with ``fix``, repair it in one transaction.
+
+    Returns a list of findings, one dict per check with ``check``,
+    ``table``, ``count`` (rows found), ``sample`` (up to SAMPLE_SIZE rowids)
+    and ``fixed`` (rows changed; 0 on a dry run). Dates the app can read but
+    that are not ISO text are rewritten as ISO. Dates that do not parse at
+    all are set to ``default_date``, or deleted when it is None. Orphaned
+    rows are deleted.
+    Non-numeric amounts that cannot be parsed are only reported. Pass
+    ``check_orphans=False`` for shard files, which hold no users rows.
+    """
+    manager = manager or get_manager()
+    checks = [entry for entry in CHECKS if check_orphans or entry[0] != 'orphaned user_id']
+    context = manager.transaction() if fix else manager.snapshot()
+    findings = []
+    with context:
+        with manager.reader() as c:
+            counts = count_issues(c, checks)
+            parsed_dates = {}
+            for check, table, condition in checks:
+                count = counts[(check, table)]
+                sample = sample_rows(c, table, condition) if count else []
+                if check in DATE_CHECKS and count:
+                    if table not in parsed_dates:
+                        recovered, unparseable = parse_text_dates(c, table)
+                        parsed_dates[table] = {'non-ISO date': [row[2] for row in recovered],
+                                               'invalid date': unparseable}
+                    rowids = parsed_dates[table][check]
+                    count, sample = len(rowids), rowids[:SAMPLE_SIZE]
+                findings.append({
+                    'check': check,
+                    'table': table,
+                    'count': count,
+                    'sample': sample,
+                    'fixed': 0,
+                })
+            if fix:
+                for finding, (check, table, condition) in zip(findings, checks):
+                    # Earlier fixes can create work for later checks, so these
+                    # run whatever the initial count was.
+                    finding['fixed'] = _apply_fix(c, check, table, condition, default_date)
+    for finding in findings:
+        if finding['count'] or finding['fixed']:
+            logging.info(f"{finding['table']}: {finding['count']} {finding['check']} row(s), {finding['fixed']} fixed")
+    return findings
+
+
+def validate_all(fix=False, default_date=DEFAULT_DATE):
+    """validate() the directory database and every shard, merging their findings.
+
+    Shards are checked without the orphan check, since users live in the
+    directory database. Each database is fixed in its own transaction.
+    Counts and fixes are summed per check; rowids are unique across shards,
+    so the samples are too.
+    """
+    directory = get_manager()
+    results = [validate(directory, fix, default_date)]
+    for manager in all_managers():
+        if manager is not directory:
+            results.append(validate(manager, fix, default_date, check_orphans=False))
+    merged = {}
+    for finding in (finding for findings in results for finding in findings):
+        known = merged.get((finding['check'], finding['table']))
+        if known is None:
+            merged[(finding['check'], finding['table'])] = dict(finding, sample=list(finding['sample']))
+        else:
+            known['count'] += finding['count']
+            known['fixed'] += finding['fixed']
+            known['sample'] = (known['sample'] + finding['sample'])[:SAMPLE_SIZE]
+    return list(merged.values())
+
+
+def print_report(findings):
+    problems = [finding for finding in findings if finding['count'] or finding['fixed']]
+    if not problems:
+        print("No data-quality problems found.")
+        return
+    for finding in problems:
+        line = f"{finding['table']}: {finding['count']} {finding['check']} row(s)"
+        if finding['fixed']:
+            line += f", {finding['fixed']} fixed"
+        if finding['sample']:
+            line += f" (e.g. rowid {', '.join(str(rowid) for rowid in finding['sample'])})"
+        print(line)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from migrations import migrate
+
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    delete_invalid_dates = '--delete-invalid-dates' in sys.argv
+    print_report(validate_all(fix='--fix' in sys.argv, default_date=None if delete_invalid_dates else DEFAULT_DATE))
@@ -1,84 +1,49 @@
+import json
+import logging
 import os
 import sqlite3
 import bcrypt
 import secrets
-from encryption import fernet_encrypt, fernet_decrypt
+from itertools import islice
+import backup
+from connection import get_manager, reader, transaction
+from dates import to_epoch_day
+from encryption import blind_index, blind_indexes, decrypt_batch, open_rows, purge_decrypt_cache, seal_row
+from migrations import migrate, shipped_query
+from money import currency_exponent, from_minor, to_minor
+from shards import all_managers, delete_user_data, manager_for_row, manager_for_user, managers_for
 
-def get_db_connection():
-    """Establish a connection to the SQLite database."""
-    conn = sqlite3.connect('finance.db')
-    return conn, conn.cursor()
+DEFAULT_BULK_BATCH_SIZE = 5000
+DEFAULT_PAGE_SIZE = 200
+DEFAULT_FETCH_SIZE = 1000
+TRANSACTION_TYPES = ('income', 'expense')
+TRANSACTION_FIELDS = 'id, type, amount, category, date, currency, sealed'
+
+# What sealed rows keep in the NOT NULL amount and category columns.
+SEALED_AMOUNT = b''
+SEALED_CATEGORY = ''
 
 def init_db():
-    """Initialize the database with the required tables."""
-    conn, c = get_db_connection()
-    try:
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                secret_key TEXT NOT NULL,
-                is_admin INTEGER DEFAULT 0
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                type TEXT NOT NULL,
-                amount BLOB NOT NULL,
-                category BLOB NOT NULL,
-                date TEXT NOT NULL,
-                currency TEXT DEFAULT 'USD',
-                user_id INTEGER NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                user_id INTEGER NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS goals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                target_amount REAL NOT NULL,
-                current_savings REAL DEFAULT 0,
-                deadline TEXT,
-                user_id INTEGER NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        # Continue with other tables as needed
-        conn.commit()
-    finally:
-        conn.close()
+    """Initialize the database schema, applying any pending migrations."""
+    migrate()
 
 def add_user(username, password, is_admin=False):
     """Add a new user to the database."""
     hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode('utf-8')
     secret_key = secrets.token_hex(16)
-    conn, c = get_db_connection()
     try:
-        c.execute('INSERT INTO users (username, password, is_admin, secret_key) VALUES (?, ?, ?, ?)', (username, hashed, is_admin, secret_key))
-        conn.commit()
+        with transaction() as c:
+            c.execute('INSERT INTO users (username, password, is_admin, secret_key) VALUES (?, ?, ?, ?)', (username, hashed, is_admin, secret_key))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def regenerate_secret_key(user_id, save_to_file=False):
     """Regenerate the secret key for a user and optionally save it to a file."""
     new_secret_key = secrets.token_hex(16)
-    conn, c = get_db_connection()
     try:
-        c.execute('UPDATE users SET secret_key = ? WHERE id = ?', (new_secret_key, user_id))
-        conn.commit()
+        with transaction() as c:
+            c.execute('UPDATE users SET secret_key = ? WHERE id = ?', (new_secret_key, user_id))
 
         if save_to_file:
             desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
@@ -93,181 +58,448 @@ def regenerate_secret_key(user_id, save_to_file=False):
     except sqlite3.Error as e:
         print(f"Error regenerating secret key for user ID {user_id}: {e}")
         return None
-    finally:
-        conn.close()
-        
+
 def verify_user(username, password):
     """Verify user credentials."""
-    conn, c = get_db_connection()
-    try:
+    with reader() as c:
         c.execute('SELECT id, password FROM users WHERE username = ?', (username,))
         user = c.fetchone()
-        if user and bcrypt.checkpw(password.encode(), user[1]):
-            return user[0], True  # Return user ID and is_admin status
-        return None, False
-    finally:
-        conn.close()
+    if user and bcrypt.checkpw(password.encode(), user[1]):
+        return user[0], True  # Return user ID and is_admin status
+    return None, False
 
 def get_users():
     """Retrieve all users."""
-    conn, c = get_db_connection()
-    try:
+    with reader() as c:
         c.execute('SELECT id, username FROM users')  # Fixed the query (removed the dangling comma)
         users = c.fetchall()
-        return [{'id': user[0], 'username': user[1]} for user in users]  # Corrected the dictionary structure
-    finally:
-        conn.close()
+    return [{'id': user[0], 'username': user[1]} for user in users]  # Corrected the dictionary structure
+
+def _next_transaction_id(c):
+    """Id AUTOINCREMENT would give the next transaction; call inside the write transaction."""
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'")
+    row = c.fetchone()
+    return (row[0] if row else 0) + 1
 
 def add_transaction(trans_type, amount, category, date, user_id, currency='USD'):
-    """Add a new transaction for a user."""
-    encrypted_amount = fernet_encrypt(str(amount))
-    encrypted_category = fernet_encrypt(category)
-    conn, c = get_db_connection()
+    """Add a new transaction for a user, sealing its amount and category. Returns its id."""
+    date_day = to_epoch_day(date)
+    with manager_for_user(user_id).transaction() as c:
+        # The id is taken up front because the sealed blob is bound to it.
+        transaction_id = _next_transaction_id(c)
+        c.execute('INSERT INTO transactions (id, type, amount, category, date, currency, user_id, date_day, sealed, category_bidx) '
+                  'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                  (transaction_id, trans_type, SEALED_AMOUNT, SEALED_CATEGORY, date, currency, user_id, date_day,
+                   seal_row(transaction_id, amount, category), blind_index(user_id, category)))
+    return transaction_id
+
+def _prepare_bulk_row(row, day_cache):
+    """Validate one bulk row.
+
+    Returns (type, amount, category, date, currency, amount_minor, date_day);
+    ``day_cache`` memoises date parsing across the load.
+    """
+    for field in ('type', 'amount', 'category', 'date'):
+        if row.get(field) in (None, ''):
+            raise ValueError(f"Missing {field}.")
+    trans_type = row['type']
+    if trans_type not in TRANSACTION_TYPES:
+        raise ValueError(f"Transaction type must be 'income' or 'expense', got {trans_type!r}.")
+    if not isinstance(row['category'], str):
+        raise ValueError(f"Category must be text, got {row['category']!r}.")
+    currency = row.get('currency') or 'USD'
+    if not isinstance(currency, str):
+        raise ValueError(f"Currency must be a code like 'USD', got {currency!r}.")
+    amount = row['amount']
     try:
-        c.execute('INSERT INTO transactions (type, amount, category, date, currency, user_id) VALUES (?, ?, ?, ?, ?, ?)',
-                  (trans_type, encrypted_amount, encrypted_category, date, currency, user_id))
-        conn.commit()
-    finally:
-        conn.close()
+        amount_minor = to_minor(amount, currency)
+    except ArithmeticError:
+        raise ValueError(f"Invalid amount {amount!r}.")
+    date = row['date']
+    date_day = day_cache.get(date)
+    if date_day is None:
+        try:
+            date_day = to_epoch_day(date)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid date {date!r}, expected YYYY-MM-DD.")
+        day_cache[date] = date_day
+    return trans_type, amount, row['category'], date, currency, amount_minor, date_day
+
+def add_transactions_bulk(rows, user_id, batch_size=DEFAULT_BULK_BATCH_SIZE, encrypt=True):
+    """Insert many transactions for a user in one database transaction.
+
+    ``rows`` is any iterable of dicts with ``type``, ``amount``, ``category``,
+    ``date`` and an optional ``currency``. It is consumed ``batch_size`` rows
+    at a time and each batch goes through a single ``executemany``. With
+    ``encrypt`` the amount and category are sealed as in add_transaction();
+    otherwise they are stored in the clear with integer minor units.
+
+    Invalid rows are skipped rather than aborting the load. Returns
+    ``(inserted, errors)`` where ``errors`` is a list of ``(row_index, message)``.
+    Use the "bulk-load" storage profile for large imports.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    rows = iter(rows)
+    inserted = 0
+    errors = []
+    index = 0
+    day_cache = {}
+    with manager_for_user(user_id).transaction() as c:
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+            valid = []
+            for row in chunk:
+                try:
+                    valid.append(_prepare_bulk_row(row, day_cache))
+                except (AttributeError, TypeError, ValueError) as e:
+                    errors.append((index, str(e)))
+                index += 1
+            if not valid:
+                continue
+            if encrypt:
+                first_id = _next_transaction_id(c)
+                c.executemany(
+                    'INSERT INTO transactions (id, type, amount, category, date, currency, user_id, date_day, sealed, category_bidx) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(first_id + i, r[0], SEALED_AMOUNT, SEALED_CATEGORY, r[3], r[4], user_id, r[6],
+                      seal_row(first_id + i, r[1], r[2]), blind_index(user_id, r[2]))
+                     for i, r in enumerate(valid)]
+                )
+            else:
+                params = []
+                for trans_type, _, category, date, currency, amount_minor, date_day in valid:
+                    exponent = currency_exponent(currency)
+                    params.append((trans_type, from_minor(amount_minor, exponent), category, date, currency,
+                                   user_id, amount_minor, exponent, date_day))
+                c.executemany(
+                    'INSERT INTO transactions (type, amount, category, date, currency, user_id, amount_minor, currency_exponent, date_day) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    params
+                )
+            inserted += len(valid)
+    return inserted, errors
+
+def _decrypted_transactions(rows):
+    """Decrypt the amount and category of rows fetched with TRANSACTION_FIELDS.
+
+    Sealed rows are opened one blob each; rows still holding Fernet tokens
+    are decrypted together in one batch.
+    """
+    fields = [(None, None)] * len(rows)
+    sealed = [i for i, row in enumerate(rows) if row[6] is not None]
+    legacy = [i for i, row in enumerate(rows) if row[6] is None]
+    opened, failed = open_rows([(rows[i][0], rows[i][6]) for i in sealed])
+    for i, value in zip(sealed, opened):
+        if value is not None:
+            fields[i] = value
+    if legacy:
+        values, failed_tokens = decrypt_batch([rows[i][2] for i in legacy] + [rows[i][3] for i in legacy])
+        for j, i in enumerate(legacy):
+            fields[i] = (values[j], values[len(legacy) + j])
+        failed += sorted({index % len(legacy) for index in failed_tokens})
+    if failed:
+        logging.warning(f"{len(failed)} of {len(rows)} transaction(s) could not be decrypted.")
+    return [{
+        'id': row[0],
+        'type': row[1],
+        'amount': amount,
+        'category': category,
+        'date': row[4],
+        'currency': row[5]
+    } for row, (amount, category) in zip(rows, fields)]
+
+@shipped_query('encrypted transactions for user', 1)
+def user_transactions_query(user_id):
+    return f'SELECT {TRANSACTION_FIELDS} FROM transactions WHERE user_id = ?', (user_id,)
+
+def iter_transactions(user_id, chunk_size=DEFAULT_FETCH_SIZE):
+    """Yield a user's decrypted transactions, fetching ``chunk_size`` rows at a time."""
+    for manager in managers_for(user_id):
+        with manager.reader() as c:
+            c.execute(*user_transactions_query(user_id))
+            while True:
+                rows = c.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from _decrypted_transactions(rows)
 
 def get_transactions(user_id):
-    """Retrieve transactions for a specific user."""
-    conn, c = get_db_connection()
-    try:
-        c.execute('SELECT * FROM transactions WHERE user_id = ?', (user_id,))
-        data = c.fetchall()
-        transactions = []
-        for row in data:
-            decrypted_amount = fernet_decrypt(row[2])
-            decrypted_category = fernet_decrypt(row[3])
-            transactions.append({
-                'id': row[0],
-                'type': row[1],
-                'amount': decrypted_amount,
-                'category': decrypted_category,
-                'date': row[4],
-                'currency': row[5]
-            })
-        return transactions
-    finally:
-        conn.close()
+    """Retrieve transactions for a specific user, decrypting them in one batch."""
+    rows = []
+    for manager in managers_for(user_id):
+        with manager.reader() as c:
+            c.execute(*user_transactions_query(user_id))
+            rows.extend(c.fetchall())
+    return _decrypted_transactions(rows)
+
+@shipped_query('encrypted transactions in category', 1, [b'0' * 16, b'1' * 16])
+def category_transactions_query(user_id, indexes):
+    placeholders = ', '.join('?' for _ in indexes)
+    return (f'SELECT {TRANSACTION_FIELDS} FROM transactions WHERE user_id = ? AND category_bidx IN ({placeholders})',
+            (user_id, *indexes))
+
+def get_transactions_by_category(user_id, category):
+    """A user's transactions in ``category``, found through the blind index.
+
+    Only the matching rows are read and decrypted. Rows not yet indexed
+    (see index_categories()) are not found.
+    """
+    query, params = category_transactions_query(user_id, blind_indexes(user_id, category))
+    rows = []
+    for manager in managers_for(user_id):
+        with manager.reader() as c:
+            c.execute(query, params)
+            rows.extend(c.fetchall())
+    return _decrypted_transactions(rows)
+
+@shipped_query('encrypted category counts', 1)
+def category_counts_query(user_id):
+    return ('SELECT category_bidx, COUNT(*), MIN(id) FROM transactions '
+            'WHERE user_id = ? AND category_bidx IS NOT NULL GROUP BY category_bidx', (user_id,))
+
+def get_category_counts(user_id):
+    """Number of transactions per category, grouped in SQL on the blind index.
+
+    One row per group (and database) is decrypted to learn the category's name.
+    """
+    groups = []
+    rows = []
+    for manager in managers_for(user_id):
+        with manager.reader() as c:
+            c.execute(*category_counts_query(user_id))
+            found = c.fetchall()
+            c.execute(f'SELECT {TRANSACTION_FIELDS} FROM transactions WHERE id IN (SELECT value FROM json_each(?))',
+                      (json.dumps([group[2] for group in found]),))
+            groups.extend(found)
+            rows.extend(c.fetchall())
+    names = {transaction['id']: transaction['category'] for transaction in _decrypted_transactions(rows)}
+    counts = {}
+    for _, count, first_id in groups:
+        name = names.get(first_id)
+        # While a key rotation runs, one category can have an index per key.
+        if name is not None:
+            counts[name] = counts.get(name, 0) + count
+    return counts
+
+@shipped_query('encrypted transaction page for user', 1, after=(20089, 1000))
+@shipped_query('encrypted undated transaction page for user', 1, after=(None, 1000), dated=False)
+def transaction_page_query(user_id, after=None, descending=True, dated=True, limit=DEFAULT_PAGE_SIZE):
+    """``(sql, params)`` for the dated rows of a get_transactions_page() page, or with ``dated=False`` the undated ones."""
+    order = 'DESC' if descending else 'ASC'
+    query = f'SELECT {TRANSACTION_FIELDS}, date_day FROM transactions WHERE user_id = ?'
+    params = [user_id]
+    if dated:
+        query += ' AND date_day IS NOT NULL'
+        if after is not None:
+            query += ' AND (date_day, id) < (?, ?)' if descending else ' AND (date_day, id) > (?, ?)'
+            params.extend(after)
+        query += f' ORDER BY date_day {order}, id {order} LIMIT ?'
+    else:
+        query += ' AND date_day IS NULL'
+        if after is not None and after[0] is None:
+            query += ' AND id < ?' if descending else ' AND id > ?'
+            params.append(after[1])
+        query += f' ORDER BY id {order} LIMIT ?'
+    return query, params + [limit]
+
+def get_transactions_page(user_id, after=None, page_size=DEFAULT_PAGE_SIZE, descending=True):
+    """Retrieve one page of a user's transactions ordered by (date_day, id).
+
+    Pass the returned cursor as ``after`` to get the next page; it is None
+    after the last page. Rows without a valid date_day come last, in id
+    order. Only the rows on the page are decrypted.
+    """
+    rows = []
+    # A user's rows all live in one database.
+    with manager_for_user(user_id).reader() as c:
+        if after is None or after[0] is not None:
+            c.execute(*transaction_page_query(user_id, after, descending, limit=page_size))
+            rows = c.fetchall()
+        if len(rows) < page_size:
+            c.execute(*transaction_page_query(user_id, after, descending, dated=False, limit=page_size - len(rows)))
+            rows += c.fetchall()
+    cursor = (rows[-1][7], rows[-1][0]) if len(rows) == page_size else None
+    return _decrypted_transactions(rows), cursor
 
 def update_transaction(transaction_id, trans_type, amount, category, date, currency):
-    """Update an existing transaction."""
-    encrypted_amount = fernet_encrypt(str(amount))
-    encrypted_category = fernet_encrypt(category)
-    conn, c = get_db_connection()
-    try:
-        c.execute('UPDATE transactions SET type = ?, amount = ?, category = ?, date = ?, currency = ? WHERE id = ?',
-                  (trans_type, encrypted_amount, encrypted_category, date, currency, transaction_id))
-        conn.commit()
-    finally:
-        conn.close()
+    """Update an existing transaction, sealing its amount and category."""
+    sealed = seal_row(transaction_id, amount, category)
+    date_day = to_epoch_day(date)
+    with manager_for_row(transaction_id).transaction() as c:
+        c.execute('SELECT user_id FROM transactions WHERE id = ?', (transaction_id,))
+        row = c.fetchone()
+        if row is None:
+            return
+        c.execute('UPDATE transactions SET type = ?, amount = ?, category = ?, date = ?, currency = ?, date_day = ?, '
+                  'sealed = ?, category_bidx = ? WHERE id = ?',
+                  (trans_type, SEALED_AMOUNT, SEALED_CATEGORY, date, currency, date_day, sealed,
+                   blind_index(row[0], category), transaction_id))
+
+def seal_transactions(manager=None, batch_size=DEFAULT_BULK_BATCH_SIZE):
+    """Rewrite ``manager``'s transactions still holding Fernet tokens in the sealed row format.
+
+    Run it once per database holding ledger rows (see shards.all_managers()).
+    Rows are read in id order ``batch_size`` at a time and each batch is
+    committed on its own, so the migration can be stopped and run again;
+    sealed rows are skipped. Rows whose tokens do not decrypt are left as
+    they are. Returns ``(sealed, failed)``.
+    """
+    manager = manager or get_manager()
+    sealed = 0
+    failed = 0
+    last_id = 0
+    while True:
+        with manager.reader() as c:
+            c.execute("SELECT id, amount, category, user_id FROM transactions "
+                      "WHERE id > ? AND sealed IS NULL AND typeof(amount) = 'blob' ORDER BY id LIMIT ?",
+                      (last_id, batch_size))
+            rows = c.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        count = len(rows)
+        values, failed_tokens = decrypt_batch([row[1] for row in rows] + [row[2] for row in rows])
+        unreadable = {index % count for index in failed_tokens}
+        params = [(SEALED_AMOUNT, SEALED_CATEGORY, seal_row(row[0], values[i], values[count + i]),
+                   blind_index(row[3], values[count + i]), row[0])
+                  for i, row in enumerate(rows) if i not in unreadable]
+        with manager.transaction() as c:
+            # An app write since the read has already sealed the row.
+            c.executemany('UPDATE transactions SET amount = ?, category = ?, sealed = ?, category_bidx = ? '
+                          'WHERE id = ? AND sealed IS NULL', params)
+        sealed += len(params)
+        failed += len(unreadable)
+        logging.info(f"Sealed transactions up to id {last_id}: {sealed} sealed, {failed} unreadable.")
+    # The cached plaintexts belong to tokens that are gone now.
+    purge_decrypt_cache()
+    return sealed, failed
+
+def index_categories(manager=None, batch_size=DEFAULT_BULK_BATCH_SIZE):
+    """Fill category_bidx for ``manager``'s encrypted transactions written before it existed.
+
+    Works in id-ordered batches committed one at a time, like
+    seal_transactions(), so it can be stopped and run again. Returns
+    ``(indexed, failed)``.
+    """
+    manager = manager or get_manager()
+    indexed = 0
+    failed = 0
+    last_id = 0
+    while True:
+        with manager.reader() as c:
+            c.execute(f"SELECT {TRANSACTION_FIELDS}, user_id FROM transactions "
+                      "WHERE id > ? AND category_bidx IS NULL AND (sealed IS NOT NULL OR typeof(amount) = 'blob') "
+                      "ORDER BY id LIMIT ?", (last_id, batch_size))
+            rows = c.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        params = [(blind_index(row[7], transaction['category']), row[0])
+                  for row, transaction in zip(rows, _decrypted_transactions(rows)) if transaction['category'] is not None]
+        with manager.transaction() as c:
+            c.executemany('UPDATE transactions SET category_bidx = ? WHERE id = ? AND category_bidx IS NULL', params)
+        indexed += len(params)
+        failed += len(rows) - len(params)
+        logging.info(f"Indexed categories up to id {last_id}: {indexed} indexed, {failed} unreadable.")
+    return indexed, failed
 
 def delete_transaction(transaction_id):
     """Delete a transaction."""
-    conn, c = get_db_connection()
-    try:
+    with manager_for_row(transaction_id).transaction() as c:
         c.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
-        conn.commit()
-    finally:
-        conn.close()
 
 def delete_user(user_id):
-    """Delete a user and their associated data."""
-    conn, c = get_db_connection()
-    try:
-        c.execute('DELETE FROM transactions WHERE user_id = ?', (user_id,))
+    """Delete a user; the cascade trigger on users removes their data, and their shard rows go too."""
+    with transaction() as c:
         c.execute('DELETE FROM users WHERE id = ?', (user_id,))
-        conn.commit()
-    finally:
-        conn.close()
+    delete_user_data([user_id])
 
 def add_category(name, user_id):
     """Add a new category for a user."""
-    conn, c = get_db_connection()
-    try:
+    with manager_for_user(user_id).transaction() as c:
         c.execute('INSERT INTO categories (name, user_id) VALUES (?, ?)', (name, user_id))
-        conn.commit()
-    finally:
-        conn.close()
+
+@shipped_query('categories for user', 1)
+def categories_query(user_id):
+    return 'SELECT name FROM categories WHERE user_id = ?', (user_id,)
 
 def get_categories(user_id):
     """Retrieve categories for a specific user."""
-    conn, c = get_db_connection()
-    try:
-        c.execute('SELECT name FROM categories WHERE user_id = ?', (user_id,))
+    with manager_for_user(user_id).reader() as c:
+        c.execute(*categories_query(user_id))
         data = c.fetchall()
-        return [category[0] for category in data]
-    finally:
-        conn.close()
+    return [category[0] for category in data]
 
 def add_currency_rate(code, rate, date):
     """Add or update a currency rate."""
-    conn, c = get_db_connection()
-    try:
+    with transaction() as c:
         c.execute('INSERT OR REPLACE INTO currencies (code, rate, date) VALUES (?, ?, ?)', (code, rate, date))
-        conn.commit()
-    finally:
-        conn.close()
 
 def get_currency_rate(code):
     """Retrieve currency rate by code."""
-    conn, c = get_db_connection()
-    try:
+    with reader() as c:
         c.execute('SELECT rate FROM currencies WHERE code=?', (code,))
         data = c.fetchone()
-        return data[0] if data else None
-    finally:
-        conn.close()
+    return data[0] if data else None
 
 def add_budget(category, amount, user_id):
     """Add or update a budget for a category."""
-    conn, c = get_db_connection()
-    try:
+    with transaction() as c:
         c.execute('INSERT OR REPLACE INTO budgets (category, amount, user_id) VALUES (?, ?, ?)', (category, amount, user_id))
-        conn.commit()
-    finally:
-        conn.close()
+
+@shipped_query('budgets for user', 1)
+def budgets_query(user_id):
+    return 'SELECT category, amount FROM budgets WHERE user_id = ?', (user_id,)
 
 def get_budgets(user_id):
     """Retrieve budgets for a specific user."""
-    conn, c = get_db_connection()
-    try:
-        c.execute('SELECT category, amount FROM budgets WHERE user_id = ?', (user_id,))
+    with reader() as c:
+        c.execute(*budgets_query(user_id))
         data = c.fetchall()
-        return [{'category': row[0], 'amount': row[1]} for row in data]
-    finally:
-        conn.close()
+    return [{'category': row[0], 'amount': row[1]} for row in data]
 
 def add_recurring_transaction(trans_type, amount, category, start_date, frequency, user_id, currency='USD'):
     """Add a recurring transaction."""
-    conn, c = get_db_connection()
-    try:
+    with transaction() as c:
         c.execute('INSERT INTO recurring_transactions (type, amount, category, start_date, frequency, user_id, currency) VALUES (?, ?, ?, ?, ?, ?, ?)',
                   (trans_type, amount, category, start_date, frequency, user_id, currency))
-        conn.commit()
-    finally:
-        conn.close()
+
+@shipped_query('recurring transactions for user', 1)
+def recurring_transactions_query(user_id):
+    return 'SELECT * FROM recurring_transactions WHERE user_id = ?', (user_id,)
 
 def get_recurring_transactions(user_id):
     """Retrieve recurring transactions for a user."""
-    conn, c = get_db_connection()
-    try:
-        c.execute('SELECT * FROM recurring_transactions WHERE user_id = ?', (user_id,))
+    with reader() as c:
+        c.execute(*recurring_transactions_query(user_id))
         data = c.fetchall()
-        return [{'id': row[0], 'type': row[1], 'amount': row[2], 'category': row[3], 'start_date': row[4], 'frequency': row[5], 'currency': row[6]} for row in data]
-    finally:
-        conn.close()
+    return [{'id': row[0], 'type': row[1], 'amount': row[2], 'category': row[3], 'start_date': row[4], 'frequency': row[5], 'currency': row[6]} for row in data]
 
-def backup_database():
+def backup_database(compress=False):
     """Backup the current database."""
-    import shutil
-    shutil.copy('finance.db', 'finance_backup.db')
-    print("Database backup created as finance_backup.db")
-
-def restore_database():
-    """Restore the database from a backup."""
-    import shutil
-    shutil.copy('finance_backup.db', 'finance.db')
-    print("Database restored from finance_backup.db")
\ No newline at end of file
+    path = backup.backup_database(compress=compress)
+    print(f"Database backup created as {path}")
+    return path
+
+def restore_database(path=None):
+    """Restore the database from a backup (the newest one by default)."""
+    path = backup.restore_database(path)
+    print(f"Database restored from {path}")
+    return path
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    # Rows not yet split into shards still sit in the directory database.
+    for manager in dict.fromkeys([get_manager(), *all_managers()]):
+        if '--seal' in sys.argv:
+            sealed, failed = seal_transactions(manager)
+            print(f"{manager.path}: sealed {sealed} transaction(s); {failed} could not be decrypted.")
+        if '--index-categories' in sys.argv:
+            indexed, failed = index_categories(manager)
+            print(f"{manager.path}: indexed {indexed} transaction categories; {failed} could not be decrypted.")
@@ -0,0 +1,46 @@
+"""Integer day numbers for transaction dates.
+
+Dates are kept as ISO ``YYYY-MM-DD`` text for display and as the number of
+days since 1970-01-01 for indexed range filters.
+"""
+import datetime
+
+DATE_FORMAT = '%Y-%m-%d'
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# julianday() of 1970-01-01 00:00, used by SQL conversions.
+JULIAN_DAY_EPOCH = 2440587.5
+
+
+def to_epoch_day(value):
+    """Return the day number of an ISO date string, date, datetime or Timestamp.
+
+    Raises ValueError for strings that are not valid ``YYYY-MM-DD`` dates.
+    """
+    if isinstance(value, str):
+        value = value.strip()
+        if len(value) == 10 and value[4] == value[7] == '-':
+            value = datetime.date.fromisoformat(value)  # Much faster than strptime
+        else:
+            value = datetime.datetime.strptime(value, DATE_FORMAT).date()
+    elif isinstance(value, datetime.datetime) or hasattr(value, 'to_pydatetime'):
+        value = value.date()
+    if not isinstance(value, datetime.date):
+        raise ValueError(f"Unsupported date value: {value!r}")
+    return value.toordinal() - _EPOCH_ORDINAL
+
+
+def from_epoch_day(day):
+    """Return the ISO date string for a day number."""
+    return datetime.date.fromordinal(int(day) + _EPOCH_ORDINAL).strftime(DATE_FORMAT)
+
+
+def today_epoch_day():
+    return to_epoch_day(datetime.date.today())
+
+
+def month_bounds(year, month):
+    """Return the [start, end) day numbers of a calendar month."""
+    start = datetime.date(year, month, 1)
+    end = datetime.date(year + month // 12, month % 12 + 1, 1)
+    return to_epoch_day(start), to_epoch_day(end)
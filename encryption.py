@@ -1,15 +1,122 @@
-from cryptography.fernet import Fernet
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-# Load or generate the encryption key (store it securely)
-try:
-    with open('secret.key', 'rb') as key_file:
-        key = key_file.read()
-except FileNotFoundError:
-    key = Fernet.generate_key()
-    with open('secret.key', 'wb') as key_file:
-        key_file.write(key)
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
-fernet = Fernet(key)
+# Batches up to this many tokens are decrypted on the calling thread; larger
+# ones are split across worker processes, one per TOKENS_PER_WORKER tokens,
+# up to MAX_DECRYPT_WORKERS.
+INLINE_DECRYPT_LIMIT = 1024
+TOKENS_PER_WORKER = 1024
+MAX_DECRYPT_WORKERS = min(8, os.cpu_count() or 1)
+
+DEFAULT_DECRYPT_CACHE_BYTES = 8 * 1024 * 1024
+# Rough per-entry overhead of the OrderedDict slot and the digest key.
+CACHE_ENTRY_OVERHEAD = 100
+
+# Sealed transaction rows keep amount and category in one AES-GCM blob:
+#   version (1 byte) | key id (2 bytes) | nonce (12 bytes) | ciphertext + tag (16 bytes)
+# The plaintext is a 2-byte amount length, the amount text, then the
+# category text. The version byte, key id and row id are the associated
+# data, so a blob copied onto another row does not open. Version 1 blobs
+# have no key id and were always sealed with LEGACY_KEY_ID.
+ROW_FORMAT_V1 = 1
+ROW_FORMAT_V2 = 2
+ROW_NONCE_SIZE = 12
+
+# Bytes of HMAC-SHA256 kept for a blind index.
+BLIND_INDEX_SIZE = 16
+
+KEY_FILE = 'secret.key'
+# Once a key has been rotated the ring lives here: {"active": id, "keys": {id: key}}.
+KEYRING_FILE = 'keyring.json'
+LEGACY_KEY_ID = 1
+
+def _load_legacy_key():
+    # Load or generate the original key (store it securely)
+    try:
+        with open(KEY_FILE, 'rb') as key_file:
+            return key_file.read()
+    except FileNotFoundError:
+        new_key = Fernet.generate_key()
+        with open(KEY_FILE, 'wb') as key_file:
+            key_file.write(new_key)
+        return new_key
+
+def load_keyring():
+    """Return ``(active_id, {key_id: key})``; just secret.key until a key is rotated."""
+    try:
+        with open(KEYRING_FILE, 'r') as file:
+            ring = json.load(file)
+    except FileNotFoundError:
+        return LEGACY_KEY_ID, {LEGACY_KEY_ID: _load_legacy_key()}
+    return int(ring['active']), {int(key_id): value.encode() for key_id, value in ring['keys'].items()}
+
+def save_keyring(active_id, keys):
+    """Write the ring owner-readable only, replacing the old file in one step."""
+    partial = KEYRING_FILE + '.partial'
+    handle = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(handle, 'w') as file:
+        json.dump({'active': active_id, 'keys': {str(key_id): value.decode() for key_id, value in keys.items()}}, file)
+    os.replace(partial, KEYRING_FILE)
+
+def derive_row_key(fernet_key):
+    """AES-256 key for sealed rows, derived from a Fernet key."""
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'finance transaction rows v1')
+    return hkdf.derive(base64.urlsafe_b64decode(fernet_key))
+
+def derive_index_key(fernet_key):
+    """HMAC key for blind indexes, derived from a Fernet key."""
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'finance category blind index v1')
+    return hkdf.derive(base64.urlsafe_b64decode(fernet_key))
+
+def _fernet_for(active_id, keys):
+    """MultiFernet that encrypts with the active key and decrypts with any key in the ring."""
+    ordered = [keys[active_id]] + [keys[key_id] for key_id in sorted(keys, reverse=True) if key_id != active_id]
+    return MultiFernet([Fernet(value) for value in ordered])
+
+def use_keyring(active_id, keys):
+    """Encrypt with ``keys[active_id]`` from now on; anything under another ring key stays readable."""
+    global keyring, active_key_id, key, fernet, row_ciphers, index_keys
+    if active_id not in keys:
+        raise ValueError(f"Active key {active_id} is not in the key ring.")
+    keyring = dict(keys)
+    active_key_id = active_id
+    key = keys[active_id]
+    fernet = _fernet_for(active_id, keys)
+    row_ciphers = {key_id: AESGCM(derive_row_key(value)) for key_id, value in keys.items()}
+    index_keys = {key_id: derive_index_key(value) for key_id, value in keys.items()}
+    # Workers hold the old ring, and cached values would outlive a retired key.
+    shutdown_decrypt_pool()
+    purge_decrypt_cache()
+
+def rotate_key():
+    """Add a new key to the ring and make it active; returns its id.
+
+    Data under older keys stays readable. rotation.reencrypt_transactions()
+    moves it to the new key.
+    """
+    keys = dict(keyring)
+    new_id = max(keys) + 1
+    keys[new_id] = Fernet.generate_key()
+    save_keyring(new_id, keys)
+    use_keyring(new_id, keys)
+    logging.info(f"Encryption key rotated; key {new_id} is now active.")
+    return new_id
 
 def fernet_encrypt(data):
     """Encrypt the data using Fernet encryption."""
@@ -19,6 +126,11 @@ def fernet_encrypt(data):
         print(f"Encryption failed: {e}")
         return None
 
+def encrypt_batch(values):
+    """Encrypt a list of strings with the shared key, returning tokens in order."""
+    encrypt = fernet.encrypt
+    return [encrypt(value.encode()) for value in values]
+
 def fernet_decrypt(data):
     """Decrypt the data using Fernet encryption."""
     try:
@@ -28,3 +140,240 @@ def fernet_decrypt(data):
     except Exception as e:
         print(f"Decryption failed: {e}")
         return None
+
+def blind_index(user_id, value, key_id=None):
+    """Keyed HMAC of ``value`` so equal values can be matched without decrypting.
+
+    The user id is part of the input, so the same category of two users
+    gives different indexes. Uses the active key unless ``key_id`` is given.
+    """
+    index_key = index_keys[active_key_id if key_id is None else key_id]
+    message = struct.pack('>q', int(user_id)) + value.encode()
+    return hmac.new(index_key, message, hashlib.sha256).digest()[:BLIND_INDEX_SIZE]
+
+def blind_indexes(user_id, value):
+    """blind_index() under every key in the ring, for lookups while a rotation is under way."""
+    return [blind_index(user_id, value, key_id) for key_id in sorted(index_keys)]
+
+def sealed_prefix(key_id):
+    """Leading bytes of every blob seal_row() writes under ``key_id``."""
+    return bytes([ROW_FORMAT_V2]) + struct.pack('>H', key_id)
+
+def seal_row(row_id, amount, category):
+    """Encrypt a transaction's amount and category into one blob bound to ``row_id``."""
+    amount = str(amount).encode()
+    payload = struct.pack('>H', len(amount)) + amount + category.encode()
+    nonce = os.urandom(ROW_NONCE_SIZE)
+    prefix = sealed_prefix(active_key_id)
+    return prefix + nonce + row_ciphers[active_key_id].encrypt(nonce, payload, prefix + struct.pack('>q', row_id))
+
+def open_row(row_id, blob):
+    """Return ``(amount, category)`` from a sealed blob; raises ValueError if it does not open."""
+    blob = bytes(blob)
+    if blob[:1] == bytes([ROW_FORMAT_V2]) and len(blob) >= 3:
+        prefix = blob[:3]
+        (key_id,) = struct.unpack('>H', prefix[1:])
+        associated_data = prefix + struct.pack('>q', row_id)
+    elif blob[:1] == bytes([ROW_FORMAT_V1]):
+        prefix = blob[:1]
+        key_id = LEGACY_KEY_ID
+        associated_data = struct.pack('>Bq', ROW_FORMAT_V1, row_id)
+    else:
+        raise ValueError(f"Unknown sealed row format {blob[:1]!r}.")
+    cipher = row_ciphers.get(key_id)
+    if cipher is None:
+        raise ValueError(f"Sealed row {row_id} uses key {key_id}, which is not in the key ring.")
+    nonce = blob[len(prefix):len(prefix) + ROW_NONCE_SIZE]
+    try:
+        payload = cipher.decrypt(nonce, blob[len(prefix) + ROW_NONCE_SIZE:], associated_data)
+        (length,) = struct.unpack_from('>H', payload)
+    except (InvalidTag, struct.error):
+        raise ValueError(f"Sealed row {row_id} failed to open.")
+    return payload[2:2 + length].decode(), payload[2 + length:].decode()
+
+def open_rows(rows):
+    """Open ``(row_id, blob)`` pairs, returning ``(values, failed)`` like decrypt_batch().
+
+    Each value is an ``(amount, category)`` pair, or None if the blob did not open.
+    """
+    values = []
+    failed = []
+    for index, (row_id, blob) in enumerate(rows):
+        try:
+            values.append(open_row(row_id, blob))
+        except ValueError:
+            values.append(None)
+            failed.append(index)
+    return values, failed
+
+def _decrypt_chunk(tokens):
+    """Decrypt tokens in order; returns ``(values, failed)`` with None for each failure."""
+    decrypt = fernet.decrypt
+    values = []
+    failed = []
+    for index, token in enumerate(tokens):
+        try:
+            if isinstance(token, str):
+                token = token.encode()
+            values.append(decrypt(token).decode())
+        except Exception:
+            values.append(None)
+            failed.append(index)
+    return values, failed
+
+def _init_decrypt_worker(active_id, keys):
+    global fernet
+    fernet = _fernet_for(active_id, keys)
+
+_decrypt_pool = None
+_decrypt_pool_lock = threading.Lock()
+
+def _get_decrypt_pool():
+    global _decrypt_pool
+    with _decrypt_pool_lock:
+        if _decrypt_pool is None:
+            # Workers are spawned rather than forked: the app has Tk and
+            # task threads running by the time the first large batch arrives.
+            _decrypt_pool = ProcessPoolExecutor(max_workers=MAX_DECRYPT_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_init_decrypt_worker, initargs=(active_key_id, keyring))
+        return _decrypt_pool
+
+def shutdown_decrypt_pool():
+    """Stop the decryption worker processes; the next large batch starts new ones."""
+    global _decrypt_pool
+    with _decrypt_pool_lock:
+        if _decrypt_pool is not None:
+            _decrypt_pool.shutdown(wait=False, cancel_futures=True)
+            _decrypt_pool = None
+
+class DecryptCache:
+    """LRU map of token digest -> decrypted value, capped at ``max_bytes``.
+
+    Only a digest of each token is kept as the key. Values stay in this
+    process's memory and are never written out; purge() drops them all.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_DECRYPT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(token):
+        if isinstance(token, str):
+            token = token.encode()
+        if not isinstance(token, bytes):
+            return None
+        return hashlib.blake2b(token, digest_size=16).digest()
+
+    def get_many(self, digests):
+        """Cached values for ``digests`` in order, None for each miss."""
+        values = []
+        with self._lock:
+            for digest in digests:
+                value = self._entries.get(digest)
+                if value is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                values.append(value)
+        return values
+
+    def put_many(self, items):
+        """Store ``(digest, value)`` pairs, evicting least recently used entries."""
+        with self._lock:
+            for digest, value in items:
+                if digest is None or value is None or digest in self._entries:
+                    continue
+                self._entries[digest] = value
+                self.bytes += sys.getsizeof(value) + CACHE_ENTRY_OVERHEAD
+            while self.bytes > self.max_bytes and self._entries:
+                _, value = self._entries.popitem(last=False)
+                self.bytes -= sys.getsizeof(value) + CACHE_ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def purge(self):
+        """Forget every decrypted value, e.g. on logout or key rotation."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+            }
+
+# Shared cache consulted by decrypt_batch(); None when caching is off.
+decrypt_cache = DecryptCache()
+
+def configure_decrypt_cache(max_bytes=DEFAULT_DECRYPT_CACHE_BYTES):
+    """Replace the shared cache with an empty one, or switch caching off when ``max_bytes`` is falsy."""
+    global decrypt_cache
+    if decrypt_cache is not None:
+        decrypt_cache.purge()
+    decrypt_cache = DecryptCache(max_bytes) if max_bytes else None
+    return decrypt_cache
+
+def purge_decrypt_cache():
+    """Drop every cached plaintext; call on logout and after a key change."""
+    if decrypt_cache is not None:
+        decrypt_cache.purge()
+
+def decrypt_batch(tokens):
+    """Decrypt a list of tokens, returning ``(values, failed)``.
+
+    ``values`` is in the order of ``tokens``, with None for every token that
+    could not be decrypted, and ``failed`` lists those tokens' indexes.
+    Nothing is printed per failure; callers decide how to report them.
+    Tokens found in the shared cache are not decrypted again. Small batches
+    are decrypted inline; large ones are split into ordered chunks across a
+    pool of worker processes sized to the batch.
+    """
+    tokens = list(tokens)
+    cache = decrypt_cache
+    if cache is None:
+        return _decrypt_tokens(tokens)
+    digests = [cache.digest(token) for token in tokens]
+    values = cache.get_many(digests)
+    missing = [index for index, value in enumerate(values) if value is None]
+    if not missing:
+        return values, []
+    decrypted, failed = _decrypt_tokens([tokens[index] for index in missing])
+    for index, value in zip(missing, decrypted):
+        values[index] = value
+    cache.put_many((digests[index], value) for index, value in zip(missing, decrypted))
+    return values, [missing[index] for index in failed]
+
+def _decrypt_tokens(tokens):
+    workers = min(MAX_DECRYPT_WORKERS, len(tokens) // TOKENS_PER_WORKER)
+    if len(tokens) <= INLINE_DECRYPT_LIMIT or workers < 2:
+        return _decrypt_chunk(tokens)
+    chunk_size = -(-len(tokens) // workers)
+    chunks = [tokens[start:start + chunk_size] for start in range(0, len(tokens), chunk_size)]
+    try:
+        results = list(_get_decrypt_pool().map(_decrypt_chunk, chunks))
+    except Exception as e:
+        logging.warning(f"Parallel decryption unavailable, decrypting inline: {e}")
+        shutdown_decrypt_pool()
+        return _decrypt_chunk(tokens)
+    values = []
+    failed = []
+    for offset, (chunk_values, chunk_failed) in zip(range(0, len(tokens), chunk_size), results):
+        values.extend(chunk_values)
+        failed.extend(offset + index for index in chunk_failed)
+    return values, failed
+
+use_keyring(*load_keyring())
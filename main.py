@@ -2,16 +2,15 @@ import os
 import json
 import requests
 import threading
+import time
 import pandas as pd
 import matplotlib.pyplot as plt
 import tkinter as tk
 from tkinter import messagebox, ttk, filedialog
 from tkcalendar import DateEntry
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from datetime import timedelta
 import bcrypt
 import sqlite3
-import shutil
 import secrets
 from reportlab.lib.pagesizes import letter, landscape
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle
@@ -19,221 +18,411 @@ from reportlab.lib.styles import getSampleStyleSheet
 import io
 import seaborn as sns  # Import here to avoid unnecessary imports at the top
 import logging
+import heapq
 import openpyxl
+from analytics import load_monthly_rollups_frame, load_transactions_frame
+from backup import BackupJob, restore_database
+from cache import ALL_USERS, TransactionCache
+from changes import ChangeTracker, table_version
+from connection import (
+    STORAGE_PROFILES, benchmark_storage_profiles, get_manager, reader,
+    set_storage_profile, transaction as write_transaction
+)
+from dates import month_bounds, to_epoch_day, today_epoch_day
+from migrations import migrate, shipped_query
+from money import from_minor, sum_minor, to_minor, currency_exponent
+from shards import (
+    delete_user_data, ledger_snapshot, manager_for_row, manager_for_user, managers_for
+)
+from tasks import TaskRunner
 
 logging.basicConfig(filename='app.log', level=logging.ERROR)
 
-# Database connection
-def get_db_connection():
-    """Establish a connection to the SQLite database."""
-    conn = sqlite3.connect('finance.db')
-    return conn, conn.cursor()
+DEFAULT_PAGE_SIZE = 200
+USER_PAGE_SIZE = 100
+DEFAULT_FETCH_SIZE = 1000
+RATES_REFRESH_SECONDS = 15 * 60
+TRANSACTION_COLUMNS = 'id, type, amount, category, date, currency, amount_minor, currency_exponent, user_id, date_day'
 
-def init_db():
-    """Initialize the database with the required tables."""
-    conn, c = get_db_connection()
-    try:
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                secret_key TEXT NOT NULL,
-                is_admin INTEGER DEFAULT 0
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                type TEXT NOT NULL,
-                amount REAL NOT NULL,
-                category TEXT NOT NULL,
-                date TEXT NOT NULL,
-                currency TEXT DEFAULT 'USD',
-                user_id INTEGER NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        # Add planned_transactions table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS planned_transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                type TEXT NOT NULL,
-                amount REAL NOT NULL,
-                category TEXT NOT NULL,
-                planned_date TEXT NOT NULL,
-                currency TEXT DEFAULT 'USD',
-                user_id INTEGER NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        conn.commit()
-    finally:
-        conn.close()
-
-def migrate_is_admin_column():
-    """Ensure that all users have the 'is_admin' column properly set."""
-    conn, c = get_db_connection()
-    try:
-        c.execute('UPDATE users SET is_admin = 0 WHERE is_admin IS NULL')
-        conn.commit()
-    except sqlite3.OperationalError as e:
-        print(f"Database error during migration: {e}")
-    finally:
-        conn.close()
-
-def setup_admin_user():
-    """Create or ensure an admin user exists."""
-    username = "admin"
-    password = "admin123"
+# Session cache of transaction rows, updated in place by the app's own writes.
+transaction_cache = TransactionCache()
 
-
-    conn, c = get_db_connection()
-    try:
-        # Check if admin user exists
-        c.execute("SELECT id FROM users WHERE username = ?", (username,))
-        if not c.fetchone():
-            # Add admin user
-            hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-            secret_key = secrets.token_hex(16)
-            c.execute(
-                'INSERT INTO users (username, password, secret_key, is_admin) VALUES (?, ?, ?, ?)',
-                (username, hashed_password, secret_key, 1)
-            )
-            conn.commit()
-            print("Admin user added.")
-        else:
-            print("Admin user already exists.")
-    finally:
-        conn.close()
+def init_db():
+    """Initialize the database schema, applying any pending migrations."""
+    migrate()
 
 def add_user(username, password, secret_key):
     """Add a new user to the database."""
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    conn, c = get_db_connection()
     try:
-        c.execute(
-            'INSERT INTO users (username, password, secret_key) VALUES (?, ?, ?)',
-            (username, hashed_password.decode('utf-8'), secret_key)
-        )
-        conn.commit()
+        with write_transaction() as c:
+            c.execute(
+                'INSERT INTO users (username, password, secret_key) VALUES (?, ?, ?)',
+                (username, hashed_password.decode('utf-8'), secret_key)
+            )
         return True
     except sqlite3.IntegrityError:
         # Handle case where username is not unique
         return False
-    finally:
-        conn.close()
+
+@shipped_query('user by name', 'admin')
+def user_by_name_query(username):
+    return 'SELECT id, password, secret_key, is_admin FROM users WHERE username = ?', (username,)
 
 def verify_user(username, password, secret_key):
     """Verify user credentials including the secret key."""
-    conn, c = get_db_connection()
-    try:
-        c.execute('SELECT id, password, secret_key, is_admin FROM users WHERE username = ?', (username,))
+    with reader() as c:
+        c.execute(*user_by_name_query(username))
         user = c.fetchone()
-        if user:
-            user_id, hashed_password, stored_secret_key, is_admin = user
-            if bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8')) and stored_secret_key == secret_key:
-                return user_id, bool(is_admin)  # Return user ID and admin status
-        return None, False
-    finally:
-        conn.close()
+    if user:
+        user_id, hashed_password, stored_secret_key, is_admin = user
+        if bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8')) and stored_secret_key == secret_key:
+            return user_id, bool(is_admin)  # Return user ID and admin status
+    return None, False
         
 def get_users():
     """Retrieve all users from the database."""
-    conn, c = get_db_connection()
-    try:
+    with reader() as c:
         c.execute('SELECT id, username, is_admin FROM users')
         users = c.fetchall()
-        return [{'id': user[0], 'username': user[1], 'is_admin': user[2]} for user in users]
-    finally:
-        conn.close()
-
-def get_planned_transactions(user_id, is_admin=False):
-    conn, c = get_db_connection()
-    try:
-        if is_admin:
-            c.execute('SELECT * FROM planned_transactions')
+    return [{'id': user[0], 'username': user[1], 'is_admin': user[2]} for user in users]
+
+def fold_case(text):
+    """Lowercase ASCII letters only, the way SQLite's NOCASE collation compares."""
+    return ''.join(ch.lower() if 'A' <= ch <= 'Z' else ch for ch in text)
+
+def nocase_successor(prefix):
+    """Smallest string above every name starting with ``prefix`` under NOCASE.
+
+    ``prefix`` must already be folded. Its last character is bumped, skipping
+    'A'-'Z', which NOCASE would fold back below the prefix ('@' becomes '[').
+    """
+    following = chr(ord(prefix[-1]) + 1)
+    if 'A' <= following <= 'Z':
+        following = chr(ord('Z') + 1)
+    return prefix[:-1] + following
+
+@shipped_query('user page by name prefix', 'adm')
+@shipped_query('next user page by name prefix', 'adm', after=('admin', 1))
+def users_page_query(query='', after=None, page_size=USER_PAGE_SIZE, anywhere=False, has_fts=False):
+    """``(sql, params)`` for get_users_page(); ``has_fts`` tells whether users_fts exists."""
+    source, conditions, params = 'users', [], []
+    if query and anywhere:
+        if has_fts and len(query) >= 3:
+            source = 'users JOIN users_fts ON users_fts.rowid = users.id'
+            conditions.append('users_fts MATCH ?')
+            params.append('"' + query.replace('"', '""') + '"')
         else:
-            c.execute('SELECT * FROM planned_transactions WHERE user_id = ?', (user_id,))
-        transactions = c.fetchall()
-        columns = [desc[0] for desc in c.description]
-        return [dict(zip(columns, transaction)) for transaction in transactions]
-    finally:
-        conn.close()
+            escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("users.username LIKE ? ESCAPE '\\'")
+            params.append(f'%{escaped}%')
+    elif query:
+        prefix = fold_case(query)
+        conditions.append('users.username COLLATE NOCASE < ?')
+        params.append(nocase_successor(prefix))
+        if after is None:
+            conditions.append('users.username COLLATE NOCASE >= ?')
+            params.append(prefix)
+    if after is not None:
+        # The scalar bound lets SQLite seek the index; the row value breaks ties.
+        conditions.append('users.username COLLATE NOCASE >= ?')
+        conditions.append('(users.username COLLATE NOCASE, users.id) > (?, ?)')
+        params.extend((after[0], after[0], after[1]))
+    sql = f'SELECT users.id, users.username, users.is_admin FROM {source}'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY users.username COLLATE NOCASE, users.id LIMIT ?'
+    return sql, params + [page_size]
+
+def get_users_page(query='', after=None, page_size=USER_PAGE_SIZE, anywhere=False):
+    """Return one page of users ordered by username (ignoring case), then id.
+
+    ``query`` is a username prefix answered from the NOCASE index. With
+    ``anywhere`` it may occur anywhere in the name; that uses the users_fts
+    trigram index for queries of three or more characters when the index
+    exists, and a LIKE scan otherwise. Returns ``(users, cursor)``; pass
+    ``cursor`` back as ``after`` for the next page. It is None after the last.
+    """
+    query = query.strip()
+    with reader() as c:
+        has_fts = False
+        if query and anywhere:
+            c.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")
+            has_fts = c.fetchone() is not None
+        c.execute(*users_page_query(query, after, page_size, anywhere, has_fts))
+        rows = c.fetchall()
+    cursor = (rows[-1][1], rows[-1][0]) if len(rows) == page_size else None
+    return [{'id': user[0], 'username': user[1], 'is_admin': user[2]} for user in rows], cursor
+
+def delete_users(user_ids):
+    """Delete users and everything they own; returns the number of users deleted.
+
+    One statement in one transaction for the whole list; the cascade trigger
+    on users removes their rows from the other tables.
+    """
+    ids = json.dumps([int(user_id) for user_id in user_ids])
+    with write_transaction() as c:
+        c.execute('DELETE FROM users WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+        deleted = c.rowcount
+    delete_user_data(user_ids)
+    return deleted
+
+def set_users_admin(user_ids, is_admin):
+    """Grant or revoke admin rights for a list of users in one statement."""
+    ids = json.dumps([int(user_id) for user_id in user_ids])
+    with write_transaction() as c:
+        c.execute('UPDATE users SET is_admin = ? WHERE id IN (SELECT value FROM json_each(?))',
+                  (1 if is_admin else 0, ids))
+        return c.rowcount
+
+def day_range_clause(column, start_day=None, end_day=None):
+    """Build an indexed [start_day, end_day) predicate on an epoch-day column."""
+    conditions, params = [], []
+    if start_day is not None:
+        conditions.append(f'{column} >= ?')
+        params.append(start_day)
+    if end_day is not None:
+        conditions.append(f'{column} < ?')
+        params.append(end_day)
+    return conditions, params
+
+@shipped_query('planned transactions for user', 1)
+@shipped_query('planned transactions in date range', 1, False, 19723, 19730)
+def planned_transactions_query(user_id, is_admin=False, start_day=None, end_day=None):
+    conditions, params = day_range_clause('planned_day', start_day, end_day)
+    if not is_admin:
+        conditions.insert(0, 'user_id = ?')
+        params.insert(0, user_id)
+    query = 'SELECT * FROM planned_transactions'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return query, params
+
+def get_planned_transactions(user_id, is_admin=False, start_day=None, end_day=None):
+    query, params = planned_transactions_query(user_id, is_admin, start_day, end_day)
+    planned = []
+    for manager in managers_for(user_id, is_admin):
+        with manager.reader() as c:
+            c.execute(query, params)
+            columns = [desc[0] for desc in c.description]
+            planned.extend(dict(zip(columns, transaction)) for transaction in c.fetchall())
+    return planned
 
 def add_planned_transaction(user_id, trans_type, amount, category, planned_date, currency='USD'):
-    conn, c = get_db_connection()
-    try:
+    planned_day = to_epoch_day(planned_date)
+    with manager_for_user(user_id).transaction() as c:
         c.execute('''
-            INSERT INTO planned_transactions (type, amount, category, planned_date, currency, user_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (trans_type, amount, category, planned_date, currency, user_id))
-        conn.commit()
-    finally:
-        conn.close()
+            INSERT INTO planned_transactions (type, amount, category, planned_date, currency, user_id, planned_day)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (trans_type, amount, category, planned_date, currency, user_id, planned_day))
 
 def update_planned_transaction(transaction_id, trans_type, amount, category, planned_date, currency):
-    conn, c = get_db_connection()
-    try:
+    planned_day = to_epoch_day(planned_date)
+    with manager_for_row(transaction_id).transaction() as c:
         c.execute('''
             UPDATE planned_transactions
-            SET type = ?, amount = ?, category = ?, planned_date = ?, currency = ?
+            SET type = ?, amount = ?, category = ?, planned_date = ?, currency = ?, planned_day = ?
             WHERE id = ?
-        ''', (trans_type, amount, category, planned_date, currency, transaction_id))
-        conn.commit()
-    finally:
-        conn.close()
+        ''', (trans_type, amount, category, planned_date, currency, planned_day, transaction_id))
 
 def delete_planned_transaction(transaction_id):
-    conn, c = get_db_connection()
-    try:
+    with manager_for_row(transaction_id).transaction() as c:
         c.execute('DELETE FROM planned_transactions WHERE id = ?', (transaction_id,))
-        conn.commit()
-    finally:
-        conn.close()
-
-def get_transactions(user_id, is_admin=False):
-    conn, c = get_db_connection()
-    try:
-        if is_admin:
-            c.execute('SELECT id, type, amount, category, date, currency, user_id FROM transactions')
-        else:
-            c.execute('SELECT id, type, amount, category, date, currency FROM transactions WHERE user_id = ?', (user_id,))
-        transactions = c.fetchall()
-        return [
-            {
-                'id': t[0],
-                'type': t[1],
-                'amount': t[2],
-                'category': t[3],
-                'date': t[4],
-                'currency': t[5],
-                'user_id': t[6] if is_admin else None  # Include user_id for admin
-            }
-            for t in transactions
-        ]
-    finally:
-        conn.close()
-
-def backup_database():
-    """Backup the current database."""
-    try:
-        shutil.copy('finance.db', 'finance_backup.db')
-        print("Database backup created as finance_backup.db")
-        messagebox.showinfo("Success", "Database backup created successfully.")
-    except Exception as e:
-        print(f"Error creating database backup: {e}")
-        messagebox.showerror("Error", f"Failed to create database backup: {e}")
 
-def restore_database():
-    """Restore the database from a backup."""
-    try:
-        shutil.copy('finance_backup.db', 'finance.db')
-        print("Database restored from finance_backup.db")
-        messagebox.showinfo("Success", "Database restored successfully.")
-    except Exception as e:
-        print(f"Error restoring database: {e}")
-        messagebox.showerror("Error", f"Failed to restore database: {e}")
+def transaction_conditions(user_id, is_admin=False, start_day=None, end_day=None):
+    """WHERE conditions and params shared by the transaction listing queries."""
+    conditions, params = day_range_clause('date_day', start_day, end_day)
+    if not is_admin:
+        conditions.insert(0, 'user_id = ?')
+        params.insert(0, user_id)
+    return conditions, params
+
+def transaction_dict(t):
+    return {
+        'id': t[0],
+        'type': t[1],
+        'amount': t[2],
+        'category': t[3],
+        'date': t[4],
+        'currency': t[5],
+        'amount_minor': t[6],
+        'currency_exponent': t[7],
+        'user_id': t[8]
+    }
+
+@shipped_query('transactions for user', 1)
+@shipped_query('transactions in date range', 1, False, 19723, 20089)
+def transactions_query(user_id, is_admin=False, start_day=None, end_day=None):
+    conditions, params = transaction_conditions(user_id, is_admin, start_day, end_day)
+    query = f'SELECT {TRANSACTION_COLUMNS} FROM transactions'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return query, params
+
+def iter_transaction_rows(user_id, is_admin=False, start_day=None, end_day=None, chunk_size=DEFAULT_FETCH_SIZE):
+    """Yield raw TRANSACTION_COLUMNS tuples, fetching ``chunk_size`` rows per round trip."""
+    query, params = transactions_query(user_id, is_admin, start_day, end_day)
+    for manager in managers_for(user_id, is_admin):
+        with manager.reader() as c:
+            c.execute(query, params)
+            while True:
+                rows = c.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+
+def iter_transactions(user_id, is_admin=False, start_day=None, end_day=None, chunk_size=DEFAULT_FETCH_SIZE):
+    """Yield transactions one at a time, fetching ``chunk_size`` rows per round trip.
+
+    Only one chunk is held in memory, so running totals over a long history
+    stay cheap. The reader connection is held until the generator finishes
+    or is closed.
+    """
+    for t in iter_transaction_rows(user_id, is_admin, start_day, end_day, chunk_size):
+        yield transaction_dict(t)
+
+def cached_transactions(user_id, is_admin=False):
+    """The session cache entry for a user's transactions (every user's for admin).
+
+    Returns None when they do not fit in the cache.
+    """
+    def load():
+        for t in iter_transaction_rows(user_id, is_admin):
+            yield transaction_dict(t), t[9]
+    versions = {}
+    for manager in managers_for(user_id, is_admin):
+        with manager.reader() as c:
+            versions[manager.path] = table_version(c, 'transactions')
+    transaction_cache.sync(versions)
+    return transaction_cache.get(ALL_USERS if is_admin else user_id, load)
+
+def get_transactions(user_id, is_admin=False, start_day=None, end_day=None):
+    if start_day is None and end_day is None:
+        cached = cached_transactions(user_id, is_admin)
+        if cached is not None:
+            return cached.all()
+    return list(iter_transactions(user_id, is_admin, start_day, end_day))
+
+@shipped_query('transaction page for user', 1, after=(20089, 1000))
+@shipped_query('transaction page for all users', 1, is_admin=True, after=(20089, 1000))
+@shipped_query('undated transaction page for user', 1, after=(None, 1000), dated=False)
+@shipped_query('undated transaction page for all users', 1, is_admin=True, after=(None, 1000), dated=False)
+def transaction_page_query(user_id, is_admin=False, after=None, descending=True, start_day=None, end_day=None,
+                           dated=True, limit=DEFAULT_PAGE_SIZE):
+    """``(sql, params)`` for the dated rows of a get_transactions_page() page, or with ``dated=False`` the undated ones."""
+    conditions, params = transaction_conditions(user_id, is_admin, start_day, end_day)
+    order = 'DESC' if descending else 'ASC'
+    if dated:
+        conditions.append('date_day IS NOT NULL')
+        if after is not None:
+            conditions.append('(date_day, id) < (?, ?)' if descending else '(date_day, id) > (?, ?)')
+            params.extend(after)
+        order_by = f'date_day {order}, id {order}'
+    else:
+        conditions.append('date_day IS NULL')
+        if after is not None and after[0] is None:
+            conditions.append('id < ?' if descending else 'id > ?')
+            params.append(after[1])
+        order_by = f'id {order}'
+    query = (f'SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE ' + ' AND '.join(conditions)
+             + f' ORDER BY {order_by} LIMIT ?')
+    return query, params + [limit]
+
+def merged_transaction_rows(user_id, is_admin, query, params, limit, key, descending):
+    """The first ``limit`` rows of ``query`` in its order across every database the user's rows live in."""
+    pages = []
+    for manager in managers_for(user_id, is_admin):
+        with manager.reader() as c:
+            c.execute(query, params)
+            pages.append(c.fetchall())
+    # Every shard's page is in order; the first ``limit`` of their merge is the page.
+    return list(heapq.merge(*pages, key=key, reverse=descending))[:limit]
+
+def get_transactions_page(user_id, is_admin=False, after=None, page_size=DEFAULT_PAGE_SIZE,
+                          descending=True, start_day=None, end_day=None):
+    """Return one page of transactions ordered by (date_day, id).
+
+    ``after`` is the cursor returned with the previous page; pages run newest
+    first unless ``descending`` is False. Returns ``(transactions, cursor)``
+    where ``cursor`` is None once the last page has been read. Each page is an
+    index range scan, so its cost does not grow with how far the user has
+    scrolled. Rows without a valid date_day come last, in id order, so they
+    can still be found and fixed; their cursors have a None day. Unfiltered
+    pages are served from the session cache when it holds the user's rows.
+    """
+    if start_day is None and end_day is None:
+        cached = cached_transactions(user_id, is_admin)
+        if cached is not None:
+            return cached.page(after, page_size, descending)
+    rows = []
+    if after is None or after[0] is not None:
+        query, params = transaction_page_query(user_id, is_admin, after, descending, start_day, end_day,
+                                               limit=page_size)
+        rows = merged_transaction_rows(user_id, is_admin, query, params, page_size,
+                                       lambda t: (t[9], t[0]), descending)
+    # A day range cannot match undated rows.
+    if len(rows) < page_size and start_day is None and end_day is None:
+        query, params = transaction_page_query(user_id, is_admin, after, descending, dated=False,
+                                               limit=page_size - len(rows))
+        rows += merged_transaction_rows(user_id, is_admin, query, params, page_size - len(rows),
+                                        lambda t: t[0], descending)
+    cursor = (rows[-1][9], rows[-1][0]) if len(rows) == page_size else None
+    return [transaction_dict(t) for t in rows], cursor
+
+@shipped_query('transaction categories for user', 1)
+def transaction_categories_query(user_id):
+    return 'SELECT DISTINCT category FROM transactions WHERE user_id = ?', (user_id,)
+
+def get_transaction_categories(user_id):
+    """Distinct categories the user has transactions in."""
+    with manager_for_user(user_id).reader() as c:
+        c.execute(*transaction_categories_query(user_id))
+        return [row[0] for row in c.fetchall()]
+
+def merge_currency_totals(rows):
+    """Add up (currency, exponent, minor total) rows from several shards into major units."""
+    totals = {}
+    for currency, exponent, total in rows:
+        known_exponent, known_total = totals.get(currency, (exponent, 0))
+        totals[currency] = (max(known_exponent, exponent), known_total + total)
+    return {currency: from_minor(total, exponent) for currency, (exponent, total) in totals.items()}
+
+@shipped_query('balance by currency', 1)
+def balances_query(user_id, is_admin=False):
+    if is_admin:
+        return 'SELECT currency, MAX(currency_exponent), SUM(amount) FROM balances GROUP BY currency', ()
+    return 'SELECT currency, currency_exponent, amount FROM balances WHERE user_id = ?', (user_id,)
+
+def get_balances_by_currency(user_id, is_admin=False):
+    """Return the net balance per currency from the trigger-maintained balances table."""
+    rows = []
+    for manager in managers_for(user_id, is_admin):
+        with manager.reader() as c:
+            c.execute(*balances_query(user_id, is_admin))
+            rows.extend(c.fetchall())
+    return merge_currency_totals(rows)
+
+@shipped_query('totals by currency in date range', 1, 'income', 19723, 19754)
+def totals_query(user_id, trans_type, start_day, end_day, is_admin=False):
+    query = '''
+        SELECT currency, MAX(currency_exponent), SUM(amount_minor)
+        FROM transactions
+        WHERE type = ? AND date_day >= ? AND date_day < ? AND amount_minor IS NOT NULL
+    '''
+    params = (trans_type, start_day, end_day)
+    if not is_admin:
+        query += ' AND user_id = ?'
+        params += (user_id,)
+    return query + ' GROUP BY currency', params
+
+def get_totals_by_currency(user_id, trans_type, start_day, end_day, is_admin=False):
+    """Return per-currency totals of one transaction type for day numbers in [start_day, end_day)."""
+    rows = []
+    for manager in managers_for(user_id, is_admin):
+        with manager.reader() as c:
+            c.execute(*totals_query(user_id, trans_type, start_day, end_day, is_admin))
+            rows.extend(c.fetchall())
+    return merge_currency_totals(rows)
 
 def generate_and_save_secret_key(username, admin_id=None, is_admin=False):
     """Generate and save a secret key for the user."""
@@ -267,15 +456,13 @@ def generate_and_save_secret_key(username, admin_id=None, is_admin=False):
 
 def delete_all_users():
     """Delete all users from the database."""
-    conn, c = get_db_connection()
     try:
-        c.execute('DELETE FROM users')
-        conn.commit()
+        with write_transaction() as c:
+            c.execute('DELETE FROM users')
+        delete_user_data()
         print("All users have been deleted.")
     except Exception as e:
         print(f"Error deleting users: {e}")
-    finally:
-        conn.close()
 
 # Constants
 CURRENCY_FILE = "selected_currencies.json"
@@ -305,6 +492,17 @@ def get_current_exchange_rates():
         rates = {"USD": 1, "UAH": 36.8, "EUR": 0.94}  # Example fallback rates
     return rates
 
+def write_excel_report(df, file_path):
+    """Write an export frame to an .xlsx workbook with number-formatted amounts."""
+    with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name="Transactions")
+        worksheet = writer.sheets["Transactions"]
+        for col in worksheet.iter_cols(min_row=2, max_row=worksheet.max_row, min_col=1, max_col=len(df.columns)):
+            for cell in col:
+                if isinstance(cell.value, float):
+                    cell.number_format = "#,##0.00"
+    return file_path
+
 def load_selected_currencies():
     if os.path.exists(CURRENCY_FILE):
         with open(CURRENCY_FILE, 'r') as file:
@@ -354,6 +552,18 @@ class FinanceApp(tk.Tk):
         self.is_admin = False
         self.selected_color_scheme = tk.StringVar(value="Light")
         self.exchange_rates = get_current_exchange_rates()
+        self.exchange_rates_fetched_at = time.monotonic()
+        self.change_tracker = ChangeTracker()
+        # Database and network work started from the UI runs on these workers
+        self.tasks = TaskRunner(self)
+        self.transactions_future = None
+        self.planned_future = None
+        self.users_future = None
+        self.users_cursor = None
+        self.report_future = None
+        self.stale_tabs = set()
+        self.backup_job = None
+        self.compress_backups = tk.BooleanVar(value=True)
         self.selected_currencies = load_selected_currencies()
         self.balance_var = tk.StringVar(value="Balance: $0.00")
 
@@ -373,13 +583,18 @@ class FinanceApp(tk.Tk):
 
     def populate_planned_transactions(self):
         """Populate the planned transactions table in the Dashboard."""
+    # Fetch planned transactions for the current user or all (if admin)
+        self.tasks.cancel(self.planned_future)
+        self.planned_future = self.tasks.submit(
+            get_planned_transactions, self.user_id, is_admin=self.is_admin,
+            on_done=self.show_planned_transactions, group='dashboard'
+        )
+
+    def show_planned_transactions(self, planned_transactions):
     # Clear the tree view
         for row in self.tree_planned_transactions.get_children():
             self.tree_planned_transactions.delete(row)
 
-    # Fetch planned transactions for the current user or all (if admin)
-        planned_transactions = get_planned_transactions(self.user_id, is_admin=self.is_admin)
-
     # Populate the tree view
         for transaction in planned_transactions:
             self.tree_planned_transactions.insert(
@@ -585,30 +800,22 @@ class FinanceApp(tk.Tk):
             print(f"Conversion error: {e}")
             return None
 
+    def get_current_month_totals(self, trans_type):
+        """Per-currency totals of one transaction type for the current calendar month."""
+        now = pd.Timestamp.now()
+        start_day, end_day = month_bounds(now.year, now.month)
+        return get_totals_by_currency(self.user_id, trans_type, start_day, end_day, is_admin=self.is_admin)
+
     def get_monthly_income(self):
         """Calculate total income for the current month in USD, UAH, and EUR."""
-        transactions = get_transactions(self.user_id, is_admin=self.is_admin)
-        if not transactions:
-            return 0.0, 0.0, 0.0
-
-        df = pd.DataFrame(transactions)
-        df['Date'] = pd.to_datetime(df['date'], errors='coerce')
-        current_month = pd.Timestamp.now().month
-        current_year = pd.Timestamp.now().year
-
-        income_transactions = df[
-            (df['Date'].dt.month == current_month) &
-            (df['Date'].dt.year == current_year) &
-            (df['type'] == 'income')
-        ]
+        totals = self.get_current_month_totals('income')
 
         total_income_usd = 0.0
         total_income_uah = 0.0
         total_income_eur = 0.0
 
-        for _, row in income_transactions.iterrows():
-            amount = row['amount']
-            currency = row['currency']
+        # One conversion per currency instead of one per transaction
+        for currency, amount in totals.items():
             total_income_usd += self.convert_currency(amount, currency, "USD") or 0
             total_income_uah += self.convert_currency(amount, currency, "UAH") or 0
             total_income_eur += self.convert_currency(amount, currency, "EUR") or 0
@@ -617,28 +824,14 @@ class FinanceApp(tk.Tk):
 
     def get_monthly_expenses(self):
         """Calculate total expenses for the current month in USD, UAH, and EUR."""
-        transactions = get_transactions(self.user_id, is_admin=self.is_admin)
-        if not transactions:
-            return 0.0, 0.0, 0.0
-
-        df = pd.DataFrame(transactions)
-        df['Date'] = pd.to_datetime(df['date'], errors='coerce')
-        current_month = pd.Timestamp.now().month
-        current_year = pd.Timestamp.now().year
-
-        expense_transactions = df[
-            (df['Date'].dt.month == current_month) &
-            (df['Date'].dt.year == current_year) &
-            (df['type'] == 'expense')
-        ]
+        totals = self.get_current_month_totals('expense')
 
         total_expenses_usd = 0.0
         total_expenses_uah = 0.0
         total_expenses_eur = 0.0
 
-        for _, row in expense_transactions.iterrows():
-            amount = row['amount']
-            currency = row['currency']
+        # One conversion per currency instead of one per transaction
+        for currency, amount in totals.items():
             total_expenses_usd += self.convert_currency(amount, currency, "USD") or 0
             total_expenses_uah += self.convert_currency(amount, currency, "UAH") or 0
             total_expenses_eur += self.convert_currency(amount, currency, "EUR") or 0
@@ -807,7 +1000,7 @@ class FinanceApp(tk.Tk):
 
         ttk.Label(filter_frame, text="Category:").grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
         self.filter_category = tk.StringVar(value="All")
-        categories = ["All"] + list(set(t['category'] for t in get_transactions(self.user_id)))
+        categories = ["All"] + get_transaction_categories(self.user_id)
         ttk.Combobox(filter_frame, textvariable=self.filter_category, values=categories, state="readonly").grid(row=0, column=1, padx=5, pady=5)
 
         ttk.Label(filter_frame, text="Date Range:").grid(row=0, column=2, padx=5, pady=5, sticky=tk.W)
@@ -845,21 +1038,46 @@ class FinanceApp(tk.Tk):
     # Initialize Default Report (Bar Chart)
         self.update_report()
 
+    def load_report_frame(self, filters=None, is_admin=None):
+        """Load report transactions as a typed frame with Amount and Date columns."""
+        if is_admin is None:
+            is_admin = self.is_admin
+        df = load_transactions_frame(self.user_id, filters=filters, is_admin=is_admin)
+        return df.rename(columns={'amount': 'Amount', 'date': 'Date'})
+
+    def load_rollup_frame(self, filters=None, is_admin=None):
+        """Load monthly rollups for the month-level reports; Date is the month start."""
+        if is_admin is None:
+            is_admin = self.is_admin
+        df = load_monthly_rollups_frame(self.user_id, filters=filters, is_admin=is_admin)
+        return df.rename(columns={'date': 'Date'})
+
     def update_report(self, event=None):
         """Update the displayed report based on the selected type."""
         for widget in self.report_frame.winfo_children():
             widget.destroy()
 
-        transactions = get_transactions(self.user_id, is_admin=self.is_admin)
-        if not transactions:
+        report_type = self.report_type_var.get()
+        self.tasks.cancel(self.report_future)
+        self.report_future = self.tasks.submit(
+            self.load_report_data, report_type,
+            on_done=lambda df: self.show_report(df, report_type), group='reports'
+        )
+
+    def load_report_data(self, report_type):
+        """Load the frame for a report type; runs on a worker thread."""
+        # Month-level charts read the trigger-maintained rollups instead of
+        # the whole ledger
+        with ledger_snapshot(self.user_id, self.is_admin):
+            if report_type in ("Bar Chart", "Line Chart", "Heatmap"):
+                return self.load_rollup_frame()
+            return self.load_report_frame()
+
+    def show_report(self, df, report_type):
+        if df.empty:
             ttk.Label(self.report_frame, text="No data available to generate reports.", font=("Arial", 14)).pack(pady=20)
             return
 
-        df = pd.DataFrame(transactions)
-        df['Amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        df['Date'] = pd.to_datetime(df['date'], errors='coerce')
-
-        report_type = self.report_type_var.get()
         if report_type == "Bar Chart":
             self.plot_bar_chart(df)
         elif report_type == "Line Chart":
@@ -875,7 +1093,7 @@ class FinanceApp(tk.Tk):
         """Generate a bar chart showing monthly or yearly trends."""
         fig, ax = plt.subplots(figsize=(12, 6))
         df['Month'] = df['Date'].dt.to_period('M')
-        monthly_summary = df.groupby('Month')['Amount'].sum()
+        monthly_summary = sum_minor(df, by='Month')
         monthly_summary.plot(kind='bar', ax=ax, color='skyblue')
         ax.set_title("Monthly Financial Trends", fontsize=16)
         ax.set_xlabel("Month", fontsize=12)
@@ -890,7 +1108,7 @@ class FinanceApp(tk.Tk):
     def plot_line_chart(self, df):
         """Generate a line chart showing financial trends over time."""
         fig, ax = plt.subplots(figsize=(12, 6))
-        df.set_index('Date').resample('M')['Amount'].sum().plot(kind='line', ax=ax, color='green', marker='o')
+        sum_minor(df, by=df['Date'].dt.to_period('M')).plot(kind='line', ax=ax, color='green', marker='o')
         ax.set_title("Financial Trends Over Time", fontsize=16)
         ax.set_xlabel("Date", fontsize=12)
         ax.set_ylabel("Total Amount ($)", fontsize=12)
@@ -916,13 +1134,7 @@ class FinanceApp(tk.Tk):
         canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
 
     def plot_heatmap(self, df):
-        pivot_table = df.pivot_table(
-            index='category',
-            columns='type',
-            values='Amount',
-            aggfunc='sum',
-            fill_value=0
-        )
+        pivot_table = sum_minor(df, by=['category', 'type']).unstack(fill_value=0)
         fig, ax = plt.subplots(figsize=(14, 8))  # Larger size for better readability
         sns.heatmap(
             pivot_table,
@@ -946,16 +1158,12 @@ class FinanceApp(tk.Tk):
         comparison_type = self.comparison_type_var.get()
 
     # Fetch and process transactions
-        transactions = get_transactions(self.user_id, is_admin=self.is_admin)
-        if not transactions:
+        with ledger_snapshot(self.user_id, self.is_admin):
+            df = self.load_rollup_frame()
+        if df.empty:
             messagebox.showwarning("Warning", "No transactions found to generate comparisons.")
             return
 
-        df = pd.DataFrame(transactions)
-        df['Amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        df['Date'] = pd.to_datetime(df['date'], errors='coerce')
-        df = df.dropna(subset=['Amount', 'Date'])
-
         if comparison_type == "Monthly":
             self.generate_monthly_comparison(df)
         elif comparison_type == "Yearly":
@@ -967,7 +1175,7 @@ class FinanceApp(tk.Tk):
         """Generate comparison of categories over time."""
     # Group by category and month
         df['Month'] = df['Date'].dt.to_period('M')
-        category_totals = df.groupby(['Month', 'category'])['Amount'].sum().unstack(fill_value=0)
+        category_totals = sum_minor(df, by=['Month', 'category']).unstack(fill_value=0)
 
     # Plot category comparison as stacked bar chart
         fig, ax = plt.subplots(figsize=(12, 6))
@@ -983,7 +1191,7 @@ class FinanceApp(tk.Tk):
     def generate_monthly_comparison(self, df):
         """Generate monthly comparison report."""
         df['Month'] = df['Date'].dt.to_period('M').astype(str)
-        monthly_totals = df.groupby(['Month', 'type'])['Amount'].sum().unstack(fill_value=0)
+        monthly_totals = sum_minor(df, by=['Month', 'type']).unstack(fill_value=0)
 
     # Calculate percentage changes
         monthly_totals['Income Change (%)'] = monthly_totals.get('income', 0).pct_change() * 100
@@ -1236,19 +1444,18 @@ class FinanceApp(tk.Tk):
 
     def verify_user(username, password):
         """Verify user credentials and check if the user is an admin."""
-        conn, c = get_db_connection()
-        try:
+        with reader() as c:
             c.execute('SELECT id, password, is_admin FROM users WHERE username = ?', (username,))
             user = c.fetchone()
-            if user and bcrypt.checkpw(password.encode(), user[1]):
-                return user[0], bool(user[2])  # Return user ID and is_admin status
-            return None, False
-        finally:
-            conn.close()
+        if user and bcrypt.checkpw(password.encode(), user[1]):
+            return user[0], bool(user[2])  # Return user ID and is_admin status
+        return None, False
 
     def handle_successful_login(self, user_id, is_admin):
         self.user_id = user_id
         self.is_admin = is_admin
+        # Watch the directory database and the shards this user's views read
+        self.change_tracker = ChangeTracker(lambda: [get_manager(), *managers_for(user_id, is_admin)])
 
         self.login_frame.pack_forget()
         self.create_main_tab()  # Recreate tabs based on user role
@@ -1286,8 +1493,29 @@ class FinanceApp(tk.Tk):
         if self.is_admin:
             self.create_admin_tab()
 
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
         self.main_tab_frame.pack_forget()
 
+    def on_tab_changed(self, event=None):
+        """Cancel loads started by the tabs the user left, and redo them on return."""
+        selected = self.notebook.select()
+        for name, frame in self.tabs.items():
+            if str(frame) == selected:
+                if name in self.stale_tabs:
+                    self.stale_tabs.discard(name)
+                    self.reload_tab(name)
+            elif self.tasks.cancel_group(name):
+                self.stale_tabs.add(name)
+
+    def reload_tab(self, name):
+        if name == 'dashboard':
+            self.populate_transactions()
+            self.populate_planned_transactions()
+        elif name == 'reports':
+            self.update_report()
+        elif name == 'admin':
+            self.populate_user_tree()
+
     def create_currency_tools(self, parent):
         """Create a unified Currency Tools section."""
         currency_tools_frame = ttk.LabelFrame(parent, text="Currency Tools", padding=10)
@@ -1348,25 +1576,12 @@ class FinanceApp(tk.Tk):
         if self.user_id is None:
             return  # Skip calculation if no user is logged in
 
-    # Fetch transactions for the logged-in user or admin
-        transactions = get_transactions(self.user_id, is_admin=self.is_admin)
-        if not transactions:
+    # Group balances by currency (exact integer sums in SQLite)
+        balance_by_currency = get_balances_by_currency(self.user_id, is_admin=self.is_admin)
+        if not balance_by_currency:
             self.balance_var.set("No transactions available.")
             return
 
-    # Group balances by currency
-        balance_by_currency = {}
-        for transaction in transactions:
-            try:
-                amount = float(transaction['amount'])
-                currency = transaction['currency']
-                if transaction['type'] == 'income':
-                    balance_by_currency[currency] = balance_by_currency.get(currency, 0) + amount
-                elif transaction['type'] == 'expense':
-                    balance_by_currency[currency] = balance_by_currency.get(currency, 0) - amount
-            except (ValueError, KeyError):
-                print(f"Invalid transaction data: {transaction}")
-
     # Prepare balances in USD, UAH, and EUR
         total_balance_usd = sum(
             self.convert_currency(balance, currency, "USD") or 0
@@ -1625,7 +1840,7 @@ class FinanceApp(tk.Tk):
         filter_frame.pack(fill='x', padx=10, pady=10)
         ttk.Label(filter_frame, text="Category:").grid(row=0, column=0, padx=5, pady=5)
         self.filter_category = tk.StringVar(value="All")
-        categories = ["All"] + list(set(t['category'] for t in get_transactions(self.user_id)))
+        categories = ["All"] + get_transaction_categories(self.user_id)
         ttk.Combobox(filter_frame, textvariable=self.filter_category, values=categories).grid(row=0, column=1, padx=5, pady=5)
         ttk.Label(filter_frame, text="Date Range:").grid(row=0, column=2, padx=5, pady=5)
         self.filter_start_date = DateEntry(filter_frame, date_pattern='yyyy-mm-dd')
@@ -1635,21 +1850,18 @@ class FinanceApp(tk.Tk):
         ttk.Button(filter_frame, text="Apply Filters", command=self.apply_filters).grid(row=0, column=5, padx=5, pady=5)
 
     def generate_report(self):
-        transactions = get_transactions(self.user_id)
-        if not transactions:
+        df = self.load_report_frame(is_admin=False)
+        if df.empty:
             messagebox.showwarning("Warning", "No transactions found to generate the report.")
             return
 
-        df = pd.DataFrame(transactions)
-    # Process DataFrame: Ensure numeric amounts and valid dates
-        df['Amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        df['Date'] = pd.to_datetime(df['date'], errors='coerce')
-        df = df.dropna(subset=['Amount', 'Date'])
+    # Amounts are already numeric; drop rows without a valid date
+        df = df.dropna(subset=['Date'])
 
     # Generate and display summary or detailed reports based on user selection
         report_type = self.report_type_var.get()
         if report_type == "Overview":
-            summary = df.groupby('category')['Amount'].sum().reset_index()
+            summary = df.groupby('category', observed=True)['Amount'].sum().reset_index()
             print(summary)  # Replace with visualizations or GUI integration
         elif report_type == "Income vs Expenses":
             self.plot_income_vs_expenses(df)
@@ -1659,28 +1871,16 @@ class FinanceApp(tk.Tk):
     def apply_filters(self):
         """Apply filters to the transactions and update the chart."""
         try:
-            transactions = get_transactions(self.user_id, is_admin=self.is_admin)
-            if not transactions:
-                self.update_report_message("No transactions found for the selected filters.")
-                return
-
-        # Convert transactions to DataFrame
-            df = pd.DataFrame(transactions)
-
-        # Ensure valid data types
-            df['Date'] = pd.to_datetime(df['date'], errors='coerce')
-            df['Amount'] = pd.to_numeric(df['amount'], errors='coerce')
-            df = df.dropna(subset=['Date', 'Amount'])  # Drop rows with invalid dates or amounts
-
-        # Apply category filter
-            category_filter = self.filter_category.get()
-            if category_filter != "All":
-                df = df[df['category'] == category_filter]
-
-        # Apply date range filter
+        # Date range and category are pushed down to SQLite; the date range
+        # is an indexed day-number range
             start_date = pd.to_datetime(self.filter_start_date.get())
             end_date = pd.to_datetime(self.filter_end_date.get())
-            df = df[(df['Date'] >= start_date) & (df['Date'] <= end_date)]
+            category_filter = self.filter_category.get()
+            df = self.load_report_frame(filters={
+                'start_day': to_epoch_day(start_date),
+                'end_day': to_epoch_day(end_date) + 1,
+                'category': None if category_filter == "All" else category_filter,
+            })
 
         # Show filter summary
             self.display_filter_summary(category_filter, start_date, end_date)
@@ -1783,28 +1983,11 @@ class FinanceApp(tk.Tk):
             return
 
     # Fetch transactions for the admin or the user
-        transactions = get_transactions(self.user_id, is_admin=self.is_admin)
-        if not transactions:
+        df = self.load_report_frame()
+        if df.empty:
             messagebox.showwarning("Warning", "No transactions found to plot.")
             return
 
-    # Create a DataFrame and process data
-        df = pd.DataFrame(transactions)
-
-    # Debugging: Print DataFrame to identify issues
-        print("Transactions DataFrame:", df)
-
-    # Ensure 'amount' column contains only numeric values
-        try:
-            df['Amount'] = pd.to_numeric(df['amount'], errors='coerce')  # Convert non-numeric to NaN
-            df = df.dropna(subset=['Amount'])  # Drop rows with NaN in the 'Amount' column
-        except KeyError:
-            messagebox.showerror("Error", "Data is missing the 'amount' field.")
-            return
-
-    # Debugging: Print cleaned DataFrame
-        print("Cleaned DataFrame for plotting:", df)
-
     # Plot based on the selected plot type
         if self.plot_type.get() == "Line Chart":
             self.plot_line_chart(df)
@@ -1818,8 +2001,8 @@ class FinanceApp(tk.Tk):
     def plot_pie_or_bar_chart(self, df):
         expenses = df[df['type'] == 'expense']
         income = df[df['type'] == 'income']
-        exp_sums = expenses.groupby('category')['Amount'].sum()
-        inc_sums = income.groupby('category')['Amount'].sum()
+        exp_sums = expenses.groupby('category', observed=True)['Amount'].sum()
+        inc_sums = income.groupby('category', observed=True)['Amount'].sum()
         fig, ax = plt.subplots(1, 2, figsize=(12, 6))
         if self.plot_type.get() == "Pie Chart":
             exp_sums.plot(kind='pie', ax=ax[0], autopct='%1.1f%%')
@@ -1841,7 +2024,7 @@ class FinanceApp(tk.Tk):
 
     def plot_line_chart(self, df):
         fig, ax = plt.subplots(figsize=(10, 5))
-        df.groupby('date')['Amount'].sum().plot(ax=ax, kind='line')
+        sum_minor(df, by='Date').plot(ax=ax, kind='line')
         ax.set_title('Trends Over Time')
         ax.set_ylabel('Amount')
         canvas = FigureCanvasTkAgg(fig, master=self.report_frame)
@@ -1858,7 +2041,7 @@ class FinanceApp(tk.Tk):
         canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
 
     def plot_heatmap(self, df):
-        pivot_table = df.pivot_table(index='category', columns='type', values='Amount', aggfunc='sum', fill_value=0)
+        pivot_table = sum_minor(df, by=['category', 'type']).unstack(fill_value=0)
         fig, ax = plt.subplots(figsize=(10, 5))
         sns.heatmap(pivot_table, annot=True, fmt=".2f", cmap="YlGnBu", ax=ax)
         ax.set_title('Expense/Income Heatmap by Category')
@@ -1880,13 +2063,22 @@ class FinanceApp(tk.Tk):
         user_frame.grid(row=0, column=0, sticky='nsew', padx=10, pady=10)
 
     # Treeview and scrollbar
-        ttk.Label(user_frame, text="Manage Users:").grid(row=0, column=0, columnspan=4, sticky=tk.W, pady=5)
+        ttk.Label(user_frame, text="Manage Users:").grid(row=0, column=0, sticky=tk.W, pady=5)
+
+    # Search box; matching users load a page at a time as the list scrolls
+        self.user_search_var = tk.StringVar()
+        self.user_search_anywhere = tk.BooleanVar(value=False)
+        search_entry = ttk.Entry(user_frame, textvariable=self.user_search_var)
+        search_entry.grid(row=0, column=1, sticky='ew', pady=5, padx=5)
+        search_entry.bind("<Return>", lambda event: self.search_users())
+        ttk.Checkbutton(user_frame, text="Match Anywhere", variable=self.user_search_anywhere).grid(row=0, column=2, pady=5, padx=5)
+        ttk.Button(user_frame, text="Search", command=self.search_users).grid(row=0, column=3, pady=5, padx=5)
 
         self.tree_users = ttk.Treeview(
             user_frame,
             columns=("ID", "Username", "Admin Status"),
             show="headings",
-            selectmode="browse"
+            selectmode="extended"
         )
         for col in ("ID", "Username", "Admin Status"):
             self.tree_users.heading(col, text=col)
@@ -1894,9 +2086,9 @@ class FinanceApp(tk.Tk):
 
         self.tree_users.grid(row=1, column=0, columnspan=3, sticky='nsew', padx=5, pady=5)
 
-        user_scrollbar = ttk.Scrollbar(user_frame, orient=tk.VERTICAL, command=self.tree_users.yview)
-        self.tree_users.configure(yscrollcommand=user_scrollbar.set)
-        user_scrollbar.grid(row=1, column=3, sticky='ns')
+        self.user_scrollbar = ttk.Scrollbar(user_frame, orient=tk.VERTICAL, command=self.tree_users.yview)
+        self.tree_users.configure(yscrollcommand=self.on_users_scroll)
+        self.user_scrollbar.grid(row=1, column=3, sticky='ns')
 
     # Buttons for user actions
         ttk.Button(user_frame, text="Delete Selected User", command=self.delete_selected_users).grid(row=2, column=0, pady=5, padx=5)
@@ -1908,8 +2100,8 @@ class FinanceApp(tk.Tk):
         settings_frame = ttk.LabelFrame(frame_admin, text="System Settings", padding=10)
         settings_frame.grid(row=1, column=0, sticky='nsew', padx=10, pady=10)
 
-        ttk.Button(settings_frame, text="Backup Database", command=backup_database).grid(row=0, column=0, pady=5, padx=5)
-        ttk.Button(settings_frame, text="Restore Database", command=restore_database).grid(row=0, column=1, pady=5, padx=5)
+        ttk.Button(settings_frame, text="Backup Database", command=self.backup_database).grid(row=0, column=0, pady=5, padx=5)
+        ttk.Button(settings_frame, text="Restore Database", command=self.restore_database).grid(row=0, column=1, pady=5, padx=5)
 
     # Logout button
         ttk.Button(frame_admin, text="Logout", command=self.logout_admin).grid(row=2, column=0, sticky=tk.E, pady=10, padx=10)
@@ -1934,9 +2126,8 @@ class FinanceApp(tk.Tk):
         # Generate a new secret key
             secret_key, file_path = generate_and_save_secret_key(username, admin_id=self.user_id, is_admin=self.is_admin)
             if secret_key:
-                conn, c = get_db_connection()
-                c.execute('UPDATE users SET secret_key = ? WHERE id = ?', (secret_key, user_id))
-                conn.commit()
+                with write_transaction() as c:
+                    c.execute('UPDATE users SET secret_key = ? WHERE id = ?', (secret_key, user_id))
                 messagebox.showinfo("Success", f"Secret key for {username} regenerated and saved to {file_path}.")
         except Exception as e:
             logging.error(f"Error regenerating secret key: {e}")
@@ -1946,6 +2137,7 @@ class FinanceApp(tk.Tk):
         """Log out the admin and navigate back to the login screen."""
         self.user_id = None
         self.is_admin = False
+        self.tasks.cancel_group()  # Their widgets are about to go
 
     # Clear the main frame
         for widget in self.main_frame.winfo_children():
@@ -1963,28 +2155,13 @@ class FinanceApp(tk.Tk):
             self.refresh_users()
 
     def refresh_users(self):
-        """Refresh the list of users in the Treeview."""
-        try:
-            for row in self.user_tree.get_children():
-                self.user_tree.delete(row)
-
-            users = get_users()
-            for user in users:
-                is_admin = user.get('is_admin', 0)  # Default to 0 if not present
-                self.user_tree.insert('', 'end', values=(user['id'], user['username'], "Yes" if is_admin else "No"))
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to refresh user list: {e}")
+        """Clear the search and reload the list of users."""
+        self.user_search_var.set("")
+        self.populate_user_tree()
 
     def search_users(self):
-        """Search for users based on the search query."""
-        query = self.user_search_var.get().lower()
-        for row in self.user_tree.get_children():
-            self.user_tree.delete(row)
-
-        users = get_users()
-        filtered_users = [u for u in users if query in u['username'].lower()]
-        for user in filtered_users:
-            self.user_tree.insert('', 'end', values=(user['id'], user['username'], "Yes" if user['is_admin'] else "No"))
+        """Reload the list with the users matching the search box."""
+        self.populate_user_tree()
 
     def delete_selected_users(self):
         """Delete the selected users from the Treeview and database."""
@@ -2000,18 +2177,13 @@ class FinanceApp(tk.Tk):
         if not confirm:
             return
 
-        conn, c = get_db_connection()
         try:
+            delete_users([self.tree_users.item(item, "values")[0] for item in selected_items])
             for item in selected_items:
-                user_id = self.tree_users.item(item, "values")[0]  # Get the user ID
-                c.execute('DELETE FROM users WHERE id = ?', (user_id,))
                 self.tree_users.delete(item)  # Remove from Treeview
-            conn.commit()
             messagebox.showinfo("Success", "Selected user(s) deleted successfully!")
         except sqlite3.Error as e:
             messagebox.showerror("Error", f"Failed to delete user(s): {e}")
-        finally:
-            conn.close()
 
     def promote_user_to_admin(self):
         selected_items = self.tree_users.selection()
@@ -2019,15 +2191,8 @@ class FinanceApp(tk.Tk):
             messagebox.showwarning("Warning", "No users selected!")
             return
 
-        conn, c = get_db_connection()
-        try:
-            for item in selected_items:
-                user_id = self.tree_users.item(item, "values")[0]
-                c.execute("UPDATE users SET is_admin = 1 WHERE id = ?", (user_id,))
-            conn.commit()
-            messagebox.showinfo("Success", "Selected users promoted to admin.")
-        finally:
-            conn.close()
+        set_users_admin([self.tree_users.item(item, "values")[0] for item in selected_items], True)
+        messagebox.showinfo("Success", "Selected users promoted to admin.")
 
         self.populate_user_tree()  # Refresh user list
 
@@ -2037,54 +2202,51 @@ class FinanceApp(tk.Tk):
             messagebox.showwarning("Warning", "No users selected!")
             return
 
-        conn, c = get_db_connection()
-        try:
-            for item in selected_items:
-                user_id = self.tree_users.item(item, "values")[0]
-                c.execute("UPDATE users SET is_admin = 0 WHERE id = ?", (user_id,))
-            conn.commit()
-            messagebox.showinfo("Success", "Selected admins demoted to regular users.")
-        finally:
-            conn.close()
+        set_users_admin([self.tree_users.item(item, "values")[0] for item in selected_items], False)
+        messagebox.showinfo("Success", "Selected admins demoted to regular users.")
 
         self.populate_user_tree()  # Refresh user list
 
     def populate_user_tree(self):
-        """Populate the Treeview with user data."""
-    # Clear existing rows in the Treeview
+        """Populate the Treeview with the first page of users matching the search."""
+        self.tasks.cancel(self.users_future)
+        self.users_future = None
         for row in self.tree_users.get_children():
             self.tree_users.delete(row)
+        self.users_cursor = None
+        self.load_user_page()
 
-    # Fetch all users from the database
-        users = get_users()
-        if not users:
-            print("No users found in the database.")  # Debugging info
+    def load_user_page(self):
+        if self.tasks.pending(self.users_future):
             return
+        self.users_future = self.tasks.submit(
+            get_users_page, self.user_search_var.get(), after=self.users_cursor,
+            anywhere=self.user_search_anywhere.get(), on_done=self.show_user_page, group='admin'
+        )
 
-    # Populate the Treeview with user data
+    def show_user_page(self, page):
+        users, self.users_cursor = page
         for user in users:
             is_admin = "Yes" if user.get('is_admin', 0) else "No"
             self.tree_users.insert('', 'end', values=(user['id'], user['username'], is_admin))
 
+    def on_users_scroll(self, first, last):
+        """Keep the scrollbar in step and load the next page at the bottom."""
+        self.user_scrollbar.set(first, last)
+        if float(last) >= 1.0 and self.users_cursor is not None:
+            self.load_user_page()
+
     def generate_detailed_report(self):
-        transactions = get_transactions(self.user_id)
-        if not transactions:
+        with ledger_snapshot(self.user_id):
+            df = self.load_rollup_frame(is_admin=False)
+        if df.empty:
             messagebox.showwarning("Warning", "No transactions found to generate the report.")
             return
 
-        df = pd.DataFrame(transactions)
-        # Ensure 'amount' column is numeric and 'date' is valid
-        try:
-            df['Amount'] = pd.to_numeric(df['amount'], errors='coerce')
-            df['Date'] = pd.to_datetime(df['date'], errors='coerce')  # Convert invalid dates to NaT
-            df = df.dropna(subset=['Amount', 'Date'])  # Drop rows with NaN in 'Amount' or 'Date'
-        except KeyError:
-            messagebox.showerror("Error", "Data is missing required fields.")
-            return
-
 
         # Analyze trends and comparisons
-        monthly_summary = df.resample('M', on='Date').sum()
+        monthly_amounts = sum_minor(df, by=df['Date'].dt.to_period('M'))
+        monthly_summary = monthly_amounts.to_frame('Amount')
         monthly_summary['Month'] = monthly_summary.index.strftime('%B %Y')
 
         # Comparison with the previous period
@@ -2156,44 +2318,42 @@ class FinanceApp(tk.Tk):
             messagebox.showerror("Error", f"Failed to generate PDF report: {e}")
 
     def export_to_excel(self):
-        try:
-            transactions = get_transactions(self.user_id)
-            if not transactions:
-                messagebox.showwarning("Warning", "No transactions found to export.")
-                return
-
-            df = pd.DataFrame(transactions)
-
-        # Ensure proper data types
-            df['date'] = pd.to_datetime(df['date'], errors='coerce')
-            df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-            df = df.dropna(subset=['amount', 'date'])  # Drop invalid rows
-
-            file_path = filedialog.asksaveasfilename(
-                defaultextension=".xlsx",
-                filetypes=[("Excel files", "*.xlsx")],
-                title="Save Excel Report",
-                initialfile="transactions_report.xlsx"
+        # Loading and writing run on workers; only the dialogs use the Tk thread
+        self.tasks.submit(self.load_export_frame, on_done=self.save_excel_export,
+                          on_error=self.on_export_error, group='reports')
+
+    def load_export_frame(self):
+        # Read from a snapshot; the slow workbook write runs after it is released
+        with ledger_snapshot(self.user_id):
+            return load_transactions_frame(
+                self.user_id, columns=('id', 'type', 'amount', 'category', 'date', 'currency')
             )
 
-            if not file_path:
-                return  # User canceled
+    def save_excel_export(self, df):
+        if df.empty:
+            messagebox.showwarning("Warning", "No transactions found to export.")
+            return
 
-            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name="Transactions")
-                workbook = writer.book
-                worksheet = writer.sheets["Transactions"]
+        df = df.dropna(subset=['date'])  # Drop invalid rows
 
-            # Format columns
-                for col in worksheet.iter_cols(min_row=2, max_row=worksheet.max_row, min_col=1, max_col=len(df.columns)):
-                    for cell in col:
-                        if isinstance(cell.value, float):
-                            cell.number_format = "#,##0.00"
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".xlsx",
+            filetypes=[("Excel files", "*.xlsx")],
+            title="Save Excel Report",
+            initialfile="transactions_report.xlsx"
+        )
 
-            messagebox.showinfo("Success", f"Transactions exported successfully to {file_path}")
-        except Exception as e:
-            print(f"Error exporting to Excel: {e}")
-            messagebox.showerror("Error", f"Failed to export Excel report: {e}")
+        if not file_path:
+            return  # User canceled
+
+        self.tasks.submit(
+            write_excel_report, df, file_path, on_error=self.on_export_error,
+            on_done=lambda path: messagebox.showinfo("Success", f"Transactions exported successfully to {path}")
+        )
+
+    def on_export_error(self, e):
+        print(f"Error exporting to Excel: {e}")
+        messagebox.showerror("Error", f"Failed to export Excel report: {e}")
 
     def create_labeled_entry(self, parent, label_text, row, widget_type, **widget_options):
         ttk.Label(parent, text=label_text).grid(row=row, column=0, sticky=tk.W, padx=10, pady=5)
@@ -2211,13 +2371,93 @@ class FinanceApp(tk.Tk):
         color_scheme_menu = ttk.Combobox(frame_settings, textvariable=self.selected_color_scheme, values=list(self.color_schemes.keys()))
         color_scheme_menu.pack(pady=5)
         color_scheme_menu.bind("<<ComboboxSelected>>", lambda event: self.apply_color_scheme())
-        ttk.Button(frame_settings, text="Backup Database", command=backup_database).pack(pady=10)
-        ttk.Button(frame_settings, text="Restore Database", command=restore_database).pack(pady=10)
+        ttk.Label(frame_settings, text="Storage Profile:").pack(pady=5)
+        self.storage_profile_var = tk.StringVar(value=get_manager().profile)
+        storage_profile_menu = ttk.Combobox(frame_settings, textvariable=self.storage_profile_var, values=list(STORAGE_PROFILES.keys()), state="readonly")
+        storage_profile_menu.pack(pady=5)
+        storage_profile_menu.bind("<<ComboboxSelected>>", lambda event: self.apply_storage_profile())
+        self.commit_latency_var = tk.StringVar()
+        ttk.Label(frame_settings, textvariable=self.commit_latency_var).pack(pady=5)
+        ttk.Button(frame_settings, text="Measure Commit Latency", command=self.measure_commit_latency).pack(pady=5)
+        self.update_commit_latency()
+        ttk.Checkbutton(frame_settings, text="Compress Backups", variable=self.compress_backups).pack(pady=5)
+        ttk.Button(frame_settings, text="Backup Database", command=self.backup_database).pack(pady=10)
+        ttk.Button(frame_settings, text="Restore Database", command=self.restore_database).pack(pady=10)
         ttk.Button(frame_settings, text="Logout", command=self.logout).pack(pady=10)
 
     def apply_color_scheme(self):
         self.setup_styles()
 
+    def apply_storage_profile(self):
+        try:
+            set_storage_profile(self.storage_profile_var.get())
+        except (ValueError, OSError, sqlite3.Error) as e:
+            messagebox.showerror("Error", f"Failed to apply storage profile: {e}")
+        self.update_commit_latency()
+
+    def update_commit_latency(self):
+        """Show the commit latency measured on live commits under the active profile."""
+        manager = get_manager()
+        stats = manager.commit_latency()
+        if stats['count']:
+            self.commit_latency_var.set(
+                f"{manager.profile}: avg commit {stats['avg_ms']:.2f} ms over {stats['count']} commits"
+            )
+        else:
+            self.commit_latency_var.set(f"{manager.profile}: no commits measured yet")
+
+    def measure_commit_latency(self):
+        try:
+            results = benchmark_storage_profiles()
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("Error", f"Failed to measure commit latency: {e}")
+            return
+        message = "\n".join(f"{profile}: {latency:.2f} ms per commit" for profile, latency in results.items())
+        messagebox.showinfo("Commit Latency", message)
+        self.update_commit_latency()
+
+    def backup_database(self):
+        """Start an online backup on a background thread and show its progress."""
+        if self.backup_job is not None and not self.backup_job.done.is_set():
+            messagebox.showinfo("Backup", "A backup is already running.")
+            return
+        self.backup_job = BackupJob(compress=self.compress_backups.get()).start()
+        self.backup_window = tk.Toplevel(self)
+        self.backup_window.title("Database Backup")
+        ttk.Label(self.backup_window, text="Backing up database...").pack(padx=20, pady=10)
+        self.backup_progress = ttk.Progressbar(self.backup_window, length=300, maximum=100)
+        self.backup_progress.pack(padx=20, pady=10)
+        self.after(100, self.poll_backup)
+
+    def poll_backup(self):
+        job = self.backup_job
+        self.backup_progress['value'] = job.progress * 100
+        if not job.done.is_set():
+            self.after(100, self.poll_backup)
+            return
+        self.backup_window.destroy()
+        if job.error is not None:
+            print(f"Error creating database backup: {job.error}")
+            messagebox.showerror("Error", f"Failed to create database backup: {job.error}")
+        else:
+            messagebox.showinfo("Success", f"Database backup created: {job.path}")
+
+    def restore_database(self):
+        """Restore the newest backup generation over the live database."""
+        if not messagebox.askyesno("Restore Database", "Replace the current data with the latest backup?"):
+            return
+        try:
+            path = restore_database()
+        except Exception as e:
+            print(f"Error restoring database: {e}")
+            messagebox.showerror("Error", f"Failed to restore database: {e}")
+            return
+        # The restored counters may not line up with what was cached.
+        transaction_cache.invalidate()
+        self.change_tracker.reset()
+        self.refresh_data()
+        messagebox.showinfo("Success", f"Database restored from {path}")
+
     def update_font_size(self):
         new_size = self.font_size.get()
         self.style.configure('TLabel', font=("tahoma", new_size))
@@ -2277,19 +2517,25 @@ class FinanceApp(tk.Tk):
         if not self.validate_date(date):
             raise ValueError(f"Invalid date format: {date}. Use YYYY-MM-DD format.")
         
-        conn, c = get_db_connection()    
+        amount_minor = to_minor(amount, currency)
+        exponent = currency_exponent(currency)
+        date_day = to_epoch_day(date)
         try:
-        # Ensure the order of the values matches the schema: (type, amount, category, date, currency, user_id)        
-            c.execute(
-                'INSERT INTO transactions (type, amount, category, date, currency, user_id) VALUES (?, ?, ?, ?, ?, ?)',            
-                (trans_type, amount, category, date, currency, user_id)
-            )       
-            conn.commit()
+            manager = manager_for_user(user_id)
+            with manager.transaction() as c:
+                version_before = table_version(c, 'transactions')
+            # Ensure the order of the values matches the schema: (type, amount, category, date, currency, user_id)        
+                c.execute(
+                    'INSERT INTO transactions (type, amount, category, date, currency, user_id, amount_minor, currency_exponent, date_day) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',            
+                    (trans_type, from_minor(amount_minor, exponent), category, date, currency, user_id, amount_minor, exponent, date_day)
+                )
+                row = (c.lastrowid, trans_type, from_minor(amount_minor, exponent), category, date, currency,
+                       amount_minor, exponent, user_id, date_day)
+                versions = (manager.path, version_before, table_version(c, 'transactions'))
+            transaction_cache.upsert(transaction_dict(row), date_day, versions)
         except sqlite3.Error as e:        
             print(f"Error inserting transaction: {e}")
             messagebox.showerror("Database Error", f"Unable to insert transaction: {e}")    
-        finally:
-            conn.close()
 
     def on_transaction_select(self, event):
         try:
@@ -2346,18 +2592,25 @@ class FinanceApp(tk.Tk):
             self.calculate_balance()
 
     def modify_transaction(self, transaction_id, trans_type, amount, category, date, currency):
-        conn, c = get_db_connection()
+        amount_minor = to_minor(amount, currency)
+        exponent = currency_exponent(currency)
+        date_day = to_epoch_day(date)
         try:
-            c.execute(
-                'UPDATE transactions SET type=?, amount=?, category=?, date=?, currency=? WHERE id=?',
-                (trans_type, amount, category, date, currency, transaction_id)
-            )
-            conn.commit()
+            manager = manager_for_row(transaction_id)
+            with manager.transaction() as c:
+                version_before = table_version(c, 'transactions')
+                c.execute(
+                    'UPDATE transactions SET type=?, amount=?, category=?, date=?, currency=?, amount_minor=?, currency_exponent=?, date_day=? WHERE id=?',
+                    (trans_type, from_minor(amount_minor, exponent), category, date, currency, amount_minor, exponent, date_day, transaction_id)
+                )
+                c.execute(f'SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE id = ?', (transaction_id,))
+                row = c.fetchone()
+                versions = (manager.path, version_before, table_version(c, 'transactions'))
+            if row is not None:
+                transaction_cache.upsert(transaction_dict(row), row[9], versions)
         except sqlite3.Error as e:
             print(f"Error updating transaction: {e}")
             messagebox.showerror("Database Error", f"Unable to update transaction: {e}")
-        finally:
-            conn.close()
 
     def delete_transaction(self):
         if not hasattr(self, 'selected_transaction_id'):
@@ -2374,22 +2627,23 @@ class FinanceApp(tk.Tk):
             self.calculate_balance()
 
     def remove_transaction(self, transaction_id):
-        conn, c = get_db_connection()
         try:
-            c.execute('DELETE FROM transactions WHERE id=?', (transaction_id,))
-            conn.commit()
+            manager = manager_for_row(transaction_id)
+            with manager.transaction() as c:
+                version_before = table_version(c, 'transactions')
+                c.execute('DELETE FROM transactions WHERE id=?', (transaction_id,))
+                versions = (manager.path, version_before, table_version(c, 'transactions'))
+            transaction_cache.remove(transaction_id, versions)
         except sqlite3.Error as e:
             print(f"Error deleting transaction: {e}")
             messagebox.showerror("Database Error", f"Unable to delete transaction: {e}")
-        finally:
-            conn.close()
 
     def populate_transactions(self):
         """Populate the transaction table for all users if admin."""
         for row in self.tree_transactions.get_children():
             self.tree_transactions.delete(row)
 
-        transactions = get_transactions(self.user_id, is_admin=self.is_admin)
+        transactions, self.transactions_cursor = get_transactions_page(self.user_id, is_admin=self.is_admin)
         if not transactions:
             print("No transactions found.")
             return
@@ -2403,17 +2657,29 @@ class FinanceApp(tk.Tk):
                         transaction['category'], transaction['date'], transaction['currency'], user_column)
             )
 
-    # Fetch transactions for the logged-in user or all transactions for admin
+    # Fetch the newest page of transactions for the logged-in user or all
+    # transactions for admin; older pages load as the table is scrolled.
     def populate_transactions(self):    
+        self.tasks.cancel(self.transactions_future)
+        self.transactions_future = None
         for row in self.tree_transactions.get_children():
             self.tree_transactions.delete(row)
-        
-        transactions = get_transactions(self.user_id, is_admin=self.is_admin)    
-        if not transactions:
-            print("No transactions found or data structure is empty.")        
+        self.tree_transactions.configure(yscrollcommand=self.on_transactions_scroll)
+        self.transactions_cursor = None
+        self.load_transaction_page()
+
+    def load_transaction_page(self):
+        # One page in flight at a time; scroll events wait for it
+        if self.tasks.pending(self.transactions_future):
             return
+        self.transactions_future = self.tasks.submit(
+            get_transactions_page, self.user_id, is_admin=self.is_admin, after=self.transactions_cursor,
+            on_done=self.show_transaction_page, group='dashboard'
+        )
+
+    def show_transaction_page(self, page):
+        transactions, self.transactions_cursor = page
         for transaction in transactions:
-            print("Inserting transaction:", transaction)  # Debugging line        
             self.tree_transactions.insert('', 'end', values=(
                 transaction['id'],            
                 transaction['type'],
@@ -2423,6 +2689,11 @@ class FinanceApp(tk.Tk):
                 transaction['currency']
             ))
 
+    def on_transactions_scroll(self, first, last):
+        """Load the next page once the table is scrolled to its last row."""
+        if float(last) >= 1.0 and getattr(self, 'transactions_cursor', None) is not None:
+            self.load_transaction_page()
+
     def group_transactions_by_user(self, transactions):
         """Group transactions by user for admin view."""
         grouped = {}
@@ -2459,25 +2730,12 @@ class FinanceApp(tk.Tk):
         if self.user_id is None:
             return  # Skip calculation if no user is logged in
 
-    # Fetch transactions for the logged-in user or admin
-        transactions = get_transactions(self.user_id, is_admin=self.is_admin)
-        if not transactions:
+    # Group balances by currency (exact integer sums in SQLite)
+        balance_by_currency = get_balances_by_currency(self.user_id, is_admin=self.is_admin)
+        if not balance_by_currency:
             self.balance_var.set("No transactions available.")
             return
 
-    # Group balances by currency
-        balance_by_currency = {}
-        for transaction in transactions:
-            try:
-                amount = float(transaction['amount'])
-                currency = transaction['currency']
-                if transaction['type'] == 'income':
-                    balance_by_currency[currency] = balance_by_currency.get(currency, 0) + amount
-                elif transaction['type'] == 'expense':
-                    balance_by_currency[currency] = balance_by_currency.get(currency, 0) - amount
-            except (ValueError, KeyError):
-                print(f"Invalid transaction data: {transaction}")
-
     # Format the balance display
         balances = [f"{currency}: {balance:.2f}" for currency, balance in balance_by_currency.items()]
         self.balance_var.set(" | ".join(balances))
@@ -2499,29 +2757,24 @@ class FinanceApp(tk.Tk):
 
     def check_planned_transaction_reminders(self):
         """Check and remind about planned transactions occurring within the next 7 days."""
-        planned_transactions = get_planned_transactions(self.user_id, is_admin=self.is_admin)
-    
-    # Convert to DataFrame for easier manipulation
-        df = pd.DataFrame(planned_transactions)
-    
-        if not df.empty and 'planned_date' in df.columns:
-        # Ensure planned_date is in datetime format
-            df['Planned Date'] = pd.to_datetime(df['planned_date'], errors='coerce')
-            today = pd.Timestamp.now()
-            upcoming_plans = df[(df['Planned Date'] > today) & (df['Planned Date'] <= today + timedelta(days=7))]
-        
-            if not upcoming_plans.empty:
-                message = "You have the following planned transactions in the next 7 days:\n\n"
-                for _, row in upcoming_plans.iterrows():
-                    message += (
-                        f"- {row['type'].capitalize()} of {row['amount']} {row['currency']} "
-                        f"in category '{row['category']}' planned for {row['Planned Date'].strftime('%Y-%m-%d')}.\n"
-                    )
-                messagebox.showinfo("Planned Transactions Reminder", message)
-            else:
-                print("No planned transactions within the next 7 days.")
+    # Tomorrow through seven days ahead, as an indexed day-number range
+        today = today_epoch_day()
+        self.tasks.submit(
+            get_planned_transactions, self.user_id, is_admin=self.is_admin, start_day=today + 1, end_day=today + 8,
+            on_done=self.show_planned_transaction_reminders
+        )
+
+    def show_planned_transaction_reminders(self, upcoming_plans):
+        if upcoming_plans:
+            message = "You have the following planned transactions in the next 7 days:\n\n"
+            for row in upcoming_plans:
+                message += (
+                    f"- {row['type'].capitalize()} of {row['amount']} {row['currency']} "
+                    f"in category '{row['category']}' planned for {row['planned_date']}.\n"
+                )
+            messagebox.showinfo("Planned Transactions Reminder", message)
         else:
-            print("No planned transactions available or data structure is empty.")
+            print("No planned transactions within the next 7 days.")
 
     def logout(self):
         self.destroy()
@@ -2538,15 +2791,30 @@ class FinanceApp(tk.Tk):
             self.after(60000, self.auto_refresh_callback)
 
     def refresh_data(self):
-        self.exchange_rates = get_current_exchange_rates()
-        self.populate_transactions()
+        # Each stage runs only if its inputs changed since it last ran. The
+        # tracker costs one small read per database it watches.
+        if time.monotonic() - self.exchange_rates_fetched_at >= RATES_REFRESH_SECONDS:
+            self.exchange_rates_fetched_at = time.monotonic()
+            self.tasks.submit(get_current_exchange_rates, on_done=self.update_exchange_rates)
+        tracker = self.change_tracker
+        if tracker.changed('transactions', ('transactions',)):
+            self.populate_transactions()
+        if tracker.changed('balance', ('transactions',)):
+            self.calculate_balance()
+        today = today_epoch_day()
+        if tracker.changed('reminders', ('planned_transactions',)) or today != getattr(self, 'reminders_day', None):
+            self.reminders_day = today
+            self.check_planned_transaction_reminders()
+
+    def update_exchange_rates(self, rates):
+        self.exchange_rates = rates
         self.calculate_balance()
-        self.check_planned_transaction_reminders()
 
     def quit_app(self, event=None):
         """Gracefully exit the application."""
         if hasattr(self, "auto_refresh") and self.auto_refresh:
             self.auto_refresh.set()  # Stop the auto-refresh thread
+        self.tasks.shutdown()
         self.destroy()  # Properly destroy the Tkinter app
 
 class DeleteUserWindow(tk.Toplevel):
@@ -2593,20 +2861,15 @@ class DeleteUserWindow(tk.Toplevel):
 
     def remove_user(self, user_id):
         """Delete a user from the database by their user_id."""
-        conn, c = get_db_connection()
         try:
-            c.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            conn.commit()
+            delete_users([user_id])
             print(f"User with ID {user_id} deleted successfully.")
         except Exception as e:
             print(f"Error deleting user: {e}")
             messagebox.showerror("Error", f"Failed to delete user: {e}")
-        finally:
-            conn.close()
 
 if __name__ == "__main__":
-    init_db()
-    setup_admin_user()  # Ensure an admin user exists
+    init_db()  # Creates/updates tables and the admin user only when the schema is behind
     print("Starting FinanceApp...")
     app = FinanceApp()
     app.mainloop()
@@ -0,0 +1,496 @@
+"""Ordered schema migrations shared by main.py, database.py and create_db.py.
+
+``PRAGMA user_version`` holds the applied schema version, so a database that
+is already current costs a single PRAGMA read at startup. The
+``schema_version`` table keeps a history of what ran and when.
+"""
+import logging
+import secrets
+import sqlite3
+
+import bcrypt
+
+from connection import get_manager
+from dates import JULIAN_DAY_EPOCH, from_epoch_day, to_epoch_day
+from balances import create_balance_triggers, fill_balances
+from changes import TRACKED_TABLES, create_version_triggers
+from money import CURRENCY_EXPONENTS, DEFAULT_EXPONENT
+from rollups import create_rollup_triggers, fill_monthly_rollups
+
+MIGRATIONS = []
+DATE_CHUNK_SIZE = 5000
+
+
+def migration(version, name):
+    """Register a migration step; versions must be added in increasing order."""
+    def register(func):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"Migration {version} registered out of order.")
+        MIGRATIONS.append((version, name, func))
+        return func
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def table_columns(c, table):
+    c.execute(f"PRAGMA table_info({table})")
+    return [col[1] for col in c.fetchall()]
+
+
+def add_column(c, table, column, definition):
+    """Add a column with ALTER TABLE unless it is already there."""
+    if column not in table_columns(c, table):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def normalise_dates(c, table, date_column, day_column, chunk_size=DATE_CHUNK_SIZE):
+    """Rewrite dates that are not strict ISO text but parse the way the app reads them.
+
+    Uses dates.to_epoch_day(), so '2024-1-5' becomes '2024-01-05' with its
+    day number. Rows are walked in rowid order ``chunk_size`` at a time;
+    values that do not parse are left for data_quality.py to report.
+    Returns the number of rows rewritten.
+    """
+    days = {}
+    rewritten = 0
+    last_rowid = 0
+    while True:
+        c.execute(f"SELECT rowid, {date_column} FROM {table} WHERE rowid > ? "
+                  f"AND NOT ({date_column} IS NOT NULL AND date({date_column}, '+0 days') IS {date_column}) "
+                  f"ORDER BY rowid LIMIT ?", (last_rowid, chunk_size))
+        rows = c.fetchall()
+        if not rows:
+            return rewritten
+        last_rowid = rows[-1][0]
+        params = []
+        for rowid, value in rows:
+            if value not in days:
+                try:
+                    days[value] = to_epoch_day(value) if isinstance(value, str) else None
+                except ValueError:
+                    days[value] = None
+            if days[value] is not None:
+                params.append((from_epoch_day(days[value]), days[value], rowid))
+        c.executemany(f'UPDATE {table} SET {date_column} = ?, {day_column} = ? WHERE rowid = ?', params)
+        rewritten += len(params)
+
+
+@migration(1, "base schema")
+def _base_schema(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            secret_key TEXT NOT NULL,
+            is_admin INTEGER DEFAULT 0
+        )
+    ''')
+    # amount/category hold plain values from main.py or Fernet tokens from
+    # database.py; SQLite keeps either as written.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            date TEXT NOT NULL,
+            currency TEXT DEFAULT 'USD',
+            user_id INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS planned_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            planned_date TEXT NOT NULL,
+            currency TEXT DEFAULT 'USD',
+            user_id INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS goals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            target_amount REAL NOT NULL,
+            current_savings REAL DEFAULT 0,
+            deadline TEXT,
+            user_id INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS currencies (
+            code TEXT PRIMARY KEY,
+            rate REAL NOT NULL,
+            date TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS budgets (
+            category TEXT NOT NULL,
+            amount REAL NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, category),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS recurring_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            frequency TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            currency TEXT DEFAULT 'USD',
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+
+@migration(2, "users admin flag and secret key")
+def _users_admin_and_secret_key(c):
+    # Older databases predate these columns; add them in place rather than
+    # dropping the users table.
+    add_column(c, 'users', 'is_admin', 'INTEGER DEFAULT 0')
+    add_column(c, 'users', 'secret_key', "TEXT NOT NULL DEFAULT ''")
+    c.execute('UPDATE users SET is_admin = 0 WHERE is_admin IS NULL')
+    c.execute("SELECT id FROM users WHERE secret_key IS NULL OR secret_key = ''")
+    missing = [(secrets.token_hex(16), row[0]) for row in c.fetchall()]
+    c.executemany('UPDATE users SET secret_key = ? WHERE id = ?', missing)
+
+
+@migration(3, "admin user")
+def _admin_user(c):
+    c.execute("SELECT id FROM users WHERE username = 'admin'")
+    if not c.fetchone():
+        admin_password = bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        c.execute(
+            "INSERT INTO users (username, password, is_admin, secret_key) VALUES (?, ?, 1, ?)",
+            ("admin", admin_password, secrets.token_hex(16))
+        )
+        logging.info("Admin user created with username 'admin' and password 'admin123'.")
+
+
+@migration(4, "user-scoped and date-range indexes")
+def _user_scoped_indexes(c):
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_id, date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_type_date ON transactions (user_id, type, date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_planned_transactions_user_date ON planned_transactions (user_id, planned_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_categories_user_name ON categories (user_id, name)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_goals_user_name ON goals (user_id, name)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_recurring_transactions_user ON recurring_transactions (user_id)')
+
+
+@migration(5, "integer minor-unit amounts")
+def _integer_minor_amounts(c):
+    add_column(c, 'transactions', 'amount_minor', 'INTEGER')
+    add_column(c, 'transactions', 'currency_exponent', 'INTEGER')
+    # One set-based UPDATE per exponent. Encrypted amounts (BLOB tokens from
+    # database.py) stay NULL: their plaintext must not land in a clear column.
+    by_exponent = {}
+    for currency, exponent in CURRENCY_EXPONENTS.items():
+        by_exponent.setdefault(exponent, []).append(currency)
+    for exponent, currencies in by_exponent.items():
+        placeholders = ', '.join('?' for _ in currencies)
+        c.execute(f'''
+            UPDATE transactions
+            SET amount_minor = CAST(ROUND(amount * ?) AS INTEGER), currency_exponent = ?
+            WHERE typeof(amount) IN ('integer', 'real') AND currency IN ({placeholders})
+        ''', (10 ** exponent, exponent, *currencies))
+    known = ', '.join('?' for _ in CURRENCY_EXPONENTS)
+    c.execute(f'''
+        UPDATE transactions
+        SET amount_minor = CAST(ROUND(amount * ?) AS INTEGER), currency_exponent = ?
+        WHERE typeof(amount) IN ('integer', 'real')
+          AND (currency IS NULL OR currency NOT IN ({known}))
+    ''', (10 ** DEFAULT_EXPONENT, DEFAULT_EXPONENT, *CURRENCY_EXPONENTS))
+
+
+@migration(6, "integer epoch-day dates")
+def _epoch_day_dates(c):
+    add_column(c, 'transactions', 'date_day', 'INTEGER')
+    add_column(c, 'planned_transactions', 'planned_day', 'INTEGER')
+    # Well-formed YYYY-MM-DD values get their day number in SQL; other dates
+    # the app accepts are rewritten as ISO by normalise_dates(), and anything
+    # that does not parse is left NULL for data_quality.py to report.
+    c.execute('''
+        UPDATE transactions
+        SET date_day = CAST(julianday(date) - ? AS INTEGER)
+        WHERE date(date, '+0 days') = date
+    ''', (JULIAN_DAY_EPOCH,))
+    c.execute('''
+        UPDATE planned_transactions
+        SET planned_day = CAST(julianday(planned_date) - ? AS INTEGER)
+        WHERE date(planned_date, '+0 days') = planned_date
+    ''', (JULIAN_DAY_EPOCH,))
+    normalise_dates(c, 'transactions', 'date', 'date_day')
+    normalise_dates(c, 'planned_transactions', 'planned_date', 'planned_day')
+    # Range filters now run on the integer columns, so the text-date indexes
+    # from migration 4 are replaced rather than kept alongside.
+    c.execute('DROP INDEX IF EXISTS idx_transactions_user_date')
+    c.execute('DROP INDEX IF EXISTS idx_transactions_user_type_date')
+    c.execute('DROP INDEX IF EXISTS idx_planned_transactions_user_date')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_day ON transactions (user_id, date_day)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_type_day ON transactions (user_id, type, date_day)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_planned_transactions_user_day ON planned_transactions (user_id, planned_day)')
+
+
+@migration(7, "date index for paged admin listings")
+def _date_day_index(c):
+    # Keyset pages over all users walk (date_day, id) in index order.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_day ON transactions (date_day)')
+
+
+@migration(8, "trigger-maintained monthly rollups")
+def _monthly_rollups(c):
+    # month is 'YYYY-MM'; total is in minor units of the currency.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_rollups (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            currency_exponent INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, month, type, category, currency)
+        ) WITHOUT ROWID
+    ''')
+    create_rollup_triggers(c)
+    fill_monthly_rollups(c)
+
+
+@migration(9, "trigger-maintained balances")
+def _balances(c):
+    # amount is income minus expenses in minor units of the currency.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS balances (
+            user_id INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            currency_exponent INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, currency)
+        ) WITHOUT ROWID
+    ''')
+    create_balance_triggers(c)
+    fill_balances(c)
+
+
+@migration(10, "per-table modification counters")
+def _table_versions(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for table in TRACKED_TABLES:
+        c.execute('INSERT OR IGNORE INTO table_versions (name) VALUES (?)', (table,))
+        create_version_triggers(c, table)
+
+
+@migration(11, "case-insensitive username index and user search")
+def _user_search(c):
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE, id)')
+    # Substring search uses an FTS5 trigram index when SQLite was built with
+    # FTS5 (3.34+); without it main.get_users_page() falls back to LIKE.
+    try:
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts
+            USING fts5(username, content='users', content_rowid='id', tokenize='trigram')
+        ''')
+    except sqlite3.OperationalError as e:
+        logging.info(f"User substring index not created: {e}")
+        return
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_fts (rowid, username) VALUES (NEW.id, NEW.username);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', OLD.id, OLD.username);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_update AFTER UPDATE OF username ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', OLD.id, OLD.username);
+            INSERT INTO users_fts (rowid, username) VALUES (NEW.id, NEW.username);
+        END
+    ''')
+    c.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+# Tables whose rows belong to a user and go when the user is deleted.
+USER_OWNED_TABLES = (
+    'transactions', 'planned_transactions', 'categories', 'goals', 'budgets', 'recurring_transactions'
+)
+
+
+@migration(12, "cascade user deletes")
+def _cascade_user_deletes(c):
+    # ON DELETE CASCADE would mean rebuilding every user-owned table and
+    # turning on foreign_keys, which shards (no users rows) cannot satisfy.
+    # A trigger gives the same cascade through the user_id indexes.
+    deletes = ' '.join(f'DELETE FROM {table} WHERE user_id = OLD.id;' for table in USER_OWNED_TABLES)
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_users_cascade_delete AFTER DELETE ON users
+        BEGIN {deletes} END
+    ''')
+
+
+@migration(13, "sealed transaction rows")
+def _sealed_transaction_rows(c):
+    # One AES-GCM blob per row holding amount and category (see
+    # encryption.seal_row). Rows with Fernet tokens or plain values leave it NULL.
+    add_column(c, 'transactions', 'sealed', 'BLOB')
+
+
+@migration(14, "category blind index")
+def _category_blind_index(c):
+    # Keyed HMAC of an encrypted row's category (see encryption.blind_index),
+    # so category filters and grouping run in SQL. The key lives outside the
+    # database, so existing rows are indexed by database.index_categories().
+    add_column(c, 'transactions', 'category_bidx', 'BLOB')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_category_bidx ON transactions (user_id, category_bidx)')
+
+
+@migration(15, "day numbers for non-ISO dates")
+def _non_iso_dates(c):
+    # Databases that ran migration 6 before it parsed dates like the app
+    # still have these rows without a day number.
+    normalise_dates(c, 'transactions', 'date', 'date_day')
+    normalise_dates(c, 'planned_transactions', 'planned_date', 'planned_day')
+
+
+# Queries the application ships, registered by the builders that produce
+# them (see shipped_query()); check_query_plans() fails if any of them
+# needs a full table scan. Admin "all users" full listings and substring
+# user searches are not registered: they read every row by design.
+SHIPPED_QUERIES = {}
+
+# Tables small enough that a SCAN of them is fine. json_each is the list of
+# ids passed in as a parameter, not a table.
+SCAN_ALLOWED = ('currencies', 'table_versions', 'json_each')
+
+
+def shipped_query(name, *args, **kwargs):
+    """Decorator registering the query a builder returns for ``args`` under ``name``.
+
+    The builder returns ``(sql, params)`` and is what the app itself calls,
+    so the checked SQL cannot drift from the executed SQL.
+    """
+    def register(builder):
+        SHIPPED_QUERIES[name] = lambda: builder(*args, **kwargs)
+        return builder
+    return register
+
+
+def full_scans(c, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN lines that scan a table not in SCAN_ALLOWED.
+
+    Only SEARCH steps seek an index; a SCAN walks every row even when it
+    reads them from a (covering) index.
+    """
+    c.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    return [row[3] for row in c.fetchall()
+            if row[3].startswith('SCAN ') and row[3].split()[1] not in SCAN_ALLOWED]
+
+
+def check_query_plans(manager=None, queries=None):
+    """Raise RuntimeError if any shipped query plans a full table scan."""
+    manager = manager or get_manager()
+    queries = SHIPPED_QUERIES if queries is None else queries
+    failures = {}
+    with manager.reader() as c:
+        for name, build in queries.items():
+            scans = full_scans(c, *build())
+            if scans:
+                failures[name] = scans
+    if failures:
+        details = "; ".join(f"{name}: {', '.join(scans)}" for name, scans in failures.items())
+        raise RuntimeError(f"Full table scans in shipped queries: {details}")
+
+
+def current_version(c):
+    c.execute('PRAGMA user_version')
+    return c.fetchone()[0]
+
+
+def migrate(manager=None):
+    """Bring the database up to the latest schema version.
+
+    Returns the number of migrations applied. When the schema is already
+    current this is a single ``PRAGMA user_version`` read.
+    """
+    manager = manager or get_manager()
+    target = latest_version()
+    with manager.reader() as c:
+        if current_version(c) >= target:
+            return 0
+
+    applied = 0
+    for version, name, func in MIGRATIONS:
+        with manager.transaction() as c:
+            # Re-check under the writer lock in case another process migrated.
+            if current_version(c) >= version:
+                continue
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            func(c)
+            c.execute('INSERT OR REPLACE INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            c.execute(f'PRAGMA user_version = {int(version)}')
+        logging.info(f"Applied schema migration {version}: {name}")
+        applied += 1
+    if applied:
+        # New indexes or columns can change plans; check the registered queries.
+        try:
+            check_query_plans(manager)
+        except (RuntimeError, sqlite3.Error) as e:
+            logging.warning(f"Query plan check after migrating: {e}")
+    return applied
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    if '--check-plans' in sys.argv:
+        # The modules that run the queries register them on import, into the
+        # ``migrations`` module rather than this ``__main__`` copy of it.
+        import analytics  # noqa: F401
+        import database  # noqa: F401
+        import main  # noqa: F401
+        import shards  # noqa: F401
+        import migrations
+        migrations.check_query_plans()
+        print(f"All {len(migrations.SHIPPED_QUERIES)} shipped queries use an index.")
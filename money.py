@@ -0,0 +1,70 @@
+"""Fixed-point money helpers.
+
+Amounts are stored as integer minor units (cents, kopecks, ...) together with
+the currency's decimal exponent, so sums stay exact integers and only the
+final totals are scaled back to major units for display.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+DEFAULT_EXPONENT = 2
+
+# ISO 4217 minor-unit exponents for currencies that differ from the default
+# or that the app offers explicitly.
+CURRENCY_EXPONENTS = {
+    'USD': 2,
+    'UAH': 2,
+    'EUR': 2,
+    'GBP': 2,
+    'PLN': 2,
+    'CHF': 2,
+    'JPY': 0,
+    'KRW': 0,
+    'BHD': 3,
+    'KWD': 3,
+}
+
+
+def currency_exponent(currency):
+    return CURRENCY_EXPONENTS.get(currency, DEFAULT_EXPONENT)
+
+
+def to_minor(amount, currency):
+    """Convert a major-unit amount (str, int, float or Decimal) to integer minor units."""
+    exponent = currency_exponent(currency)
+    value = Decimal(str(amount)).scaleb(exponent)
+    return int(value.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor, exponent):
+    """Convert integer minor units back to a major-unit float."""
+    return minor / 10 ** exponent
+
+
+def minor_frame(df):
+    """Keep rows that carry minor units and give them int64 columns."""
+    df = df.dropna(subset=['amount_minor']).copy()
+    df['amount_minor'] = df['amount_minor'].astype('int64')
+    df['currency_exponent'] = df['currency_exponent'].fillna(DEFAULT_EXPONENT).astype('int64')
+    return df
+
+
+def major_amounts(df):
+    """Vectorised major-unit amounts for a frame prepared by minor_frame()."""
+    return df['amount_minor'] / (10.0 ** df['currency_exponent'])
+
+
+def sum_minor(df, by=None):
+    """Sum a frame's amounts exactly as integers, returning major units.
+
+    Rows are first rescaled to the largest exponent in the frame so mixed
+    exponents add up without rounding. ``by`` takes anything
+    ``DataFrame.groupby`` accepts; without it a single float is returned.
+    """
+    exponent = int(df['currency_exponent'].max()) if not df.empty else DEFAULT_EXPONENT
+    scaled = df['amount_minor'] * (10 ** (exponent - df['currency_exponent']))
+    if by is None:
+        return int(scaled.sum()) / 10 ** exponent
+    if isinstance(by, str) or not isinstance(by, (list, tuple)):
+        by = [by]
+    keys = [df[key] if isinstance(key, str) else key for key in by]
+    return scaled.groupby(keys, observed=True).sum() / 10 ** exponent
@@ -0,0 +1,104 @@
+"""Monthly transaction rollups kept current by SQLite triggers.
+
+monthly_rollups holds one row per (user, month, type, category, currency)
+with the exact minor-unit total and the number of transactions. Only rows
+with plain minor-unit amounts and a valid date_day are counted; encrypted
+rows from database.py have no readable amount and are left out.
+"""
+import logging
+
+from connection import get_manager
+from money import DEFAULT_EXPONENT
+
+ROLLUP_KEY = 'user_id, month, type, category, currency'
+
+
+def _month(row):
+    return f"strftime('%Y-%m', {row}.date_day * 86400, 'unixepoch')"
+
+
+def _qualifies(row):
+    return f"{row}.amount_minor IS NOT NULL AND {row}.date_day IS NOT NULL"
+
+
+def _add(row):
+    """Statement adding a transaction row to its rollup bucket."""
+    return f'''
+        INSERT INTO monthly_rollups (user_id, month, type, category, currency, currency_exponent, total, count)
+        SELECT {row}.user_id, {_month(row)}, {row}.type, {row}.category, COALESCE({row}.currency, 'USD'),
+               COALESCE({row}.currency_exponent, {DEFAULT_EXPONENT}), {row}.amount_minor, 1
+        WHERE {_qualifies(row)}
+        ON CONFLICT ({ROLLUP_KEY}) DO UPDATE SET total = total + excluded.total, count = count + 1;
+    '''
+
+
+def _remove(row):
+    """Statements taking a transaction row out of its rollup bucket."""
+    bucket = (f"user_id = {row}.user_id AND month = {_month(row)} AND type = {row}.type "
+              f"AND category = {row}.category AND currency = COALESCE({row}.currency, 'USD')")
+    return f'''
+        UPDATE monthly_rollups SET total = total - {row}.amount_minor, count = count - 1
+        WHERE {_qualifies(row)} AND {bucket};
+        DELETE FROM monthly_rollups WHERE {_qualifies(row)} AND {bucket} AND count <= 0;
+    '''
+
+
+ROLLUP_TRIGGERS = {
+    'trg_transactions_rollup_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_insert AFTER INSERT ON transactions
+        WHEN {_qualifies('NEW')}
+        BEGIN {_add('NEW')} END
+    ''',
+    'trg_transactions_rollup_update': f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_update
+        AFTER UPDATE OF user_id, type, category, currency, currency_exponent, amount_minor, date_day ON transactions
+        WHEN ({_qualifies('OLD')}) OR ({_qualifies('NEW')})
+        BEGIN {_remove('OLD')} {_add('NEW')} END
+    ''',
+    'trg_transactions_rollup_delete': f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_delete AFTER DELETE ON transactions
+        WHEN {_qualifies('OLD')}
+        BEGIN {_remove('OLD')} END
+    ''',
+}
+
+
+def create_rollup_triggers(c):
+    for sql in ROLLUP_TRIGGERS.values():
+        c.execute(sql)
+
+
+def fill_monthly_rollups(c):
+    """Recompute every rollup row from the transactions table."""
+    c.execute('DELETE FROM monthly_rollups')
+    c.execute(f'''
+        INSERT INTO monthly_rollups (user_id, month, type, category, currency, currency_exponent, total, count)
+        SELECT user_id, strftime('%Y-%m', date_day * 86400, 'unixepoch'), type, category,
+               COALESCE(currency, 'USD'), MAX(COALESCE(currency_exponent, {DEFAULT_EXPONENT})),
+               SUM(amount_minor), COUNT(*)
+        FROM transactions
+        WHERE amount_minor IS NOT NULL AND date_day IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+    ''')
+
+
+def rebuild_monthly_rollups(manager=None):
+    """Rebuild monthly_rollups in one transaction and return its row count."""
+    manager = manager or get_manager()
+    with manager.transaction() as c:
+        fill_monthly_rollups(c)
+        c.execute('SELECT COUNT(*) FROM monthly_rollups')
+        count = c.fetchone()[0]
+    logging.info(f"Rebuilt {count} monthly rollup row(s).")
+    return count
+
+
+if __name__ == "__main__":
+    import sys
+
+    from migrations import migrate
+
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    if '--rebuild' in sys.argv:
+        rebuild_monthly_rollups()
@@ -0,0 +1,149 @@
+"""Re-encrypt transactions after an encryption key rotation.
+
+encryption.rotate_key() adds a key to the ring and makes it active. New
+writes use it straight away and reads accept every key in the ring, so the
+app keeps working while older rows are moved over. reencrypt_transactions()
+walks ``transactions`` in id order, a batch at a time, and reseals every
+encrypted row that is not yet under the active key: sealed rows under an
+older key and rows still holding Fernet tokens alike, along with their
+category blind index. Each batch commits on its own and rows already under
+the active key are never selected, so an interrupted run picks up where it
+stopped when started again.
+"""
+import logging
+import threading
+
+import encryption
+from connection import get_manager
+from database import DEFAULT_BULK_BATCH_SIZE, SEALED_AMOUNT, SEALED_CATEGORY
+
+# Encrypted rows not yet sealed under the active key; takes _stale_params().
+_STALE_ROWS = '''
+    ((sealed IS NOT NULL AND substr(sealed, 1, ?) IS NOT ?)
+     OR (sealed IS NULL AND typeof(amount) = 'blob'))
+'''
+
+
+def _stale_params(prefix):
+    return (len(prefix), prefix)
+
+
+def count_stale_rows(manager=None):
+    """Number of encrypted transactions not yet under the active key."""
+    manager = manager or get_manager()
+    prefix = encryption.sealed_prefix(encryption.active_key_id)
+    with manager.reader() as c:
+        c.execute(f'SELECT COUNT(*) FROM transactions WHERE {_STALE_ROWS}', _stale_params(prefix))
+        return c.fetchone()[0]
+
+
+def _reseal(rows):
+    """New ``(amount, category, sealed, category_bidx)`` per row, None where the old data does not decrypt."""
+    sealed = [i for i, row in enumerate(rows) if row[3] is not None]
+    legacy = [i for i, row in enumerate(rows) if row[3] is None]
+    fields = [None] * len(rows)
+    opened, _ = encryption.open_rows([(rows[i][0], rows[i][3]) for i in sealed])
+    for i, value in zip(sealed, opened):
+        fields[i] = value
+    if legacy:
+        values, failed = encryption.decrypt_batch([rows[i][1] for i in legacy] + [rows[i][2] for i in legacy])
+        unreadable = {index % len(legacy) for index in failed}
+        for j, i in enumerate(legacy):
+            if j not in unreadable:
+                fields[i] = (values[j], values[len(legacy) + j])
+    return [None if value is None else (SEALED_AMOUNT, SEALED_CATEGORY, encryption.seal_row(row[0], *value),
+                                        encryption.blind_index(row[4], value[1]))
+            for row, value in zip(rows, fields)]
+
+
+def reencrypt_transactions(manager=None, batch_size=DEFAULT_BULK_BATCH_SIZE, after_id=0, progress=None, stop=None):
+    """Reseal every encrypted transaction under the active key.
+
+    ``progress(done)`` is called after each committed batch; setting the
+    ``stop`` event ends the run after the batch in flight. Rows changed by
+    the app between the read and the write are left for its own write,
+    which already used the active key. Returns ``(reencrypted, failed,
+    last_id)``; pass ``last_id`` back as ``after_id`` to resume a stopped
+    run without rescanning the rows before it.
+    """
+    manager = manager or get_manager()
+    prefix = encryption.sealed_prefix(encryption.active_key_id)
+    reencrypted = 0
+    failed = 0
+    last_id = after_id
+    while stop is None or not stop.is_set():
+        with manager.reader() as c:
+            c.execute(f'SELECT id, amount, category, sealed, user_id FROM transactions WHERE id > ? AND {_STALE_ROWS} '
+                      'ORDER BY id LIMIT ?', (last_id, *_stale_params(prefix), batch_size))
+            rows = c.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        params = [(*new, row[0], row[3], row[1]) for row, new in zip(rows, _reseal(rows)) if new is not None]
+        with manager.transaction() as c:
+            c.executemany('UPDATE transactions SET amount = ?, category = ?, sealed = ?, category_bidx = ? '
+                          'WHERE id = ? AND sealed IS ? AND amount IS ?', params)
+        reencrypted += len(params)
+        failed += len(rows) - len(params)
+        if progress is not None:
+            progress(reencrypted + failed)
+        logging.info(f"Re-encrypted transactions up to id {last_id}: {reencrypted} done, {failed} unreadable.")
+    # The cache only holds values of tokens the batches above replaced.
+    encryption.purge_decrypt_cache()
+    return reencrypted, failed, last_id
+
+
+class ReencryptionJob:
+    """Runs reencrypt_transactions() on a background thread.
+
+    Like backup.BackupJob, the Tk thread polls ``progress``, ``done``,
+    ``result`` and ``error``; ``cancel()`` stops it after the current batch.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self._stop = threading.Event()
+        self._total = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self._stop.set()
+
+    def _update(self, done):
+        self.progress = min(done / self._total, 1.0) if self._total else 1.0
+
+    def _run(self):
+        try:
+            self._total = count_stale_rows(self.options.get('manager'))
+            self.result = reencrypt_transactions(progress=self._update, stop=self._stop, **self.options)
+            if not self._stop.is_set():
+                self.progress = 1.0
+        except Exception as e:
+            logging.error(f"Re-encryption failed: {e}")
+            self.error = e
+        finally:
+            self.done.set()
+
+
+if __name__ == "__main__":
+    import sys
+
+    from migrations import migrate
+    from shards import all_managers
+
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    if '--rotate' in sys.argv:
+        print(f"Key {encryption.rotate_key()} is now active.")
+    # database.py writes to the directory database even when sharded.
+    for manager in dict.fromkeys([get_manager(), *all_managers()]):
+        reencrypted, failed, _ = reencrypt_transactions(manager)
+        print(f"{manager.path}: re-encrypted {reencrypted} transaction(s); {failed} could not be decrypted.")
@@ -0,0 +1,377 @@
+"""Optional per-user sharding of the ledger tables.
+
+By default everything lives in ``finance.db``. When ``sharding.json``
+exists, ``finance.db`` becomes the directory database that keeps ``users``
+(and the shared budgets, currencies and recurring tables), while each
+user's transactions, planned transactions, categories and goals live in
+one of ``buckets`` shared shard files, or in a file of their own when
+``buckets`` is null::
+
+    {"directory": "shards", "buckets": 16}
+
+Only MAX_OPEN_SHARDS shard files keep connections open at a time; the
+least recently used ones are closed and reopened on demand.
+
+Every shard numbers its rows from ``index << ID_BITS``, so ids stay unique
+across shards and the shard holding a row can be found from its id alone.
+Admin views fan out over every shard file and merge the results.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+
+import encryption
+from connection import ConnectionManager, get_manager, load_storage_profile
+from migrations import migrate, shipped_query, table_columns
+
+SHARDING_FILE = "sharding.json"
+DEFAULT_SHARD_DIR = "shards"
+SHARD_PREFIX = "shard"
+SHARDED_TABLES = ('transactions', 'planned_transactions', 'categories', 'goals')
+DEFAULT_BUCKETS = 16
+MAX_OPEN_SHARDS = 16
+
+# Low bits of a row id left for the row itself; the shard index sits above.
+ID_BITS = 40
+SPLIT_BATCH_SIZE = 1000
+
+
+def shard_file_index(path):
+    """Index of the shard file named like ``path``, or None if it does not name one."""
+    name = os.path.basename(path)
+    if not (name.startswith(SHARD_PREFIX + '_') and name.endswith('.db')):
+        return None
+    suffix = name[len(SHARD_PREFIX) + 1:-len('.db')]
+    return int(suffix) if suffix.isdigit() and int(suffix) > 0 else None
+
+
+def load_sharding():
+    """Return the settings saved in SHARDING_FILE, or None when unsharded."""
+    if not os.path.exists(SHARDING_FILE):
+        return None
+    try:
+        with open(SHARDING_FILE, 'r') as file:
+            settings = json.load(file)
+        return {
+            'directory': settings.get('directory') or DEFAULT_SHARD_DIR,
+            'buckets': settings.get('buckets', DEFAULT_BUCKETS),
+        }
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"Error reading sharding settings: {e}")
+        return None
+
+
+def save_sharding(directory=DEFAULT_SHARD_DIR, buckets=DEFAULT_BUCKETS):
+    with open(SHARDING_FILE, 'w') as file:
+        json.dump({'directory': directory, 'buckets': buckets}, file)
+
+
+class ShardRouter:
+    """Maps users and row ids to the ConnectionManager of their shard file.
+
+    Shard managers are opened, migrated and seeded on first use and kept
+    for the life of the router. Only the ``max_open`` most recently used
+    keep their connections; older ones release theirs when idle.
+    """
+
+    def __init__(self, directory=DEFAULT_SHARD_DIR, buckets=DEFAULT_BUCKETS, profile=None, max_open=MAX_OPEN_SHARDS):
+        if buckets is not None and buckets < 1:
+            raise ValueError("buckets must be at least 1")
+        self.directory = directory
+        self.buckets = buckets
+        self.profile = profile or load_storage_profile()
+        self.max_open = max_open
+        self._managers = {}
+        self._open = OrderedDict()  # Indexes whose managers may hold connections, oldest first
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def shard_index(self, user_id):
+        user_id = int(user_id)
+        return user_id if self.buckets is None else user_id % self.buckets + 1
+
+    def shard_path(self, index):
+        return os.path.join(self.directory, f'{SHARD_PREFIX}_{index}.db')
+
+    def manager(self, index):
+        if index < 1:
+            # Ids below 1 << ID_BITS belong to the directory database.
+            raise ValueError(f"No shard has index {index}.")
+        with self._lock:
+            manager = self._managers.get(index)
+            if manager is None:
+                manager = ConnectionManager(self.shard_path(index), profile=self.profile)
+                prepare_shard(manager, index)
+                self._managers[index] = manager
+            self._open[index] = manager
+            self._open.move_to_end(index)
+            self._trim()
+            return manager
+
+    def _trim(self):
+        # Managers still in use stay listed and are retried on the next trim.
+        for index in list(self._open)[:max(0, len(self._open) - self.max_open)]:
+            if self._open[index].release_idle():
+                del self._open[index]
+
+    def trim(self):
+        """Release idle connections of all but the ``max_open`` most recently used shards."""
+        with self._lock:
+            self._trim()
+
+    def manager_for_user(self, user_id):
+        return self.manager(self.shard_index(user_id))
+
+    def manager_for_row(self, row_id):
+        return self.manager(int(row_id) >> ID_BITS)
+
+    def indexes(self):
+        """Indexes of the shard files on disk, in order."""
+        paths = glob.glob(os.path.join(self.directory, f'{SHARD_PREFIX}_*.db'))
+        return sorted(index for index in map(shard_file_index, paths) if index is not None)
+
+    def managers(self):
+        """Yield managers for every shard file on disk, in index order.
+
+        Each is fetched as the caller reaches it, so a loop that finishes
+        with one shard before the next keeps at most ``max_open`` open.
+        """
+        for index in self.indexes():
+            yield self.manager(index)
+
+    def close(self):
+        with self._lock:
+            for manager in self._managers.values():
+                manager.close()
+            self._managers = {}
+            self._open.clear()
+
+
+def prepare_shard(manager, index):
+    """Bring a shard up to the current schema and start its ids at its offset.
+
+    Shards share the migrations of the directory database; the users rows
+    those create are removed, since users only live in the directory.
+    """
+    migrate(manager)
+    offset = index << ID_BITS
+    with manager.reader() as c:
+        c.execute('SELECT name, seq FROM sqlite_sequence')
+        sequences = dict(c.fetchall())
+    if all(sequences.get(table, 0) >= offset for table in SHARDED_TABLES) and 'users' not in sequences:
+        return
+    with manager.transaction() as c:
+        for table in SHARDED_TABLES:
+            seq = sequences.get(table)
+            if seq is None:
+                c.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, offset))
+            elif seq < offset:
+                c.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (offset, table))
+        c.execute('DELETE FROM users')
+        c.execute("DELETE FROM sqlite_sequence WHERE name = 'users'")
+
+
+_router = None
+_router_loaded = False
+_router_lock = threading.Lock()
+
+
+def configure_sharding(directory=DEFAULT_SHARD_DIR, buckets=DEFAULT_BUCKETS, profile=None):
+    """Switch sharding on with the given layout, or off when ``directory`` is None."""
+    global _router, _router_loaded
+    with _router_lock:
+        if _router is not None:
+            _router.close()
+        _router = ShardRouter(directory, buckets, profile) if directory is not None else None
+        _router_loaded = True
+        return _router
+
+
+def get_router():
+    """Return the shared ShardRouter, or None when sharding is off."""
+    global _router, _router_loaded
+    with _router_lock:
+        if not _router_loaded:
+            settings = load_sharding()
+            if settings is not None:
+                _router = ShardRouter(settings['directory'], settings['buckets'])
+            _router_loaded = True
+        return _router
+
+
+def manager_for_user(user_id):
+    """Manager holding ``user_id``'s ledger rows."""
+    router = get_router()
+    return router.manager_for_user(user_id) if router is not None else get_manager()
+
+
+def manager_for_row(row_id):
+    """Manager holding the ledger row with id ``row_id``."""
+    router = get_router()
+    return router.manager_for_row(row_id) if router is not None else get_manager()
+
+
+def all_managers():
+    """Managers for every database holding ledger rows; iterate it once."""
+    router = get_router()
+    return router.managers() if router is not None else [get_manager()]
+
+
+def managers_for(user_id, is_admin=False):
+    """Managers a user-scoped (or, for admins, every-user) query has to read."""
+    return all_managers() if is_admin else [manager_for_user(user_id)]
+
+
+@contextmanager
+def ledger_snapshot(user_id, is_admin=False, copy=False):
+    """connection.snapshot() over every database ``managers_for()`` returns.
+
+    Each shard is consistent on its own; shards are not pinned at one
+    common instant.
+    """
+    with ExitStack() as stack:
+        for manager in managers_for(user_id, is_admin):
+            stack.enter_context(manager.snapshot(copy))
+        yield
+    # An admin snapshot holds every shard open at once; let them go now.
+    router = get_router()
+    if router is not None:
+        router.trim()
+
+
+@shipped_query('delete user transactions', 'transactions', [1])
+def delete_users_query(table, user_ids):
+    return (f'DELETE FROM {table} WHERE user_id IN (SELECT value FROM json_each(?))',
+            (json.dumps([int(user_id) for user_id in user_ids]),))
+
+
+def delete_user_data(user_ids=None):
+    """Delete users' ledger rows from their shards, every user's when ``user_ids`` is None.
+
+    One transaction per shard touched. A no-op when unsharded, where the
+    cascade trigger on users already removed them.
+    """
+    router = get_router()
+    if router is None:
+        return
+    if user_ids is None:
+        for manager in router.managers():
+            clear_ledger(manager)
+        return
+    by_shard = {}
+    for user_id in user_ids:
+        by_shard.setdefault(router.shard_index(user_id), []).append(user_id)
+    for index, ids in by_shard.items():
+        with router.manager(index).transaction() as c:
+            for table in SHARDED_TABLES:
+                c.execute(*delete_users_query(table, ids))
+
+
+def clear_ledger(manager):
+    """Delete every row of the sharded tables in ``manager``'s database."""
+    with manager.transaction() as c:
+        for table in SHARDED_TABLES:
+            c.execute(f'DELETE FROM {table}')
+
+
+def _create_split_log(c):
+    # Directory row ids already copied into this shard, committed with the copies.
+    c.execute('CREATE TABLE IF NOT EXISTS split_moves ('
+              'source_table TEXT NOT NULL, source_id INTEGER NOT NULL, '
+              'PRIMARY KEY (source_table, source_id)) WITHOUT ROWID')
+
+
+def _reseal_for_shard(c, table, columns, rows):
+    """``rows`` with the ids the shard gives them, sealed blobs resealed for those ids.
+
+    A sealed blob is bound to its row id, so one copied as-is would not
+    open under its new id. Blobs that do not open under the old id either
+    are copied unchanged. Call inside the shard's write transaction.
+    """
+    c.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+    seq = c.fetchone()
+    sealed = columns.index('sealed') + 1
+    values = []
+    unreadable = 0
+    for new_id, row in enumerate(rows, (seq[0] if seq else 0) + 1):
+        row = list(row)
+        if row[sealed] is not None:
+            try:
+                row[sealed] = encryption.seal_row(new_id, *encryption.open_row(row[0], row[sealed]))
+            except ValueError:
+                unreadable += 1
+        values.append((new_id, *row[1:]))
+    if unreadable:
+        logging.warning(f"Copied {unreadable} {table} row(s) whose sealed data could not be decrypted.")
+    return values
+
+
+def split_into_shards(router=None, manager=None, batch_size=SPLIT_BATCH_SIZE):
+    """Move ledger rows out of the directory database into their shards.
+
+    Rows get new ids in their shard, and sealed transactions are resealed
+    for them. A user's rows are moved ``batch_size`` at a time: the batch
+    is copied into the shard together with a record of the directory ids
+    it came from, then exactly those ids are deleted from the directory.
+    Rows added while the split runs are never deleted uncopied. A split
+    interrupted between the copy and the delete is finished by running it
+    again, which skips the rows the shard has recorded and deletes them
+    from the directory; until then they are counted in both places.
+    Returns the number of rows moved.
+    """
+    router = router or get_router()
+    if router is None:
+        raise RuntimeError("Sharding is not configured.")
+    manager = manager or get_manager()
+    moved = 0
+    for table in SHARDED_TABLES:
+        with manager.reader() as c:
+            columns = [name for name in table_columns(c, table) if name != 'id']
+            c.execute(f'SELECT DISTINCT user_id FROM {table}')
+            user_ids = [row[0] for row in c.fetchall()]
+        column_list = ', '.join(columns)
+        placeholders = ', '.join('?' for _ in columns)
+        for user_id in user_ids:
+            shard = router.manager_for_user(user_id)
+            last_id = 0
+            while True:
+                with manager.reader() as c:
+                    c.execute(f'SELECT id, {column_list} FROM {table} WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?',
+                              (user_id, last_id, batch_size))
+                    rows = c.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                ids = json.dumps([row[0] for row in rows])
+                with shard.transaction() as c:
+                    _create_split_log(c)
+                    c.execute('SELECT source_id FROM split_moves '
+                              'WHERE source_table = ? AND source_id IN (SELECT value FROM json_each(?))', (table, ids))
+                    copied = {row[0] for row in c.fetchall()}
+                    pending = [row for row in rows if row[0] not in copied]
+                    if 'sealed' in columns:
+                        c.executemany(f'INSERT INTO {table} (id, {column_list}) VALUES (?, {placeholders})',
+                                      _reseal_for_shard(c, table, columns, pending))
+                    else:
+                        c.executemany(f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})',
+                                      [row[1:] for row in pending])
+                    c.executemany('INSERT INTO split_moves (source_table, source_id) VALUES (?, ?)',
+                                  [(table, row[0]) for row in pending])
+                with manager.transaction() as c:
+                    c.execute(f'DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+                moved += len(pending)
+        logging.info(f"Moved {table} rows of {len(user_ids)} user(s) into shards.")
+    return moved
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    if '--split' in sys.argv:
+        print(f"Moved {split_into_shards()} row(s) into shards.")
@@ -0,0 +1,89 @@
+"""Run database and network calls off the Tk main thread.
+
+TaskRunner submits plain functions (get_transactions, get_users,
+add_planned_transaction, ...) to a small thread pool and hands back the
+Future. Results are delivered to ``on_done`` / ``on_error`` callbacks on the
+Tk thread: one ``after()`` loop polls the outstanding futures while there
+are any. Tasks carry an optional group name (the app uses the notebook tab
+they belong to) so everything a view started can be cancelled when the
+user leaves it.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 4
+DEFAULT_POLL_MS = 50
+
+
+class TaskRunner:
+    """Thread pool whose results come back through Tk's event loop."""
+
+    def __init__(self, widget, max_workers=DEFAULT_WORKERS, poll_ms=DEFAULT_POLL_MS):
+        self._widget = widget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='finance-task')
+        self._poll_ms = poll_ms
+        self._pending = {}  # Future -> (on_done, on_error, group)
+        self._polling = False
+
+    def submit(self, func, *args, on_done=None, on_error=None, group=None, **kwargs):
+        """Run ``func(*args, **kwargs)`` on a worker and return its Future.
+
+        ``on_done(result)`` or ``on_error(exception)`` is called on the Tk
+        thread once it finishes, unless the task was cancelled first.
+        """
+        future = self._executor.submit(func, *args, **kwargs)
+        self._pending[future] = (on_done, on_error, group)
+        if not self._polling:
+            self._polling = True
+            self._widget.after(self._poll_ms, self._poll)
+        return future
+
+    def cancel(self, future):
+        """Cancel one task; if it is already running its result is dropped."""
+        if future is None or self._pending.pop(future, None) is None:
+            return False
+        future.cancel()
+        return True
+
+    def cancel_group(self, group=None):
+        """Cancel every task in ``group``, or every task when it is None.
+
+        Returns the number of tasks cancelled.
+        """
+        futures = [future for future, (_, _, task_group) in self._pending.items()
+                   if group is None or task_group == group]
+        for future in futures:
+            self.cancel(future)
+        return len(futures)
+
+    def pending(self, future):
+        """True until ``future``'s callbacks have run or it was cancelled."""
+        return future in self._pending
+
+    def _poll(self):
+        finished = [future for future in self._pending if future.done()]
+        for future in finished:
+            callbacks = self._pending.pop(future, None)
+            if callbacks is None or future.cancelled():
+                continue
+            on_done, on_error, _ = callbacks
+            error = future.exception()
+            try:
+                if error is not None:
+                    if on_error is None:
+                        logging.error(f"Background task failed: {error}")
+                    else:
+                        on_error(error)
+                elif on_done is not None:
+                    on_done(future.result())
+            except Exception as e:
+                logging.error(f"Background task callback failed: {e}")
+        if self._pending:
+            self._widget.after(self._poll_ms, self._poll)
+        else:
+            self._polling = False
+
+    def shutdown(self):
+        """Cancel everything outstanding and stop the workers without waiting."""
+        self.cancel_group()
+        self._executor.shutdown(wait=False, cancel_futures=True)